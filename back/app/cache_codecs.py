@@ -0,0 +1,179 @@
+# cache_codecs.py
+"""Кодеки ответов в кэше Redis: сериализация + сжатие.
+
+Значение в Redis - заголовок из трех байт (b'\\x00', код сериализатора,
+код сжатия) и тело, поэтому оно читается независимо от текущих настроек;
+значение без заголовка - прежний формат (JSON-текст). Сжимаются тела
+не меньше CACHE_COMPRESS_MIN_BYTES.
+
+Кодек задается строкой 'сериализатор+сжатие', например 'orjson+zstd'
+или 'msgpack'. orjson, msgpack, zstandard и lz4 необязательны: недоступный
+сериализатор заменяется на JSON, недоступное сжатие - на zlib.
+"""
+import os
+import json
+import zlib
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from typing import Callable, NamedTuple, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+# Кодек по умолчанию (пусто - лучший из установленных)
+CACHE_CODEC = os.getenv('CACHE_CODEC', '')
+# Тела меньше порога хранятся без сжатия
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', str(64 * 1024)))
+
+HEADER_MARK = b'\x00'
+ZLIB_LEVEL = 1
+ZSTD_LEVEL = 3
+
+
+def _json_default(obj):
+    """datetime/date/time -> ISO-строка, Decimal -> число, timedelta -> секунды,
+    как в ответах FastAPI (jsonable_encoder)"""
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+def dumps_json(data) -> bytes:
+    """JSON (UTF-8) для тела ответа"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=_json_default, ensure_ascii=False).encode('utf-8')
+
+
+def loads_json(payload: bytes):
+    return orjson.loads(payload) if orjson is not None else json.loads(payload)
+
+
+class Serializer(NamedTuple):
+    code: bytes
+    dumps: Callable
+    loads: Callable
+    # Тело - готовый JSON ответа (после распаковки отдается как есть)
+    is_json: bool
+
+
+class Compressor(NamedTuple):
+    code: bytes
+    compress: Callable
+    decompress: Callable
+
+
+SERIALIZERS = {
+    'json': Serializer(
+        b'j', lambda data: json.dumps(data, default=_json_default, ensure_ascii=False).encode('utf-8'),
+        json.loads, True
+    ),
+}
+if orjson is not None:
+    SERIALIZERS['orjson'] = Serializer(b'o', dumps_json, orjson.loads, True)
+if msgpack is not None:
+    SERIALIZERS['msgpack'] = Serializer(
+        b'm', lambda data: msgpack.packb(data, default=_json_default, use_bin_type=True),
+        lambda payload: msgpack.unpackb(payload, raw=False, strict_map_key=False), False
+    )
+
+COMPRESSORS = {
+    'none': Compressor(b'-', bytes, bytes),
+    'zlib': Compressor(b'z', lambda body: zlib.compress(body, ZLIB_LEVEL), zlib.decompress),
+}
+if zstandard is not None:
+    COMPRESSORS['zstd'] = Compressor(
+        # Объекты zstandard не потокобезопасны - создаются на каждый вызов
+        b's', lambda body: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body),
+        lambda body: zstandard.ZstdDecompressor().decompress(body)
+    )
+if lz4_frame is not None:
+    COMPRESSORS['lz4'] = Compressor(b'l', lz4_frame.compress, lz4_frame.decompress)
+
+_SERIALIZER_BY_CODE = {serializer.code: serializer for serializer in SERIALIZERS.values()}
+_COMPRESSOR_BY_CODE = {compressor.code: compressor for compressor in COMPRESSORS.values()}
+
+
+def default_codec_name() -> str:
+    serializer = 'orjson' if 'orjson' in SERIALIZERS else 'json'
+    compressor = next(name for name in ('zstd', 'lz4', 'zlib') if name in COMPRESSORS)
+    return f"{serializer}+{compressor}"
+
+
+class Codec:
+    """Сериализатор + сжатие (для тел от min_bytes)"""
+
+    def __init__(self, serializer: str, compressor: str, min_bytes: int = None):
+        self.name = f"{serializer}+{compressor}"
+        self.serializer = SERIALIZERS[serializer]
+        self.compressor = COMPRESSORS[compressor]
+        self.min_bytes = CACHE_COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+
+    def encode(self, data) -> Tuple[bytes, bytes]:
+        """(JSON для ответа, значение для Redis)"""
+        body = self.serializer.dumps(data)
+        response = body if self.serializer.is_json else dumps_json(data)
+        compressor = self.compressor if len(body) >= self.min_bytes else COMPRESSORS['none']
+        return response, HEADER_MARK + self.serializer.code + compressor.code + compressor.compress(body)
+
+
+@lru_cache(maxsize=None)
+def get_codec(name: str = None) -> Codec:
+    """Кодек по строке 'сериализатор+сжатие'; недоступные части заменяются"""
+    name = name or CACHE_CODEC or default_codec_name()
+    serializer, _, compressor = name.partition('+')
+    compressor = compressor or 'none'
+    if serializer not in SERIALIZERS:
+        logger.warning(f"Сериализатор {serializer} недоступен, используется JSON")
+        serializer = 'orjson' if 'orjson' in SERIALIZERS else 'json'
+    if compressor not in COMPRESSORS:
+        logger.warning(f"Сжатие {compressor} недоступно, используется zlib")
+        compressor = 'zlib'
+    return Codec(serializer, compressor)
+
+
+def _unpack(stored: bytes):
+    """(сериализатор, тело после распаковки); сериализатор None - прежний формат"""
+    if not stored.startswith(HEADER_MARK):
+        return None, stored
+    serializer = _SERIALIZER_BY_CODE[stored[1:2]]
+    return serializer, _COMPRESSOR_BY_CODE[stored[2:3]].decompress(stored[3:])
+
+
+def decode_payload(stored: bytes) -> bytes:
+    """Значение из Redis -> JSON для тела ответа"""
+    serializer, body = _unpack(stored)
+    if serializer is None or serializer.is_json:
+        return body
+    return dumps_json(serializer.loads(body))
+
+
+def decode_data(stored: bytes):
+    """Значение из Redis -> данные"""
+    serializer, body = _unpack(stored)
+    if serializer is None:
+        return loads_json(body)
+    return serializer.loads(body)
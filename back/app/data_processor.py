@@ -1,18 +1,88 @@
 # data_processor.py
+import os
+import hashlib
 import pandas as pd
 import re
 import unicodedata
 import logging
-from datetime import datetime
 from sqlalchemy import create_engine, inspect, text, types as sa_types
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
+from shr_decoder import decode_shr_frame_parallel, OUTPUT_COLUMNS
+from shr_cache import get_shr_cache
+from pg_copy import copy_dataframe
+from flight_parsers import convert_coord_series
+from schema_registry import schema_registry
+from region_rollup import (ROLLUP_SOURCE_COLUMNS, rollup_table_name, build_rollup,
+                           replace_rollup, insert_with_rollup)
+from dependencies import bump_dataset_version
+
+# Сколько подмена таблицы ждет блокировку, прежде чем отказаться
+TABLE_SWAP_LOCK_TIMEOUT = os.getenv('TABLE_SWAP_LOCK_TIMEOUT', '5s')
+
+# Режим загрузки по умолчанию: replace - таблица пересобирается через staging
+# и подменяется целиком; upsert (LOAD_MODE=upsert или mode=upsert у загрузки) -
+# новые строки дописываются в живую таблицу, уже загруженные (по естественному
+# ключу) пропускаются
+LOAD_MODES = ('upsert', 'replace')
+LOAD_MODE = os.getenv('LOAD_MODE', 'replace')
+
+# Строк в одной пачке при заполнении новых типизированных колонок у уже
+# загруженных строк (upsert в таблицу, собранную до их появления)
+TYPED_BACKFILL_ROWS = int(os.getenv('TYPED_BACKFILL_ROWS', '50000'))
+
+# Естественный ключ строки и колонка с названием листа-источника
+ROW_KEY_COLUMN = 'row_key'
+SOURCE_SHEET_COLUMN = 'source_sheet'
+
+# Типизированные колонки, которые один раз выводятся из текстовых при загрузке
+# (departure_time / arrival_time 'HH:MM:SS', dof 'DDMMYY'); тип в БД задан явно,
+# чтобы не зависеть от того, заполнена ли колонка в конкретном блоке
+TYPED_COLUMN_TYPES = {
+    'dep_time': sa_types.Time,
+    'arr_time': sa_types.Time,
+    'flight_date': sa_types.Date,
+    'departure_at': sa_types.TIMESTAMP,
+    'duration_minutes': sa_types.Float,
+    'dep_lat': sa_types.Float,
+    'dep_lon': sa_types.Float,
+    'dest_lat': sa_types.Float,
+    'dest_lon': sa_types.Float,
+}
+
+# Колонки координат (DDMMN/DDDMME) -> колонки широты и долготы
+COORDINATE_COLUMNS = {
+    'dep_1': ('dep_lat', 'dep_lon'),
+    'dest': ('dest_lat', 'dest_lon'),
+}
+
+
+# Результат pd.api.types.infer_dtype для object-колонок -> тип pandas;
+# смешанные и прочие значения остаются текстом
+OBJECT_INFERRED_TYPES = {
+    'integer': 'int64',
+    'floating': 'float64',
+    'mixed-integer-float': 'float64',
+    'boolean': 'bool',
+    'datetime': 'datetime64[ns]',
+    'datetime64': 'datetime64[ns]',
+}
+
+
+class DuplicateRowKeysError(ValueError):
+    """В живой таблице есть повторы по row_key - загрузка upsert невозможна"""
+
 
 class DataProcessor:
     """Упрощенный обработчик данных с добавлением уникальных ID"""
 
-    def __init__(self, db_connection_string=None, db_session=None):
-        """Инициализация с подключением к базе данных или существующей сессией"""
+    def __init__(self, db_connection_string=None, db_session=None,
+                 decode_workers=None, parallel_min_rows=None):
+        """Инициализация с подключением к базе данных или существующей сессией.
+
+        decode_workers / parallel_min_rows - параметры параллельной дешифровки SHR
+        (по умолчанию SHR_DECODE_WORKERS и SHR_PARALLEL_MIN_ROWS из окружения).
+        """
         if db_session:
             self.db = db_session
             self.engine = db_session.bind
@@ -21,6 +91,9 @@ class DataProcessor:
             self.db = None
         else:
             raise ValueError("Необходимо указать либо db_connection_string, либо db_session")
+
+        self.decode_workers = decode_workers
+        self.parallel_min_rows = parallel_min_rows
             
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
@@ -83,15 +156,20 @@ class DataProcessor:
         return cleaned_names[0] if cleaned_names else 'unknown_sheet'
 
     @staticmethod
-    def clean_dataframe(df):
-        """Очистка DataFrame от пустых строк и колонок"""
+    def clean_dataframe(df, drop_empty_columns=True):
+        """Очистка DataFrame от пустых строк и колонок
+
+        drop_empty_columns=False - для блоков потокового чтения: колонка, пустая
+        в одном блоке, может быть заполнена в следующем.
+        """
         if df.empty:
             return df
 
         original_columns = df.columns.tolist()
         df.columns = DataProcessor.clean_column_names(df.columns)
         df = df.dropna(how='all')
-        df = df.dropna(axis=1, how='all')
+        if drop_empty_columns:
+            df = df.dropna(axis=1, how='all')
         df = df.where(pd.notnull(df), None)
 
         return df
@@ -112,232 +190,642 @@ class DataProcessor:
 
         dtypes = {}
         for col in df.columns:
+            if col in TYPED_COLUMN_TYPES:
+                dtypes[col] = TYPED_COLUMN_TYPES[col]
+                continue
+
             pandas_type = str(df[col].dtype)
 
             if pandas_type == 'object':
-                non_null_values = df[col].dropna()
-                if not non_null_values.empty:
-                    sample_value = non_null_values.iloc[0]
-                    if isinstance(sample_value, (int, float)):
-                        pandas_type = 'float64' if isinstance(sample_value, float) else 'int64'
-                    elif isinstance(sample_value, bool):
-                        pandas_type = 'bool'
-                    elif isinstance(sample_value, datetime):
-                        pandas_type = 'datetime64[ns]'
+                # Тип - по всем значениям колонки, а не по первому
+                pandas_type = OBJECT_INFERRED_TYPES.get(pd.api.types.infer_dtype(df[col], skipna=True), 'object')
 
             postgres_type = type_mapping.get(pandas_type, sa_types.Text)
             dtypes[col] = postgres_type
 
         return dtypes
 
-    def decode_flight_plan_fields(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Дешифрует сырые данные из полей сообщения о плане запуска"""
+    @staticmethod
+    def _none_for_missing(values: pd.Series) -> pd.Series:
+        return values.astype(object).where(values.notna(), None)
+
+    @staticmethod
+    def add_typed_columns(df):
+        """
+        Добавляет типизированные колонки (TYPED_COLUMN_TYPES) по очищенным
+        departure_time, arrival_time, dof и координатам dep_1/dest - векторно,
+        без разбора по строкам.
+
+        duration_minutes - как parse_flight_duration: посадка после полуночи
+        дает +24 ч; departure_at - дата полета (DOF) + время вылета;
+        dep_lat/dep_lon и dest_lat/dest_lon - как convert_coord.
+        Некорректные значения становятся NULL.
+        """
         if df.empty:
             return df
 
-        df = df.copy()
-
-        prefixes = [
-            'DOF/', 'STS/', 'DEP/', 'DEST/', 'TYP/', 'REG/',
-            'EET/', 'OPR/', 'ORGN/', 'PER/', 'DLE/'
-        ]
-
-        for prefix in prefixes:
-            df[prefix.strip('/')] = None
-        df['RMK'] = None
-        df['departure_time'] = None
-        df['arrival_time'] = None
-        df['flight_level'] = None
-        df['flight_zone'] = None
-        df['flight_zone_radius'] = None
-
-        time_pattern_icao = r'(?<![/])([A-Z]{4})(\d{4})\b'
-        time_pattern_hms = r'(\d{2}:\d{2}(?::\d{2})?)'
-        shr_pattern = r'\(SHR-(.*?)\)'
-        flight_level_pattern = r'M\d{4}/M\d{4}'
-        flight_zone_pattern = r'\/ZONA\s+([^\/]+)'
-
-        for idx, row in df.iterrows():
-            departure_time = None
-            arrival_time = None
-            shr_cell = None
-
-            for col in df.columns:
-                try:
-                    cell = str(row[col])
-                    shr_match = re.search(shr_pattern, cell, re.DOTALL)
-                    if shr_match and not shr_cell:
-                        shr_cell = shr_match.group(1)
-                except Exception:
-                    continue
+        typed = {}
+        if {'departure_time', 'arrival_time', 'dof'} & set(df.columns):
+            def parse(column, time_format):
+                if column not in df.columns:
+                    return pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+                return pd.to_datetime(df[column], format=time_format, errors='coerce')
+
+            departure = parse('departure_time', '%H:%M:%S')
+            arrival = parse('arrival_time', '%H:%M:%S')
+            flight_date = parse('dof', '%d%m%y')
+
+            duration = (arrival - departure).dt.total_seconds() / 60
+            duration = duration.where(duration >= 0, duration + 24 * 60)
+
+            none = DataProcessor._none_for_missing
+            typed.update(
+                dep_time=none(departure.dt.time),
+                arr_time=none(arrival.dt.time),
+                flight_date=none(flight_date.dt.date),
+                departure_at=flight_date + (departure - departure.dt.normalize()),
+                duration_minutes=duration,
+            )
+
+        for column, (lat_column, lon_column) in COORDINATE_COLUMNS.items():
+            if column in df.columns:
+                coords = convert_coord_series(df[column])
+                typed[lat_column] = coords['latitude']
+                typed[lon_column] = coords['longitude']
+
+        return df.assign(**typed) if typed else df
 
-            if shr_cell:
-                for prefix in prefixes:
-                    if prefix in shr_cell:
-                        value = shr_cell.split(prefix)[1].split(' ')[0].split(')')[0].split('/')[0]
-                        value = value.replace(',', '')
-                        df.at[idx, prefix.strip('/')] = value
-
-                        if prefix == 'OPR/':
-                            next_prefix_positions = []
-                            for p in prefixes:
-                                if p in shr_cell and shr_cell.find(p) > shr_cell.find(prefix):
-                                    next_prefix_positions.append(shr_cell.find(p))
-                            if next_prefix_positions:
-                                min_pos = min(next_prefix_positions)
-                                value = shr_cell[shr_cell.find(prefix)+len(prefix):min_pos].strip()
-                            else:
-                                value = shr_cell.split(prefix)[1].strip()
-                            df.at[idx, prefix.strip('/')] = value
-
-                flight_level_match = re.search(flight_level_pattern, shr_cell)
-                if flight_level_match:
-                    df.at[idx, 'flight_level'] = flight_level_match.group(0)
-
-                flight_zone_match = re.search(flight_zone_pattern, shr_cell)
-                if flight_zone_match:
-                    zone_info = flight_zone_match.group(1).strip()
-                    df.at[idx, 'flight_zone'] = zone_info
-                    radius_match = re.search(r'R[\d,]+', zone_info)
-                    if radius_match:
-                        df.at[idx, 'flight_zone_radius'] = radius_match.group(0)
-                        df.at[idx, 'flight_zone'] = zone_info.replace(radius_match.group(0), '').strip()
-
-                if 'RMK/' in shr_cell:
-                    rmk_value = shr_cell.split('RMK/')[1].split(')')[0].strip()
-                    rmk_value = rmk_value.replace(',', '')
-                    df.at[idx, 'RMK'] = rmk_value
-
-            idep_found = False
-            iarr_found = False
-            for col in df.columns:
-                try:
-                    cell = str(row[col])
-                    if not idep_found and ('IDEP' in str(col) or 'IDEP' in cell):
-                        idep_found = True
-                        atd_match = re.search(r'-ATD\s+(\d{4})', cell)
-                        if atd_match:
-                            time_str = atd_match.group(1)
-                            departure_time = f"{time_str[:2]}:{time_str[2:]}"
-
-                    if not iarr_found and ('IARR' in str(col) or 'IARR' in cell):
-                        iarr_found = True
-                        ata_match = re.search(r'-ATA\s+(\d{4})', cell)
-                        if ata_match:
-                            time_str = ata_match.group(1)
-                            arrival_time = f"{time_str[:2]}:{time_str[2:]}"
-                except Exception:
-                    continue
+    @staticmethod
+    def _key_value(value):
+        """Значение ячейки для ключа: 5.0 и 5 (float из pandas и int из openpyxl) совпадают"""
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    @staticmethod
+    def add_row_keys(df):
+        """
+        Добавляет колонку row_key - естественный ключ строки (md5, hex).
+
+        Ключ строится по листу-источнику (source_sheet) и всем непустым
+        исходным ячейкам вместе с именами колонок: SHR, IDEP/IARR (ATD/ATA) и
+        остальные - разные полеты по одному плану различаются. Вызывается до
+        дешифровки: дешифрованные колонки совпадают по именам с исходными
+        (DEP -> dep_1), поэтому после нее их не отличить.
+        """
+        if df.empty:
+            return df
 
-            if not departure_time and shr_cell:
-                shr_times = []
-                for match in re.finditer(time_pattern_hms, shr_cell):
-                    current_time = match.group(1)
-                    if current_time not in ["00:00", "00:00:00"]:
-                        shr_times.append(current_time)
-                for match in re.finditer(time_pattern_icao, shr_cell):
-                    time_str = match.group(1)
-                    current_time = f"{time_str[:2]}:{time_str[2:]}"
-                    if current_time != "00:00":
-                        shr_times.append(current_time)
-                if shr_times:
-                    departure_time = shr_times[0] if len(shr_times) > 0 else None
-
-            if departure_time:
-                if departure_time == '24:00' or departure_time == '24:00:00':
-                    departure_time = '00:00:00'
-                if len(departure_time.split(':')) == 2:
-                    departure_time += ':00'
-
-            if arrival_time:
-                if arrival_time == '24:00' or arrival_time == '24:00:00':
-                    arrival_time = '00:00:00'
-                if len(arrival_time.split(':')) == 2:
-                    arrival_time += ':00'
-
-            if departure_time and arrival_time:
-                try:
-                    departure_dt = datetime.strptime(departure_time, "%H:%M:%S")
-                    arrival_dt = datetime.strptime(arrival_time, "%H:%M:%S")
-                    if arrival_dt < departure_dt:
-                        departure_time, arrival_time = arrival_time, departure_time
-                except ValueError:
-                    pass
-
-            df.at[idx, 'departure_time'] = departure_time
-            df.at[idx, 'arrival_time'] = arrival_time
+        keys = (df[SOURCE_SHEET_COLUMN].astype(str).tolist() if SOURCE_SHEET_COLUMN in df.columns
+                else [''] * len(df))
+        skip = ({ROW_KEY_COLUMN, SOURCE_SHEET_COLUMN, 'id'} | set(OUTPUT_COLUMNS) | set(TYPED_COLUMN_TYPES))
+        separator = '\x1e'
+        for col in df.columns:
+            if col in skip:
+                continue
+            present = df[col].notna().tolist()
+            keys = [
+                f"{key}{separator}{col}={DataProcessor._key_value(value)}" if filled else key
+                for key, value, filled in zip(keys, df[col].tolist(), present)
+            ]
+            separator = '\x1f'
+
+        return df.assign(**{ROW_KEY_COLUMN: [hashlib.md5(key.encode('utf-8')).hexdigest() for key in keys]})
 
+    def decode_flight_plan_fields(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Дешифрует сырые данные из полей сообщения о плане запуска"""
+        cache = get_shr_cache()
+        df = decode_shr_frame_parallel(df, self.decode_workers, self.parallel_min_rows, cache)
+        if cache is not None:
+            self.logger.info(f"Кэш SHR: {cache.stats()}")
         return df
 
-    def save_to_table_with_id(self, df, table_name="excel_data_result_1"):
+    def load_sheet_chunks(self, chunks, table_name="excel_data_result_1", append=False, publish=True,
+                          sheet_name=None, upsert=False):
+        """
+        Очистка -> дешифровка -> загрузка по блокам (ExcelParser.iter_sheet_chunks).
+        Блоки пишутся в staging-таблицу: первый пересоздает ее (при append=False),
+        остальные дописываются, поэтому в памяти одновременно находится только
+        один блок. publish=True - после последнего блока подменить живую таблицу.
+
+        sheet_name - записать название листа в source_sheet и добавить row_key.
+        upsert=True - блоки сразу дописываются в живую таблицу (upsert_to_table);
+        строки, ключи которых уже есть в таблице, отбрасываются до дешифровки.
+        """
+        added = 0
+        skipped = 0
+        total = 0
+        for number, chunk in enumerate(chunks, start=1):
+            # Колонки не удаляем: иначе имена дешифрованных колонок (DEP -> dep_1)
+            # зависели бы от того, пуста ли исходная колонка в конкретном блоке
+            chunk = DataProcessor.clean_dataframe(chunk, drop_empty_columns=False)
+            if chunk.empty:
+                continue
+            total += len(chunk)
+
+            if sheet_name is not None:
+                chunk[SOURCE_SHEET_COLUMN] = sheet_name
+                chunk = DataProcessor.add_row_keys(chunk)
+
+            if upsert:
+                new_rows = self.drop_loaded_rows(chunk, table_name)
+                skipped += len(chunk) - len(new_rows)
+                if new_rows.empty:
+                    self.logger.info(f"Блок {number}: все {len(chunk)} строк уже загружены")
+                    continue
+                result = self.upsert_to_table(self.decode_flight_plan_fields(new_rows), table_name)
+                skipped += result.get("skipped", 0)
+            else:
+                decoded = self.decode_flight_plan_fields(chunk)
+                result = self.save_to_table_with_id(decoded, table_name, append=append, publish=False)
+                append = True
+            added += result.get("added", 0)
+            self.logger.info(f"Блок {number}: сохранено {result.get('added', 0)} строк, всего {added}")
+
+        if publish and added and not upsert:
+            self.publish_table(table_name)
+
+        return {
+            "added": added,
+            "skipped": skipped,
+            "total": total if upsert else added
+        }
+
+    def _table_columns(self, connection, table_name):
+        """Колонки таблицы через то же соединение (видны и незакоммиченные изменения)"""
+        return set(connection.execute(text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = :table
+        """), {"table": table_name}).scalars().all())
+
+    def drop_loaded_rows(self, df, table_name="excel_data_result_1"):
+        """Строки df, ключей (row_key) которых еще нет в живой таблице"""
+        if df.empty or ROW_KEY_COLUMN not in df.columns:
+            return df
+
+        connection, close_connection = self._get_connection()
+        try:
+            if ROW_KEY_COLUMN not in self._table_columns(connection, table_name):
+                return df
+            loaded = set(connection.execute(
+                text(f"SELECT {ROW_KEY_COLUMN} FROM {table_name} WHERE {ROW_KEY_COLUMN} = ANY(:keys)"),
+                {"keys": df[ROW_KEY_COLUMN].unique().tolist()}
+            ).scalars().all())
+        finally:
+            if close_connection:
+                connection.close()
+
+        if not loaded:
+            return df
+        self.logger.info(f"Уже загружено строк: {len(loaded)} из {len(df)}")
+        return df[~df[ROW_KEY_COLUMN].isin(loaded)]
+
+    def upsert_to_table(self, df, table_name="excel_data_result_1"):
+        """
+        Дописывает строки в живую таблицу без пересоздания (режим upsert).
+
+        Строки идут через COPY во временную таблицу, затем
+        INSERT ... ON CONFLICT (row_key) DO NOTHING: уже загруженные по
+        естественному ключу пропускаются; вставленные строки в том же запросе
+        прибавляются к сводке по регионам (region_rollup). Колонки, которых в таблице нет
+        (встречаются только на части листов), добавляются; если таблицы нет -
+        она создается с id SERIAL PRIMARY KEY и уникальным индексом по row_key.
+        Ключи (add_row_keys) должны быть добавлены до дешифровки.
+        """
+        try:
+            df_cleaned = DataProcessor.clean_dataframe(df)
+            if df_cleaned.empty:
+                self.logger.info("Нет данных для сохранения")
+                return {"added": 0, "skipped": 0, "total": 0}
+            if ROW_KEY_COLUMN not in df_cleaned.columns:
+                raise ValueError(f"Нет колонки {ROW_KEY_COLUMN}: ключи строк добавляются до дешифровки")
+            df_cleaned = DataProcessor.add_typed_columns(df_cleaned)
+
+            connection, close_connection = self._get_connection()
+            try:
+                inspector = inspect(self.engine)
+                if not inspector.has_table(table_name):
+                    dtypes = DataProcessor.map_pandas_to_postgres_types(df_cleaned)
+                    df_cleaned.head(0).to_sql(table_name, connection, if_exists='fail', index=False, dtype=dtypes)
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN id SERIAL PRIMARY KEY"))
+                    connection.commit()
+                    schema_registry.invalidate(table_name)
+                    self.logger.info(f"Создана таблица {table_name}")
+                else:
+                    added_columns = self._add_missing_columns(connection, inspector, df_cleaned, table_name)
+                    added_typed = [col for col in added_columns if col in TYPED_COLUMN_TYPES]
+                    if added_typed and self._backfill_typed_columns(connection, table_name, added_typed):
+                        # Сводка, посчитанная по пустым колонкам, пересчитывается ниже
+                        connection.execute(text(f"DROP TABLE IF EXISTS {rollup_table_name(table_name)}"))
+                        schema_registry.invalidate(rollup_table_name(table_name))
+
+                table_columns = set(df_cleaned.columns) | self._table_columns(connection, table_name)
+                for statement in self._index_statements(table_name, table_columns):
+                    connection.execute(text(statement))
+
+                self._ensure_unique_row_key(connection, table_name)
+
+                # Типы берутся из живой таблицы: временная создается по ее образцу
+                live_types = {col['name']: col['type'] for col in inspect(self.engine).get_columns(table_name)}
+                columns = ', '.join(f'"{col}"' for col in df_cleaned.columns)
+                incoming = f"{table_name}_incoming"
+                connection.execute(text(f"DROP TABLE IF EXISTS pg_temp.{incoming}"))
+                connection.execute(text(
+                    f"CREATE TEMP TABLE {incoming} ON COMMIT DROP AS "
+                    f"SELECT {columns} FROM {table_name} WITH NO DATA"
+                ))
+                copy_dataframe(connection, df_cleaned, incoming, live_types)
+                if ROLLUP_SOURCE_COLUMNS <= table_columns:
+                    rollup = rollup_table_name(table_name)
+                    if not self._table_columns(connection, rollup):
+                        # Сводки еще нет: строится по уже загруженным строкам до вставки
+                        undated = build_rollup(connection, table_name, rollup)
+                        schema_registry.invalidate(rollup)
+                        self.logger.info(f"Построена сводка {rollup}")
+                        self._warn_undated(rollup, undated)
+                    added = insert_with_rollup(connection, table_name, incoming, columns, ROW_KEY_COLUMN)
+                else:
+                    added = connection.execute(text(
+                        f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {incoming} "
+                        f"ON CONFLICT ({ROW_KEY_COLUMN}) DO NOTHING"
+                    )).rowcount
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                if close_connection:
+                    connection.close()
+
+            if added:
+                bump_dataset_version()
+            skipped = len(df_cleaned) - added
+            self.logger.info(f"В таблицу {table_name} добавлено {added} записей, пропущено {skipped}")
+            return {
+                "added": added,
+                "skipped": skipped,
+                "total": len(df_cleaned)
+            }
+
+        except SQLAlchemyError as e:
+            self.logger.error(f"Ошибка при сохранении в PostgreSQL: {e}")
+            raise
+
+    @staticmethod
+    def staging_table_name(table_name):
+        """Таблица, в которую идет загрузка до подмены живой таблицы"""
+        return f"{table_name}_staging"
+
+    def _get_connection(self):
+        """Соединение сессии (если есть) или новое; второй элемент - нужно ли его закрыть"""
+        if self.db:
+            return self.db.connection(), False
+        return self.engine.connect(), True
+
+    def _add_missing_columns(self, connection, inspector, df, table_name):
+        """Добавляет в существующую таблицу колонки, которых в ней еще нет; возвращает их список"""
+        existing = {col['name'] for col in inspector.get_columns(table_name)}
+        missing = [col for col in df.columns if col not in existing]
+        if not missing:
+            return []
+
+        dtypes = DataProcessor.map_pandas_to_postgres_types(df[missing])
+        for col in missing:
+            column_type = dtypes[col]().compile(dialect=self.engine.dialect)
+            connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN "{col}" {column_type}'))
+        connection.commit()
+        schema_registry.invalidate(table_name)
+        self.logger.info(f"В таблицу {table_name} добавлены колонки: {missing}")
+        return missing
+
+    def _backfill_typed_columns(self, connection, table_name, columns):
+        """
+        Заполняет добавленные в таблицу типизированные колонки у уже
+        загруженных строк - так же, как при загрузке (add_typed_columns), по
+        departure_time/arrival_time/dof и координатам. Строки читаются пачками
+        по id, результат записывается одним UPDATE из временной таблицы.
+        Возвращает число обновленных строк.
+        """
+        table_columns = self._table_columns(connection, table_name)
+        source = [col for col in ('departure_time', 'arrival_time', 'dof', *COORDINATE_COLUMNS)
+                  if col in table_columns]
+        if not source or 'id' not in table_columns:
+            return 0
+
+        typed = f"{table_name}_typed"
+        column_list = ', '.join(f'"{col}"' for col in columns)
+        connection.execute(text(f"DROP TABLE IF EXISTS pg_temp.{typed}"))
+        connection.execute(text(
+            f"CREATE TEMP TABLE {typed} ON COMMIT DROP AS SELECT id, {column_list} FROM {table_name} WITH NO DATA"
+        ))
+        source_list = ', '.join(f'"{col}"' for col in source)
+        select = text(f"SELECT id, {source_list} FROM {table_name} WHERE id > :after ORDER BY id LIMIT :limit")
+        types = {col: TYPED_COLUMN_TYPES[col] for col in columns}
+        after = 0
+        while True:
+            rows = connection.execute(select, {"after": after, "limit": TYPED_BACKFILL_ROWS}).mappings().all()
+            if not rows:
+                break
+            batch = DataProcessor.add_typed_columns(pd.DataFrame([dict(row) for row in rows]))
+            for col in columns:
+                if col not in batch.columns:
+                    batch[col] = None
+            copy_dataframe(connection, batch[['id', *columns]], typed, types)
+            after = rows[-1]['id']
+
+        assignments = ', '.join(f'"{col}" = {typed}."{col}"' for col in columns)
+        updated = connection.execute(text(
+            f"UPDATE {table_name} SET {assignments} FROM {typed} WHERE {table_name}.id = {typed}.id"
+        )).rowcount
+        self.logger.info(f"В {table_name} заполнены колонки {columns} у {updated} ранее загруженных строк")
+        return updated
+
+    def _warn_undated(self, rollup, undated):
+        """Строки без даты полета в сводке: в помесячную статистику они не попадают"""
+        if undated:
+            self.logger.warning(
+                f"В сводке {rollup} строк без даты полета: {undated} "
+                f"(flight_date = 'infinity', в статистике по месяцам не учитываются)"
+            )
+
+    @staticmethod
+    def _type_family(column_type):
+        """Семейство типа колонки для расширения: int, float, bool, timestamp, text, other"""
+        if isinstance(column_type, type):
+            column_type = column_type()
+        if isinstance(column_type, sa_types.Boolean):
+            return 'bool'
+        if isinstance(column_type, sa_types.Integer):
+            return 'int'
+        if isinstance(column_type, (sa_types.Float, sa_types.Numeric)):
+            return 'float'
+        if isinstance(column_type, sa_types.DateTime):
+            return 'timestamp'
+        if isinstance(column_type, sa_types.String):
+            return 'text'
+        return 'other'
+
+    @staticmethod
+    def widened_type(table_type, chunk_type, values):
+        """
+        Тип, до которого нужно расширить колонку таблицы, чтобы в нее
+        поместились значения очередного блока (None - расширять не нужно).
+
+        Целые остаются целыми, пока в блоке нет дробных значений (5.0 - целое);
+        дробные расширяют BIGINT до DOUBLE PRECISION, остальные несовпадения - до TEXT.
+        """
+        table_family = DataProcessor._type_family(table_type)
+        chunk_family = DataProcessor._type_family(chunk_type)
+        if table_family in (chunk_family, 'text') or (table_family, chunk_family) == ('float', 'int'):
+            return None
+        if (table_family, chunk_family) == ('int', 'float'):
+            numbers = pd.to_numeric(values.dropna())
+            if (numbers == numbers.round()).all():
+                return None
+            return sa_types.Float
+        return sa_types.Text
+
+    def _widen_columns(self, connection, inspector, df, dtypes, table_name):
+        """
+        Расширяет типы колонок таблицы под значения блока (ALTER COLUMN TYPE).
+
+        Типы staging-таблицы выводятся по первому блоку листа: колонка с
+        целыми числами в нем становится BIGINT, и дробное значение в
+        следующем блоке иначе оборвало бы COPY. Возвращает типы колонок
+        таблицы после расширения - по ним COPY приводит значения.
+        """
+        table_types = {col['name']: col['type'] for col in inspector.get_columns(table_name)}
+        widened = []
+        for col in df.columns:
+            if col not in table_types or col in TYPED_COLUMN_TYPES:
+                continue
+            new_type = DataProcessor.widened_type(table_types[col], dtypes[col], df[col])
+            if new_type is None:
+                continue
+            column_type = new_type().compile(dialect=self.engine.dialect)
+            connection.execute(text(
+                f'ALTER TABLE {table_name} ALTER COLUMN "{col}" TYPE {column_type} USING "{col}"::{column_type}'
+            ))
+            table_types[col] = new_type()
+            widened.append(f"{col} -> {column_type}")
+        if widened:
+            connection.commit()
+            schema_registry.invalidate(table_name)
+            self.logger.info(f"В таблице {table_name} расширены типы колонок: {widened}")
+        return table_types
+
+    def _ensure_unique_row_key(self, connection, table_name):
+        """
+        Уникальный индекс по row_key для INSERT ... ON CONFLICT режима upsert.
+
+        Таблица, собранная в режиме replace, может содержать повторы по ключу
+        (полностью одинаковые строки листа; индекс тогда неуникальный). Строки
+        при этом не удаляются: загрузка upsert в такую таблицу отклоняется
+        (DuplicateRowKeysError), ее нужно перезагрузить в режиме replace.
+        """
+        unique_index = f"{table_name}_{ROW_KEY_COLUMN}_key"
+        exists = connection.execute(text("""
+            SELECT 1 FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = :table AND indexname = :index
+        """), {"table": table_name, "index": unique_index}).first()
+        if exists:
+            return
+        repeated = connection.execute(text(
+            f"SELECT COUNT({ROW_KEY_COLUMN}) - COUNT(DISTINCT {ROW_KEY_COLUMN}) FROM {table_name}"
+        )).scalar()
+        if repeated:
+            raise DuplicateRowKeysError(
+                f"В {table_name} строк с повторяющимся {ROW_KEY_COLUMN}: {repeated}. "
+                f"Загрузка upsert невозможна - загрузите файл в режиме replace"
+            )
+        # Таблица, собранная до появления ключа: у старых строк row_key пуст
+        connection.execute(text(f"CREATE UNIQUE INDEX {unique_index} ON {table_name} ({ROW_KEY_COLUMN})"))
+        connection.execute(text(f"DROP INDEX IF EXISTS {table_name}_{ROW_KEY_COLUMN}_idx"))
+
+    def _index_statements(self, table_name, columns):
+        """Индексы по типизированным колонкам (строятся на staging-таблице до подмены).
+
+        (регион, дата) с duration_minutes в INCLUDE покрывает статистику по
+        регионам и месяцам; departure_at - отбор по времени вылета;
+        (id) с координатами вылета - все точки для карты, GiST по point - точки
+        в видимой области.
+        """
+        statements = []
+        if {'tsentr_es_orvd', 'flight_date', 'duration_minutes'} <= columns:
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_region_date_idx "
+                f"ON {table_name} (tsentr_es_orvd, flight_date) INCLUDE (duration_minutes)"
+            )
+        if {'dep_lat', 'dep_lon'} <= columns:
+            # Покрывающий индекс для /flights/points: точки читаются index-only scan
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_dep_point_idx "
+                f"ON {table_name} (id) INCLUDE (dep_lat, dep_lon) WHERE dep_lat IS NOT NULL"
+            )
+            # Встроенный тип point (без PostGIS): отбор по видимой области карты (<@ box)
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_dep_point_gist "
+                f"ON {table_name} USING gist (point(dep_lon, dep_lat)) WHERE dep_lat IS NOT NULL"
+            )
+        if 'departure_at' in columns:
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_departure_at_idx ON {table_name} (departure_at)"
+            )
+        return statements
+
+    def publish_table(self, table_name="excel_data_result_1"):
+        """
+        Подменяет живую таблицу заполненной staging-таблицей.
+
+        Ключ id и индексы строятся на staging-таблице заранее, а сама подмена -
+        несколько переименований в одной транзакции: читатели видят либо старые,
+        либо новые данные целиком, а блокировка держится миллисекунды. Сводка
+        по регионам (region_rollup) пересчитывается по staging и подменяется
+        в той же транзакции.
+        """
+        staging = self.staging_table_name(table_name)
+        old = f"{table_name}_old"
+        connection, close_connection = self._get_connection()
+        try:
+            staging_columns = self._table_columns(connection, staging)
+            if 'id' not in staging_columns:
+                connection.execute(text(f"ALTER TABLE {staging} ADD COLUMN id SERIAL PRIMARY KEY"))
+                self.logger.info(f"Добавлена колонка id SERIAL PRIMARY KEY в {staging}")
+            if ROW_KEY_COLUMN in staging_columns:
+                # replace загружает все строки как есть: при повторах по ключу
+                # (одинаковые строки листа) индекс неуникальный, а upsert в такую
+                # таблицу отклоняется (_ensure_unique_row_key)
+                repeated = connection.execute(text(
+                    f"SELECT COUNT({ROW_KEY_COLUMN}) - COUNT(DISTINCT {ROW_KEY_COLUMN}) FROM {staging}"
+                )).scalar()
+                if repeated:
+                    self.logger.warning(
+                        f"В {staging} строк с повторяющимся {ROW_KEY_COLUMN}: {repeated}; "
+                        f"уникальный индекс не создан"
+                    )
+                    connection.execute(text(
+                        f"CREATE INDEX {staging}_{ROW_KEY_COLUMN}_idx ON {staging} ({ROW_KEY_COLUMN})"
+                    ))
+                else:
+                    connection.execute(text(
+                        f"CREATE UNIQUE INDEX {staging}_{ROW_KEY_COLUMN}_key ON {staging} ({ROW_KEY_COLUMN})"
+                    ))
+            for statement in self._index_statements(staging, staging_columns):
+                connection.execute(text(statement))
+            # Сводка по регионам считается заранее; в транзакции подмены только копируется
+            rollup = rollup_table_name(table_name)
+            staging_rollup = rollup_table_name(staging)
+            has_rollup = ROLLUP_SOURCE_COLUMNS <= staging_columns
+            if has_rollup:
+                self._warn_undated(rollup, build_rollup(connection, staging, staging_rollup))
+            connection.commit()
+
+            # Подмена: все DDL в одной транзакции; не ждем долгие читающие запросы бесконечно
+            connection.execute(text(f"SET LOCAL lock_timeout = '{TABLE_SWAP_LOCK_TIMEOUT}'"))
+            connection.execute(text(f"DROP TABLE IF EXISTS {old}"))
+            connection.execute(text(f"ALTER TABLE IF EXISTS {table_name} RENAME TO {old}"))
+            connection.execute(text(f"ALTER TABLE {staging} RENAME TO {table_name}"))
+            connection.execute(text(f"DROP TABLE IF EXISTS {old}"))
+            self._rename_table_objects(connection, staging, table_name)
+            if has_rollup:
+                replace_rollup(connection, staging_rollup, rollup)
+            else:
+                # Без колонок сводки статистика считается по самой таблице
+                connection.execute(text(f"DROP TABLE IF EXISTS {rollup}"))
+            connection.commit()
+            schema_registry.invalidate(table_name)
+            schema_registry.invalidate(rollup)
+            bump_dataset_version()
+            self.logger.info(f"Таблица {table_name} заменена данными из {staging}")
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            if close_connection:
+                connection.close()
+
+    def _rename_table_objects(self, connection, staging, table_name):
+        """Индексы и последовательность id после подмены получают имена живой таблицы"""
+        indexes = connection.execute(text("""
+            SELECT indexname FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = :table
+        """), {"table": table_name}).scalars().all()
+        for index_name in indexes:
+            if index_name.startswith(staging):
+                connection.execute(text(
+                    f'ALTER INDEX "{index_name}" RENAME TO "{table_name}{index_name[len(staging):]}"'
+                ))
+
+        sequence = connection.execute(
+            text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table_name}
+        ).scalar()
+        if sequence and sequence.split('.')[-1].strip('"') != f"{table_name}_id_seq":
+            connection.execute(text(f'ALTER SEQUENCE {sequence} RENAME TO "{table_name}_id_seq"'))
+
+    def save_to_table_with_id(self, df, table_name="excel_data_result_1", append=False, publish=True):
         """
         Загрузка данных в таблицу excel_data_result_1 с добавлением уникального ID
+
+        Данные пишутся в staging-таблицу ({table_name}_staging), живая таблица
+        не удаляется. append=True - дописать строки в staging (следующие блоки
+        или листы загрузки), недостающие колонки добавляются. publish=True -
+        сразу подменить живую таблицу (publish_table); для многошаговой загрузки
+        publish_table вызывается один раз в конце.
         """
+        staging = self.staging_table_name(table_name)
         try:
-            self.logger.info(f"Начало сохранения {len(df)} строк в таблицу {table_name}")
+            self.logger.info(f"Начало сохранения {len(df)} строк в таблицу {staging}")
 
             # Очищаем DataFrame перед сохранением
             df_cleaned = DataProcessor.clean_dataframe(df)
             if df_cleaned.empty:
                 self.logger.info("Нет данных для сохранения")
                 return {"added": 0, "total": 0}
+            df_cleaned = DataProcessor.add_typed_columns(df_cleaned)
 
             # Используем существующее подключение или создаем новое
-            if self.db:
-                # Используем существующую сессию
-                connection = self.db.connection()
-            else:
-                # Создаем новое подключение
-                connection = self.engine.connect()
+            connection, close_connection = self._get_connection()
 
             try:
-                # Проверяем существование таблицы
+                # Проверяем существование staging-таблицы
                 inspector = inspect(self.engine)
-                table_exists = inspector.has_table(table_name)
+                table_exists = inspector.has_table(staging)
 
-                if table_exists:
-                    self.logger.info(f"Таблица {table_name} существует, пересоздаем...")
-                    
-                    # УДАЛЯЕМ существующую таблицу и создаем новую с правильной структурой
-                    connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
-                    connection.commit()
-                
-                # Создаем таблицу с данными
                 dtypes = DataProcessor.map_pandas_to_postgres_types(df_cleaned)
-                
-                # Создаем таблицу
-                df_cleaned.to_sql(
-                    table_name,
-                    self.engine,
-                    if_exists='replace',  # replace - пересоздает таблицу
-                    index=False,
-                    dtype=dtypes,
-                    chunksize=1000
-                )
-                
-                # Добавляем автоинкрементный ID
-                columns_after = [col['name'] for col in inspector.get_columns(table_name)]
-                if 'id' not in columns_after:
-                    connection.execute(text(f"""
-                        ALTER TABLE {table_name} ADD COLUMN id SERIAL PRIMARY KEY;
-                    """))
-                    self.logger.info("Добавлена колонка id SERIAL PRIMARY KEY")
-                
-                connection.commit()
-                
-                added_count = len(df_cleaned)
-                self.logger.info(f"Создана новая таблица {table_name} с {added_count} записями")
-
-                return {
-                    "added": added_count,
-                    "total": added_count
-                }
 
+                if append and table_exists:
+                    self._add_missing_columns(connection, inspector, df_cleaned, staging)
+                    table_types = self._widen_columns(connection, inspect(self.engine), df_cleaned, dtypes, staging)
+                    copy_dataframe(connection, df_cleaned, staging, table_types)
+                    connection.commit()
+                    self.logger.info(f"В таблицу {staging} добавлено {len(df_cleaned)} записей")
+                else:
+                    # Пустая staging-таблица с нужными типами (прежняя staging, если
+                    # осталась от прерванной загрузки, пересоздается), данные - через COPY
+                    df_cleaned.head(0).to_sql(
+                        staging,
+                        connection,
+                        if_exists='replace',
+                        index=False,
+                        dtype=dtypes
+                    )
+                    copy_dataframe(connection, df_cleaned, staging, dtypes)
+                    connection.commit()
+                    self.logger.info(f"Создана таблица {staging} с {len(df_cleaned)} записями")
             finally:
                 # Закрываем подключение только если мы его создавали
-                if not self.db:
+                if close_connection:
                     connection.close()
-                    
+
+            if publish:
+                self.publish_table(table_name)
+
+            added_count = len(df_cleaned)
+            return {
+                "added": added_count,
+                "total": added_count
+            }
+
         except SQLAlchemyError as e:
             self.logger.error(f"Ошибка при сохранении в PostgreSQL: {e}")
             raise
@@ -1,17 +1,78 @@
 import redis
-import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
 from datetime import timedelta
-from functools import lru_cache
+from functools import lru_cache, wraps
 import os
+from fastapi import Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from cache_codecs import get_codec, decode_payload, decode_data, dumps_json
+from http_compression import response_encoding, compress_body, HTTP_COMPRESS_MIN_BYTES
+from schema_registry import schema_registry
+
+logger = logging.getLogger(__name__)
 
 
 # Настройка Redis
-redis_client = redis.Redis(
+_redis_settings = dict(
     host=os.getenv('REDIS_HOST', 'localhost'),
     port=int(os.getenv('REDIS_PORT', 6379)),
     db=int(os.getenv('REDIS_DB', 0)),
-    decode_responses=True
+    socket_connect_timeout=float(os.getenv('REDIS_CONNECT_TIMEOUT', '1'))
 )
+redis_client = redis.Redis(decode_responses=True, **_redis_settings)
+# Клиент для закэшированных ответов: значения - байты кодеков (cache_codecs)
+redis_binary = redis.Redis(decode_responses=False, **_redis_settings)
+
+# Счетчик версии данных: увеличивается после каждой записи новых данных
+# в таблицу (загрузка через /api/upload или загрузчик excel_to_postgres)
+DATASET_VERSION_KEY = os.getenv('DATASET_VERSION_KEY', 'uav:dataset_version')
+# Время последнего обновления данных (unix-время; для Last-Modified)
+DATASET_MODIFIED_KEY = os.getenv('DATASET_MODIFIED_KEY', f"{DATASET_VERSION_KEY}:modified")
+# Канал, в который публикуется новая версия данных
+DATASET_VERSION_CHANNEL = os.getenv('DATASET_VERSION_CHANNEL', 'uav:dataset_version')
+# Срок хранения ответов: актуальность обеспечивает версия в ключе,
+# срок нужен только чтобы вытеснять ответы прежних версий
+RESPONSE_CACHE_MINUTES = int(os.getenv('RESPONSE_CACHE_MINUTES', str(24 * 60)))
+
+# Локальный (в памяти процесса) уровень кэша ответов
+LOCAL_CACHE_MAX_BYTES = int(os.getenv('LOCAL_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+LOCAL_CACHE_TTL = float(os.getenv('LOCAL_CACHE_TTL', '300'))
+# Как часто подписчик сверяет версию с Redis (на случай потерянного сообщения)
+VERSION_RECHECK_SECONDS = float(os.getenv('VERSION_RECHECK_SECONDS', '30'))
+
+# Защита от одновременного пересчета: срок блокировки в Redis, сколько
+# ожидающий воркер ждет ответ в кэше и как часто его проверяет
+CACHE_LOCK_SECONDS = float(os.getenv('CACHE_LOCK_SECONDS', '30'))
+CACHE_LOCK_WAIT_SECONDS = float(os.getenv('CACHE_LOCK_WAIT_SECONDS', '30'))
+CACHE_LOCK_POLL_SECONDS = 0.05
+# Отдавать ответ прежней версии данных, пока новый считается в фоне
+CACHE_STALE_WHILE_REVALIDATE = os.getenv('CACHE_STALE_WHILE_REVALIDATE', 'false').lower() == 'true'
+# После ошибки соединения с Redis его уровень отключается на этот срок:
+# запросы не пытаются переподключаться каждый раз
+REDIS_RETRY_SECONDS = float(os.getenv('REDIS_RETRY_SECONDS', '30'))
+
+_redis_down_until = 0.0
+
+def _redis_enabled() -> bool:
+    return time.monotonic() >= _redis_down_until
+
+def _redis_failed(error: Exception):
+    """Ошибка соединения с Redis (или таймаут) отключает его на REDIS_RETRY_SECONDS"""
+    global _redis_down_until
+    if not isinstance(error, (redis.ConnectionError, redis.TimeoutError)):
+        return
+    if _redis_enabled():
+        logger.warning(f"Redis недоступен, кэш в Redis отключен на {REDIS_RETRY_SECONDS:g} с: {error}")
+    _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+def _redis_recovered():
+    global _redis_down_until
+    _redis_down_until = 0.0
 
 def get_cache_key(endpoint: str, **params):
     """Генерация ключа кэша"""
@@ -20,27 +81,541 @@ def get_cache_key(endpoint: str, **params):
         key_parts.append(f"{k}:{v}")
     return "|".join(key_parts)
 
+def serialize_response(data) -> bytes:
+    """Ответ в JSON (UTF-8) - в таком виде он хранится в локальном уровне кэша"""
+    return dumps_json(data)
+
 def get_cached_data(key: str):
     """Получить данные из кэша"""
+    if not _redis_enabled():
+        return None
     try:
-        cached = redis_client.get(key)
+        cached = redis_binary.get(key)
         if cached:
-            # Явно приводим к строке
-            return json.loads(str(cached))
+            return decode_data(cached)
         return None
-    except Exception:
+    except Exception as e:
+        _redis_failed(e)
         return None
 
-def set_cached_data(key: str, data: dict, expire_minutes: int = 30):
+def set_cached_data(key: str, data: dict, expire_minutes: int = 30, codec: str = None):
     """Сохранить данные в кэш"""
     try:
-        # Сериализуем данные, обрабатывая datetime объекты
-        def json_serializer(obj):
-            if hasattr(obj, 'isoformat'):
-                return obj.isoformat()
-            raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
-        
-        serialized_data = json.dumps(data, default=json_serializer, ensure_ascii=False)
-        redis_client.setex(key, timedelta(minutes=expire_minutes), serialized_data)
+        _, stored = get_codec(codec).encode(data)
+        set_cached_bytes(key, stored, expire_minutes)
+    except Exception as e:
+        print(f"Ошибка кэширования: {e}")
+
+def get_cached_bytes(key: str):
+    """JSON ответа из Redis (распакованный, без разбора); None - нет или Redis недоступен"""
+    if not _redis_enabled():
+        return None
+    try:
+        cached = redis_binary.get(key)
+        if cached is None:
+            return None
+        return decode_payload(cached)
+    except Exception as e:
+        _redis_failed(e)
+        return None
+
+def get_cached_raw(key: str):
+    """Значение из Redis как есть (сжатые тела ответов); None - нет или Redis недоступен"""
+    if not _redis_enabled():
+        return None
+    try:
+        return redis_binary.get(key)
+    except Exception as e:
+        _redis_failed(e)
+        return None
+
+def set_cached_bytes(key: str, stored: bytes, expire_minutes: int = 30):
+    """Записать в Redis значение, уже закодированное кодеком"""
+    if not _redis_enabled():
+        return
+    try:
+        redis_binary.setex(key, timedelta(minutes=expire_minutes), stored)
+    except Exception as e:
+        _redis_failed(e)
+        logger.warning(f"Ошибка кэширования: {e}")
+
+
+class LocalResponseCache:
+    """LRU сериализованных ответов в памяти процесса с ограничением по байтам и сроку"""
+
+    def __init__(self, max_bytes: int = None, ttl: float = None):
+        self.max_bytes = LOCAL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = LOCAL_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if self.ttl > 0 and expires_at < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, key: str, payload: bytes):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        self._size -= len(self._entries.pop(key)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size}
+
+
+local_cache = LocalResponseCache()
+
+# Счетчики обращений к кэшу ответов по уровням
+_counts = {"requests": 0, "local_hits": 0, "redis_hits": 0, "misses": 0, "coalesced": 0, "stale": 0}
+_counts_lock = threading.Lock()
+
+def _count(name: str):
+    with _counts_lock:
+        _counts["requests"] += 1
+        _counts[name] += 1
+
+def _count_coalesced():
+    """Промах, который дождался ответа, посчитанного другим запросом"""
+    with _counts_lock:
+        _counts["coalesced"] += 1
+
+def _count_stale():
+    """Промах, на который отдан ответ прежней версии"""
+    with _counts_lock:
+        _counts["stale"] += 1
+
+def cache_stats():
+    """Доли попаданий по уровням: local - от всех запросов, redis - от промахов локального уровня"""
+    with _counts_lock:
+        counts = dict(_counts)
+    requests = counts["requests"]
+    reached_redis = requests - counts["local_hits"]
+    return {
+        **counts,
+        "local_hit_ratio": round(counts["local_hits"] / requests, 4) if requests else 0.0,
+        "redis_hit_ratio": round(counts["redis_hits"] / reached_redis, 4) if reached_redis else 0.0,
+        "hit_ratio": round((requests - counts["misses"]) / requests, 4) if requests else 0.0,
+        "local": local_cache.stats(),
+        "dataset_version": _known_version,
+    }
+
+
+def get_dataset_version():
+    """Текущая версия данных; None - Redis недоступен (кэш не используется)"""
+    if not _redis_enabled():
+        return None
+    try:
+        return int(redis_client.get(DATASET_VERSION_KEY) or 0)
+    except Exception as e:
+        _redis_failed(e)
+        logger.warning(f"Не удалось получить версию данных: {e}")
+        return None
+
+def bump_dataset_version():
+    """Новая версия данных: закэшированные ответы прежних версий больше не читаются,
+    процессы API получают ее через pub/sub и очищают локальный уровень"""
+    try:
+        pipeline = redis_client.pipeline()
+        pipeline.incr(DATASET_VERSION_KEY)
+        pipeline.set(DATASET_MODIFIED_KEY, int(time.time()))
+        version, _ = pipeline.execute()
+        redis_client.publish(DATASET_VERSION_CHANNEL, version)
+        return version
+    except Exception as e:
+        logger.warning(f"Не удалось обновить версию данных: {e}")
+        return None
+
+
+# Версия, известная процессу по подписке, и время ее появления; None -
+# подписки нет, версия читается из Redis на каждый запрос
+_known_version = None
+_known_modified = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+def _read_dataset_modified():
+    """Unix-время последнего обновления данных из Redis; None - неизвестно"""
+    if not _redis_enabled():
+        return None
+    try:
+        value = redis_client.get(DATASET_MODIFIED_KEY)
+        return int(value) if value else None
+    except Exception as e:
+        _redis_failed(e)
+        logger.warning(f"Не удалось получить время обновления данных: {e}")
+        return None
+
+def _set_known_version(version):
+    """Вызывается потоком-подписчиком (и со значением None - при его запуске)"""
+    global _known_version, _known_modified
+    if version != _known_version:
+        local_cache.clear()
+        # Загрузка в другом процессе могла подменить таблицы, сводку и колонки
+        schema_registry.invalidate()
+        # Время читается раз на версию и до нее: читатель не увидит новую версию со старым временем
+        _known_modified = _read_dataset_modified() if version is not None else None
+    _known_version = version
+
+def _listen_dataset_version():
+    """Поток-подписчик: держит версию данных в памяти и сбрасывает локальный уровень и кэш структуры таблиц"""
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(DATASET_VERSION_CHANNEL)
+            # Подписка удалась - Redis снова доступен
+            _redis_recovered()
+            # Версия читается после подписки, поэтому следующая публикация не потеряется
+            _set_known_version(get_dataset_version())
+            checked = time.monotonic()
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    _set_known_version(int(message['data']))
+                elif time.monotonic() - checked > VERSION_RECHECK_SECONDS:
+                    _set_known_version(get_dataset_version())
+                    checked = time.monotonic()
+        except Exception as e:
+            _redis_failed(e)
+            logger.warning(f"Подписка на версию данных прервана: {e}")
+            _set_known_version(None)
+            time.sleep(VERSION_RECHECK_SECONDS)
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+def _ensure_listener():
+    """Запускает подписчика один раз на процесс (после fork - заново)"""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _set_known_version(None)
+        threading.Thread(target=_listen_dataset_version, name="dataset-version", daemon=True).start()
+        _listener_pid = os.getpid()
+
+def current_dataset_version():
+    """Версия данных для ключа кэша: из памяти (по подписке) или из Redis"""
+    _ensure_listener()
+    version = _known_version
+    return version if version is not None else get_dataset_version()
+
+
+def known_dataset_version():
+    """
+    (версия данных, unix-время ее появления) из памяти процесса, без обращения
+    к Redis - для вызовов из event loop; (None, None) - подписчик версию еще
+    не получил или Redis недоступен
+    """
+    _ensure_listener()
+    version = _known_version
+    return version, (_known_modified if version is not None else None)
+
+
+class _KeyLocks:
+    """Блокировки по ключу кэша внутри процесса; запись удаляется вместе с последним ожидающим"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def acquire_ref(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [self._factory(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release_ref(self, key):
+        with self._guard:
+            entry = self._locks[key]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+# Синхронные эндпоинты ждут в потоках пула, асинхронные - в цикле событий
+_thread_locks = _KeyLocks(threading.Lock)
+_async_locks = _KeyLocks(asyncio.Lock)
+
+
+# Блокировка-заглушка: Redis недоступен или ждать другой воркер больше нельзя
+_NO_LOCK = object()
+
+def _stale_key(base_key: str) -> str:
+    return f"stale|{base_key}"
+
+def _try_redis_lock(key: str):
+    """Короткая блокировка вычисления ответа между воркерами; None - занята другим"""
+    if not _redis_enabled():
+        # Без Redis блокировки между воркерами нет - считаем сами
+        return _NO_LOCK
+    try:
+        lock = redis_client.lock(f"lock|{key}", timeout=CACHE_LOCK_SECONDS)
+        return lock if lock.acquire(blocking=False) else None
     except Exception as e:
-        print(f"Ошибка кэширования: {e}")
\ No newline at end of file
+        _redis_failed(e)
+        logger.warning(f"Блокировка кэша недоступна: {e}")
+        return _NO_LOCK
+
+def _release_redis_lock(lock):
+    if lock is _NO_LOCK:
+        return
+    try:
+        lock.release()
+    except Exception as e:
+        # Срок блокировки истек раньше, чем закончилось вычисление (или Redis недоступен)
+        _redis_failed(e)
+
+def _refresh_kwargs(kwargs):
+    """Параметры для фонового обновления: сессия запроса к этому времени закрыта, нужна своя"""
+    from database import SessionLocal
+
+    sessions = []
+    refreshed = {}
+    for name, value in kwargs.items():
+        if isinstance(value, Session):
+            value = SessionLocal()
+            sessions.append(value)
+        refreshed[name] = value
+    return refreshed, sessions
+
+
+def cached_response(endpoint: str, expire_minutes: int = None, stale_while_revalidate: bool = None,
+                    codec: str = None):
+    """
+    Декоратор эндпоинта: двухуровневый кэш ответа по ключу
+    endpoint + параметры запроса + версия данных.
+
+    Первый уровень - сериализованные байты в памяти процесса, второй - Redis,
+    общий для воркеров uvicorn. Попадание отдается как готовый JSON без
+    повторной сериализации. Сессия БД в ключ не входит; ошибки (HTTPException)
+    и готовые Response не кэшируются; без Redis эндпоинт работает как обычно
+    (после ошибки соединения Redis не опрашивается REDIS_RETRY_SECONDS).
+    У async-эндпоинтов работа с Redis идет в пуле потоков, не в event loop.
+
+    При промахе ответ вычисляет один запрос: в процессе остальные ждут на
+    блокировке по ключу, между воркерами - на короткой блокировке в Redis
+    (ожидающие опрашивают кэш). stale_while_revalidate=True (по умолчанию
+    CACHE_STALE_WHILE_REVALIDATE) - пока ответ новой версии считается в
+    фоне, отдается ответ предыдущей версии. codec - кодек значения в Redis
+    ('orjson+zstd', 'msgpack+lz4', ...; по умолчанию CACHE_CODEC).
+    Сжатые для HTTP (http_compression) копии ответа хранятся рядом с ним
+    в обоих уровнях.
+    """
+    expire_minutes = expire_minutes or RESPONSE_CACHE_MINUTES
+    if stale_while_revalidate is None:
+        stale_while_revalidate = CACHE_STALE_WHILE_REVALIDATE
+
+    def lookup(kwargs):
+        """(ключ, ключ без версии, байты ответа или None); ключ None - кэш недоступен"""
+        version = current_dataset_version()
+        if version is None:
+            return None, None, None
+        params = {k: v for k, v in kwargs.items() if not isinstance(v, Session)}
+        key = get_cache_key(endpoint, version=version, **params)
+        base_key = get_cache_key(endpoint, **params)
+
+        payload = local_cache.get(key)
+        if payload is not None:
+            _count("local_hits")
+            return key, base_key, payload
+        payload = get_cached_bytes(key)
+        if payload is not None:
+            _count("redis_hits")
+            local_cache.put(key, payload)
+            return key, base_key, payload
+        _count("misses")
+        return key, base_key, None
+
+    def recheck(key):
+        """Ответ, который успел посчитать другой запрос"""
+        payload = local_cache.get(key)
+        if payload is None:
+            payload = get_cached_bytes(key)
+            if payload is not None:
+                local_cache.put(key, payload)
+        return payload
+
+    def serve(payload, key=None):
+        """
+        Ответ из байтов кэша. Если запрос принимает сжатие (response_encoding),
+        отдается сжатое тело, которое хранится рядом с ответом по ключу key:
+        сжатие выполняется раз на версию данных, а не на каждый запрос.
+        Vary: Accept-Encoding ставится и на несжатый ответ
+        """
+        encoding = response_encoding.get()
+        if key is None or encoding is None or len(payload) < HTTP_COMPRESS_MIN_BYTES:
+            return Response(content=payload, media_type="application/json",
+                            headers={"Vary": "Accept-Encoding"})
+        compressed_key = f"{key}|encoding:{encoding}"
+        body = local_cache.get(compressed_key)
+        if body is None:
+            body = get_cached_raw(compressed_key)
+            if body is None:
+                body = compress_body(payload, encoding)
+                set_cached_bytes(compressed_key, body, expire_minutes)
+            local_cache.put(compressed_key, body)
+        return Response(content=body, media_type="application/json",
+                        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+
+    def store(key, base_key, data):
+        if isinstance(data, Response):
+            # Готовый ответ (например, бинарный) отдается без кэширования
+            return data
+        try:
+            payload, stored = get_codec(codec).encode(data)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Ответ {endpoint} не кэшируется: {e}")
+            return data
+        local_cache.put(key, payload)
+        set_cached_bytes(key, stored, expire_minutes)
+        if stale_while_revalidate:
+            set_cached_bytes(_stale_key(base_key), stored, expire_minutes)
+        return serve(payload, key)
+
+    def stale_payload(base_key):
+        return get_cached_bytes(_stale_key(base_key)) if stale_while_revalidate else None
+
+    def refresh_in_background(func, key, base_key, kwargs, redis_lock):
+        """Пересчет ответа в отдельном потоке со своей сессией БД"""
+        def run():
+            sessions = []
+            try:
+                refreshed, sessions = _refresh_kwargs(kwargs)
+                data = func(**refreshed)
+                if asyncio.iscoroutine(data):
+                    data = asyncio.run(data)
+                store(key, base_key, data)
+            except Exception as e:
+                logger.warning(f"Фоновое обновление {endpoint} не удалось: {e}")
+            finally:
+                for session in sessions:
+                    session.close()
+                _release_redis_lock(redis_lock)
+
+        threading.Thread(target=run, name=f"refresh {endpoint}", daemon=True).start()
+
+    def claim(func, key, base_key, kwargs):
+        """
+        Решение после промаха (под блокировкой процесса по ключу):
+        (ответ, None) - отдать готовый ответ; (None, блокировка) - считать самим;
+        (None, None) - ответ считает другой воркер, ждать его в кэше.
+        """
+        payload = recheck(key)
+        if payload is not None:
+            _count_coalesced()
+            return serve(payload, key), None
+
+        redis_lock = _try_redis_lock(key)
+        stale = stale_payload(base_key)
+        if stale is not None:
+            _count_stale()
+            if redis_lock is not None:
+                refresh_in_background(func, key, base_key, kwargs, redis_lock)
+            # Прежняя версия: сжатое тело не кэшируется (его сожмет middleware)
+            return serve(stale), None
+        return None, redis_lock
+
+    def waited(key, started):
+        """Ответ другого воркера; _NO_LOCK - не дождались, считаем сами"""
+        payload = recheck(key)
+        if payload is not None:
+            _count_coalesced()
+            return serve(payload, key)
+        if time.monotonic() - started > CACHE_LOCK_WAIT_SECONDS:
+            return _NO_LOCK
+        return None
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            # Обращения к Redis, кодирование и сжатие синхронные - в пул потоков,
+            # чтобы не блокировать event loop (контекст запроса копируется)
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                key, base_key, payload = await run_in_threadpool(lookup, kwargs)
+                if payload is not None:
+                    return await run_in_threadpool(serve, payload, key)
+                if key is None:
+                    return await func(*args, **kwargs)
+
+                lock = _async_locks.acquire_ref(key)
+                try:
+                    async with lock:
+                        response, redis_lock = await run_in_threadpool(claim, func, key, base_key, kwargs)
+                        started = time.monotonic()
+                        while response is None and redis_lock is None:
+                            await asyncio.sleep(CACHE_LOCK_POLL_SECONDS)
+                            response = await run_in_threadpool(waited, key, started)
+                            if response is _NO_LOCK:
+                                response, redis_lock = None, _NO_LOCK
+                        if response is not None:
+                            return response
+                        try:
+                            data = await func(*args, **kwargs)
+                            return await run_in_threadpool(store, key, base_key, data)
+                        finally:
+                            await run_in_threadpool(_release_redis_lock, redis_lock)
+                finally:
+                    _async_locks.release_ref(key)
+        else:
+            # Синхронные эндпоинты FastAPI выполняет в пуле потоков - обертка тоже синхронная
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                key, base_key, payload = lookup(kwargs)
+                if payload is not None:
+                    return serve(payload, key)
+                if key is None:
+                    return func(*args, **kwargs)
+
+                lock = _thread_locks.acquire_ref(key)
+                try:
+                    with lock:
+                        response, redis_lock = claim(func, key, base_key, kwargs)
+                        started = time.monotonic()
+                        while response is None and redis_lock is None:
+                            time.sleep(CACHE_LOCK_POLL_SECONDS)
+                            response = waited(key, started)
+                            if response is _NO_LOCK:
+                                response, redis_lock = None, _NO_LOCK
+                        if response is not None:
+                            return response
+                        try:
+                            return store(key, base_key, func(*args, **kwargs))
+                        finally:
+                            _release_redis_lock(redis_lock)
+                finally:
+                    _thread_locks.release_ref(key)
+        return wrapper
+
+    return decorator
@@ -1,42 +1,149 @@
 import pandas as pd
 import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Размер блока строк при потоковом чтении
+EXCEL_CHUNK_ROWS = int(os.getenv('EXCEL_CHUNK_ROWS', '50000'))
+# Форматы, которые openpyxl умеет читать построчно (read_only)
+STREAMING_EXTENSIONS = ('.xlsx', '.xlsm', '.xltx', '.xltm')
+# Сколько разобранных книг держать открытыми одновременно
+EXCEL_WORKBOOK_CACHE_SIZE = int(os.getenv('EXCEL_WORKBOOK_CACHE_SIZE', '4'))
+
+# Общий кэш открытых книг: (абсолютный путь, mtime, размер) -> _CachedWorkbook.
+# Для xlsx внутри лежит книга openpyxl в режиме read_only, листы которой
+# читаются лениво, поэтому заголовки берутся без разбора остальных строк.
+_workbooks = OrderedDict()
+_workbooks_lock = threading.Lock()
+# Процесс-владелец кэша: дочерний процесс (fork) не должен читать
+# унаследованные дескрипторы файлов родителя
+_workbooks_pid = os.getpid()
+
+
+class _CachedWorkbook:
+    """Книга из кэша со счетчиком использующих ее запросов.
+
+    Книга openpyxl read_only читает листы из одного открытого архива и не
+    рассчитана на одновременное чтение из нескольких потоков, поэтому
+    обращения к ней идут под lock. Вытесненная из кэша книга закрывается,
+    только когда ее отпустит последний использующий запрос.
+    """
+
+    def __init__(self, excel_file):
+        self.excel_file = excel_file
+        self.lock = threading.RLock()
+        self.users = 0
+        self.evicted = False
+
+
+def _workbook_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _retire(entry):
+    """Убранная из кэша книга; закрывается сразу, если ее никто не читает (под _workbooks_lock)"""
+    entry.evicted = True
+    if entry.users == 0:
+        entry.excel_file.close()
+
+
+def _release(entry):
+    with _workbooks_lock:
+        entry.users -= 1
+        if entry.evicted and entry.users == 0:
+            entry.excel_file.close()
+
+
+def release_workbook(path):
+    """Убирает из кэша книгу по пути (перед удалением/перезаписью файла);
+    файл закрывается, когда его отпустят все читающие запросы"""
+    path = os.path.abspath(path)
+    with _workbooks_lock:
+        for key in [key for key in _workbooks if key[0] == path]:
+            _retire(_workbooks.pop(key))
+
 class ExcelParser:
     """Парсер Excel файлов"""
     
     def __init__(self):
         self.excel_file_path = os.getenv('EXCEL_FILE_PATH', 'data.xlsx')
         # Убираем sheet_name по умолчанию, так как теперь будем работать со всеми страницами
-    
+
+    @contextmanager
+    def _workbook_entry(self):
+        """Книга из общего кэша, удерживаемая (не закрывается) до выхода из блока with;
+        файл разбирается один раз, пока не изменятся его mtime или размер"""
+        global _workbooks_pid
+        key = _workbook_key(self.excel_file_path)
+        with _workbooks_lock:
+            if _workbooks_pid != os.getpid():
+                _workbooks.clear()
+                _workbooks_pid = os.getpid()
+
+            entry = _workbooks.get(key)
+            if entry is not None:
+                _workbooks.move_to_end(key)
+            else:
+                # Устаревшие версии того же файла больше не нужны
+                for stale in [stale for stale in _workbooks if stale[0] == key[0]]:
+                    _retire(_workbooks.pop(stale))
+
+                entry = _CachedWorkbook(pd.ExcelFile(self.excel_file_path))
+                _workbooks[key] = entry
+                while len(_workbooks) > max(EXCEL_WORKBOOK_CACHE_SIZE, 1):
+                    _retire(_workbooks.popitem(last=False)[1])
+            entry.users += 1
+        try:
+            yield entry
+        finally:
+            _release(entry)
+
+    @contextmanager
+    def workbook(self):
+        """Открытая книга (pd.ExcelFile) из общего кэша в монопольном пользовании на время блока with"""
+        with self._workbook_entry() as entry, entry.lock:
+            yield entry.excel_file
+
+    def close(self):
+        """Освобождает кэшированную книгу этого файла"""
+        release_workbook(self.excel_file_path)
+
     def get_sheet_names(self):
         """Получить список всех страниц в Excel файле"""
         try:
-            excel_file = pd.ExcelFile(self.excel_file_path)
-            return excel_file.sheet_names
+            with self.workbook() as excel_file:
+                return excel_file.sheet_names
         except Exception as e:
             raise Exception(f"Ошибка при получении списка страниц: {e}")
     
     def read_excel_sheet(self, sheet_name):
         """Чтение конкретной страницы Excel файла"""
         try:
-            return pd.read_excel(
-                io=self.excel_file_path,
-                sheet_name=sheet_name
-            )
+            with self.workbook() as excel_file:
+                return excel_file.parse(sheet_name=sheet_name)
         except Exception as e:
             raise Exception(f"Ошибка при чтении страницы '{sheet_name}': {e}")
+
+    def read_sheet_head(self, sheet_name, nrows=0):
+        """Заголовок и первые nrows строк страницы; остальные строки не разбираются"""
+        try:
+            with self.workbook() as excel_file:
+                return excel_file.parse(sheet_name=sheet_name, nrows=nrows)
+        except Exception as e:
+            raise Exception(f"Ошибка при чтении заголовка страницы '{sheet_name}': {e}")
     
     def read_all_excel_sheets(self):
         """Чтение всех страниц Excel файла"""
         try:
-            # Используем pandas.read_excel с sheet_name=None для чтения всех страниц
-            all_sheets = pd.read_excel(
-                io=self.excel_file_path,
-                sheet_name=None  # Это вернет словарь {sheet_name: DataFrame}
-            )
+            # sheet_name=None вернет словарь {sheet_name: DataFrame}
+            with self.workbook() as excel_file:
+                all_sheets = excel_file.parse(sheet_name=None)
 
             # # Ограничиваем только первыми 10 строками для каждого листа
             # for sheet_name in all_sheets:
@@ -47,14 +154,99 @@ class ExcelParser:
             raise Exception(f"Ошибка при чтении всех страниц Excel файла: {e}")
 
     
+    @staticmethod
+    def _header_names(header_row, width):
+        """Имена колонок как у pandas.read_excel: пустые - 'Unnamed: N', повторы - 'имя.1'"""
+        names = []
+        seen = {}
+        for index in range(width):
+            value = header_row[index] if index < len(header_row) else None
+            name = f"Unnamed: {index}" if value is None or value == '' else value
+            if name in seen:
+                seen[name] += 1
+                candidate = f"{name}.{seen[name]}"
+                while candidate in seen:
+                    seen[name] += 1
+                    candidate = f"{name}.{seen[name]}"
+                seen[candidate] = 0
+                name = candidate
+            else:
+                seen[name] = 0
+            names.append(name)
+        return names
+
+    def iter_sheet_chunks(self, sheet_name, chunk_size=None):
+        """Потоковое чтение страницы блоками по chunk_size строк (DataFrame на блок).
+
+        Для .xlsx используется openpyxl read_only: в памяти одновременно
+        находится только текущий блок. Прочие форматы читаются целиком
+        и отдаются теми же блоками.
+        """
+        chunk_size = chunk_size or EXCEL_CHUNK_ROWS
+
+        # Книга удерживается, пока читается лист; lock книги берется только
+        # на чтение очередного блока строк, не на время обработки блока
+        with self._workbook_entry() as entry:
+            with entry.lock:
+                streaming = (entry.excel_file.engine == 'openpyxl'
+                             and str(self.excel_file_path).lower().endswith(STREAMING_EXTENSIONS))
+            if not streaming:
+                df = self.read_excel_sheet(sheet_name)
+                for start in range(0, len(df), chunk_size):
+                    yield df.iloc[start:start + chunk_size].reset_index(drop=True)
+                return
+
+            with entry.lock:
+                try:
+                    worksheet = entry.excel_file.book[sheet_name]
+                except Exception as e:
+                    raise Exception(f"Ошибка при чтении страницы '{sheet_name}': {e}")
+
+                rows = worksheet.iter_rows(values_only=True)
+                header_row = next(rows, None)
+            if header_row is None:
+                return
+
+            # Ширина - по заголовку без пустых ячеек в конце (размерность листа
+            # в read_only берется из файла и бывает завышена); данные правее
+            # заголовка расширяют ее, как у pandas.read_excel
+            width = len(header_row)
+            while width and header_row[width - 1] in (None, ''):
+                width -= 1
+            columns = self._header_names(header_row, width)
+
+            while True:
+                with entry.lock:
+                    batch = list(islice(rows, chunk_size))
+                if not batch:
+                    return
+
+                chunk = []
+                for row in batch:
+                    if len(row) > width:
+                        used = len(row)
+                        while used > width and row[used - 1] in (None, ''):
+                            used -= 1
+                        if used > width:
+                            # Колонки 'Unnamed: N'; в уже отданных блоках их нет (пустые)
+                            width = used
+                            columns = self._header_names(header_row, width)
+                            chunk = [cells + (None,) * (width - len(cells)) for cells in chunk]
+                    if len(row) < width:
+                        row = row + (None,) * (width - len(row))
+                    chunk.append(row[:width])
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+
+    def iter_all_sheet_chunks(self, chunk_size=None):
+        """Потоковое чтение всех страниц: пары (имя страницы, блок DataFrame)"""
+        for sheet_name in self.get_sheet_names():
+            for chunk in self.iter_sheet_chunks(sheet_name, chunk_size):
+                yield sheet_name, chunk
+
     def get_sheet_columns_info(self, sheet_name):
         """Получить информацию о колонках конкретной страницы"""
         try:
-            df = pd.read_excel(
-                io=self.excel_file_path,
-                sheet_name=sheet_name,
-                nrows=1
-            )
+            df = self.read_sheet_head(sheet_name, nrows=1)
             return {
                 'columns': list(df.columns),
                 'dtypes': {col: str(df[col].dtype) for col in df.columns}
@@ -63,7 +255,7 @@ class ExcelParser:
             raise Exception(f"Ошибка при получении информации о колонках страницы '{sheet_name}': {e}")
     
     def get_all_sheets_info(self):
-        """Получить информацию о всех страницах и их колонках"""
+        """Получить информацию о всех страницах и их колонках (книга разбирается один раз)"""
         try:
             sheets_info = {}
             sheet_names = self.get_sheet_names()
@@ -1,4 +1,6 @@
 import re
+import numpy as np
+import pandas as pd
 from typing import Dict
 from datetime import datetime
 from models import FlightInfo
@@ -60,6 +62,24 @@ def convert_coord(coord: str) -> Dict[str, float]:
     except Exception:
         return {"latitude": None, "longitude": None}
 
+COORD_PATTERN = r'^(\d{2})(\d{2})([NnSs])(\d{3})(\d{2})([EeWw])'
+
+
+def convert_coord_series(coords: pd.Series) -> pd.DataFrame:
+    """
+    Векторный вариант convert_coord для колонки: DataFrame с колонками
+    latitude и longitude (float), некорректные значения - NaN
+    """
+    parts = coords.astype('string').str.extract(COORD_PATTERN)
+    # Знак по полушарию; у несовпавших строк NaN дают сами градусы
+    lat_sign = np.where(parts[2].isin(['S', 's']), -1.0, 1.0)
+    lon_sign = np.where(parts[5].isin(['W', 'w']), -1.0, 1.0)
+    degrees = parts[[0, 1, 3, 4]].astype(float)
+    return pd.DataFrame({
+        "latitude": lat_sign * (degrees[0] + degrees[1] / 60),
+        "longitude": lon_sign * (degrees[3] + degrees[4] / 60),
+    }, index=coords.index)
+
 def parse_flight_duration(dep: str, arr: str) -> float | None:
     """
     Преобразует время отправления и прибытия в длительность в минутах.
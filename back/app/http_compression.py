@@ -0,0 +1,214 @@
+# http_compression.py
+"""Сжатие ответов API (Content-Encoding): brotli, zstd или gzip.
+
+Кодировка выбирается по Accept-Encoding в порядке предпочтения сервера
+(HTTP_COMPRESS_ENCODINGS); brotli и zstandard необязательны - без них
+остается gzip. Сжимаются JSON/текстовые ответы от HTTP_COMPRESS_MIN_BYTES;
+потоковые ответы (StreamingResponse) сжимаются по частям.
+
+Выбранная кодировка передается эндпоинтам через response_encoding: кэш
+ответов (dependencies.cached_response) отдает заранее сжатое тело, а
+ответы, у которых Content-Encoding уже задан, middleware не трогает.
+Все ответы, которые могли быть сжаты (в том числе отданные без сжатия -
+меньше порога или клиенту без Accept-Encoding), получают
+Vary: Accept-Encoding, чтобы промежуточные кэши не отдали сжатое тело
+клиенту, который его не принимает, и наоборот.
+"""
+import os
+import gzip
+import zlib
+from contextvars import ContextVar
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Ответы меньше порога отдаются без сжатия
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv('HTTP_COMPRESS_MIN_BYTES', '1024'))
+# Кодировки в порядке предпочтения сервера
+HTTP_COMPRESS_ENCODINGS = os.getenv('HTTP_COMPRESS_ENCODINGS', 'br,zstd,gzip')
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 6
+
+COMPRESSIBLE_TYPES = (b"application/json", b"application/x-ndjson", b"text/")
+
+# Кодировка, выбранная для текущего запроса (None - без сжатия)
+response_encoding: ContextVar[Optional[str]] = ContextVar('response_encoding', default=None)
+
+
+def _available_encodings() -> list:
+    available = {'gzip'}
+    if brotli is not None:
+        available.add('br')
+    if zstandard is not None:
+        available.add('zstd')
+    return [name.strip() for name in HTTP_COMPRESS_ENCODINGS.split(',') if name.strip() in available]
+
+
+ENCODINGS = _available_encodings()
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Кодировка по заголовку Accept-Encoding (с учетом q=0 и *)"""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        params = params.strip()
+        quality = 1.0
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """Тело ответа целиком в кодировке encoding"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """Сжатие потокового ответа: каждая часть сбрасывается клиенту сразу"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            # wbits=31 - формат gzip (заголовок и CRC)
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.process(chunk) + self._compressor.flush()
+        if self.encoding == 'zstd':
+            return self._compressor.compress(chunk) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def _header(headers, name: bytes):
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _with_vary(headers) -> list:
+    """Заголовки ответа + Vary: Accept-Encoding (ответ зависит от кодировки)"""
+    vary = _header(headers, b"vary")
+    if vary is None:
+        return list(headers) + [(b"vary", b"Accept-Encoding")]
+    if b"accept-encoding" in vary.lower():
+        return list(headers)
+    return [(key, value + b", Accept-Encoding" if key.lower() == b"vary" else value)
+            for key, value in headers]
+
+
+def _varies(headers) -> bool:
+    """Ответ зависит от Accept-Encoding: уже сжат или мог быть сжат"""
+    if _header(headers, b"content-encoding") is not None:
+        return True
+    return (_header(headers, b"content-type") or b"").startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI-middleware: сжатие ответов по Accept-Encoding"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(scope["headers"], b"accept-encoding")
+        encoding = negotiate_encoding(accept.decode("latin-1")) if accept else None
+        if encoding is None:
+            async def send_with_vary(message):
+                if message["type"] == "http.response.start" and _varies(message.get("headers", [])):
+                    message = {**message, "headers": _with_vary(message.get("headers", []))}
+                await send(message)
+
+            await self.app(scope, receive, send_with_vary)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = _header(headers, b"content-type") or b""
+                if _header(headers, b"content-encoding") is not None:
+                    # Тело уже сжато (кэш ответов)
+                    passthrough = True
+                    await send({**message, "headers": _with_vary(headers)})
+                elif not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Решение - по первой части тела
+                    start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                headers = [(key, value) for key, value in start_message.get("headers", [])
+                           if key.lower() != b"content-length"]
+                if not more_body and len(body) < HTTP_COMPRESS_MIN_BYTES:
+                    passthrough = True
+                    await send({**start_message, "headers": _with_vary(start_message.get("headers", []))})
+                    await send(message)
+                    return
+                headers = _with_vary(headers) + [(b"content-encoding", encoding.encode())]
+                if not more_body:
+                    body = compress_body(body, encoding)
+                    headers.append((b"content-length", str(len(body)).encode()))
+                    await send({**start_message, "headers": headers})
+                    start_message = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                compressor = StreamCompressor(encoding)
+                await send({**start_message, "headers": headers})
+                start_message = None
+
+            if more_body:
+                await send({"type": "http.response.body", "body": compressor.compress(body), "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.compress(body) + compressor.finish()})
+
+        token = response_encoding.set(encoding)
+        try:
+            await self.app(scope, receive, send_compressed)
+        finally:
+            response_encoding.reset(token)
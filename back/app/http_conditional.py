@@ -0,0 +1,96 @@
+# http_conditional.py
+"""Условные GET-запросы по версии данных (ETag / If-None-Match).
+
+Ответы читающих эндпоинтов зависят только от данных таблицы, а данные
+меняются только при загрузке (версия в Redis, см. dependencies). Поэтому
+ETag - это номер версии, Last-Modified - время ее появления. Запрос с
+совпадающим If-None-Match (или If-Modified-Since не раньше Last-Modified)
+получает 304 до вызова эндпоинта - без обращения к БД и к кэшу ответов.
+Версия берется из памяти процесса (подписка на ее изменения, см.
+dependencies); пока она неизвестна (нет Redis, подписчик еще не получил
+версию), запросы проходят как обычно.
+"""
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from dependencies import known_dataset_version
+
+# Заголовок Cache-Control для ответов с ETag: no-cache - браузер хранит ответ,
+# но перед использованием сверяет версию (дешевый 304)
+HTTP_CACHE_CONTROL = os.getenv('HTTP_CACHE_CONTROL', 'no-cache')
+
+# Эндпоинты, ответ которых определяется версией данных ("/" - только корень)
+CONDITIONAL_PATHS = ("/statistics", "/city/", "/cities", "/stats/", "/flights/")
+
+
+def is_conditional_path(path: str) -> bool:
+    return path == "/" or path.startswith(CONDITIONAL_PATHS)
+
+
+def dataset_etag(version: int) -> str:
+    # Слабый ETag: тело может отличаться сжатием, данные - нет
+    return f'W/"dataset-{version}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение If-None-Match (список ETag через запятую или *)"""
+    opaque = etag[2:]
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, modified: int) -> bool:
+    try:
+        return parsedate_to_datetime(header).timestamp() >= modified
+    except (TypeError, ValueError):
+        return False
+
+
+class ConditionalGetMiddleware:
+    """ASGI-middleware: ETag/Last-Modified/Cache-Control и 304 для читающих эндпоинтов"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] not in ("GET", "HEAD")
+                or not is_conditional_path(scope["path"])):
+            await self.app(scope, receive, send)
+            return
+
+        # Только версия из памяти (поток-подписчик): middleware не ходит в Redis из event loop
+        version, modified = known_dataset_version()
+        if version is None:
+            await self.app(scope, receive, send)
+            return
+
+        validators = [(b"etag", dataset_etag(version).encode()),
+                      (b"cache-control", HTTP_CACHE_CONTROL.encode())]
+        if modified is not None:
+            validators.append((b"last-modified", formatdate(modified, usegmt=True).encode()))
+
+        headers = {name: value.decode("latin-1") for name, value in scope["headers"]}
+        if_none_match = headers.get(b"if-none-match")
+        if_modified_since = headers.get(b"if-modified-since")
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, dataset_etag(version))
+        else:
+            not_modified = (if_modified_since is not None and modified is not None
+                            and _not_modified_since(if_modified_since, modified))
+        if not_modified:
+            await send({"type": "http.response.start", "status": 304, "headers": validators})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_validators(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                present = {name.lower() for name, _ in message.get("headers", [])}
+                message["headers"] = list(message.get("headers", [])) + [
+                    header for header in validators if header[0] not in present
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
@@ -0,0 +1,16 @@
+# json_response.py
+"""Класс ответа по умолчанию: JSON через orjson (cache_codecs.dumps_json).
+
+datetime/date/time, Decimal и массивы numpy кодируются напрямую, без
+стандартного json. Эндпоинты с большими списками строк возвращают
+FastJSONResponse сами - тогда FastAPI не прогоняет данные через
+jsonable_encoder.
+"""
+from fastapi.responses import JSONResponse
+
+from cache_codecs import dumps_json
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps_json(content)
@@ -1,22 +1,30 @@
 from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks, Path
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy import func, text, distinct
+from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import Session
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 import os
 import sys
+import math
+import time
+import shutil
 import logging
 from pydantic import BaseModel
 import json
+import numpy as np
 from collections import defaultdict
-from flight_parsers import parse_coord, convert_coord, parse_flight_duration, parse_time
+from flight_parsers import parse_coord, convert_coord, parse_flight_duration
 import geopandas as gpd
 
 from fastapi import UploadFile, File
-from excel_parser import ExcelParser
-from data_processor import DataProcessor
+from excel_parser import ExcelParser, release_workbook
+from data_processor import DataProcessor, DuplicateRowKeysError, LOAD_MODE, LOAD_MODES, SOURCE_SHEET_COLUMN
+from shr_cache import get_shr_cache
 from postgres_loader import PostgresLoader 
+from sheet_pipeline import iter_prepared_sheets, resolve_workers
 
 
 # Настройка логирования
@@ -31,10 +39,18 @@ sys.path.append(os.path.dirname(__file__))
 
 # Импортируем из наших модулей
 from database import engine, SessionLocal, get_db
-from dependencies import get_cache_key, get_cached_data, set_cached_data
+from dependencies import get_cache_key, get_cached_data, set_cached_data, cached_response, cache_stats
+from schema_registry import schema_registry
+from region_rollup import rollup_table_name, UNKNOWN_DATE
+from json_response import FastJSONResponse
+from http_conditional import ConditionalGetMiddleware
+from http_compression import CompressionMiddleware
+from streaming import open_row_batches, ndjson_stream, json_document_stream, NDJSON_MEDIA_TYPE
 
 # Константа с именем целевой таблицы
 TARGET_TABLE = "excel_data_result_1"
+# Буфер копирования загружаемого файла на диск
+UPLOAD_COPY_BUFFER = 1024 * 1024
 
 # Модели для валидации данных
 class RegionCreate(BaseModel):
@@ -42,8 +58,12 @@ class RegionCreate(BaseModel):
     description: Optional[str] = None
 
 # Создание приложения
-app = FastAPI(title="БВС API", version="1.0.0")
+# Ответы кодируются orjson (json_response); большие списки строк эндпоинты
+# отдают FastJSONResponse сами, минуя jsonable_encoder
+app = FastAPI(title="БВС API", version="1.0.0", default_response_class=FastJSONResponse)
 
+# 304 по версии данных; подключается раньше CORS, чтобы CORS-заголовки были и у 304
+app.add_middleware(ConditionalGetMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -51,24 +71,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Сжатие ответов (gzip/brotli/zstd); кэш ответов отдает заранее сжатые тела
+app.add_middleware(CompressionMiddleware)
 
 def _find_column_case_insensitive(db: Session, table_name: str, target_columns: List[str]) -> Optional[str]:
-    """Находит имя колонки в таблице с учётом регистра."""
+    """Находит имя колонки в таблице с учётом регистра (по кэшу структуры таблицы)."""
     try:
-        result = db.execute(text("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = :table_name
-            AND table_schema = 'public'
-        """), {"table_name": table_name})
-
-        existing_columns = [row[0] for row in result.fetchall()]
-        target_columns_lower = [col.lower() for col in target_columns]
-
-        for existing_col in existing_columns:
-            if existing_col.lower() in target_columns_lower:
-                return existing_col
-        return None
+        return schema_registry.find_column(db, table_name, target_columns)
     except Exception as e:
         logger.error(f"Ошибка при поиске колонки: {e}")
         return None
@@ -81,6 +90,8 @@ def _execute_safe_query(db: Session, query: str, params: Optional[Dict] = None)
         return result
     except Exception as e:
         logger.error(f"Ошибка при выполнении запроса '{query}': {e}")
+        # Запрос мог сослаться на колонку, которой после перезагрузки таблицы нет
+        schema_registry.invalidate(TARGET_TABLE)
         raise HTTPException(status_code=500, detail=f"Ошибка базы данных: {str(e)}")
 
 def _get_required_columns(db: Session) -> Dict[str, str]:
@@ -141,7 +152,7 @@ async def startup_event():
 
 @app.get("/")
 async def get_main_data(db: Session = Depends(get_db)):
-    """Главная страница - возвращает все строки с основными полями"""
+    """Главная страница - возвращает все строки с основными полями (потоком, без сборки в памяти)"""
     try:
         # Получаем имена нужных колонок
         columns = _get_required_columns(db)
@@ -170,68 +181,114 @@ async def get_main_data(db: Session = Depends(get_db)):
         ]
 
         query = f"SELECT {', '.join(select_columns)} FROM {TARGET_TABLE}"
-        result = _execute_safe_query(db, query)
-
-        data = [dict(row) for row in result.mappings().all()]
-        return {
-            "data": data,
-            "count": len(data),
-            "columns": list(columns.keys())
-        }
+        try:
+            batches = open_row_batches(query)
+        except Exception:
+            schema_registry.invalidate(TARGET_TABLE)
+            raise
+
+        # Строки идут потоком из серверного курсора: {"data": [...], "count": N, "columns": [...]}
+        response_columns = list(columns.keys())
+        return StreamingResponse(
+            json_document_stream(batches, "data",
+                                 lambda count: {"count": count, "columns": response_columns}),
+            media_type="application/json"
+        )
     except Exception as e:
         logger.error(f"Ошибка на главной странице: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
+STATISTICS_FORMATS = ("json", "ndjson")
+STATISTICS_COUNT_MODES = ("exact", "approximate", "none")
+
+def _count_rows(db: Session, mode: str):
+    """(число строк таблицы, это оценка): exact - COUNT(*), approximate - оценка
+    планировщика (pg_class.reltuples, без чтения таблицы), none - не считать"""
+    if mode == "none":
+        return None, False
+    if mode == "approximate":
+        estimate = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+            {"table": TARGET_TABLE}
+        ).scalar()
+        # -1 - таблица еще не анализировалась, считаем точно
+        if estimate is not None and estimate >= 0:
+            return estimate, True
+    return db.execute(text(f"SELECT COUNT(*) FROM {TARGET_TABLE}")).scalar() or 0, False
+
 @app.get("/statistics")
 async def get_statistics(
-    limit: Optional[int] = Query(None, description="Лимит записей"),
-    offset: int = Query(0, description="Смещение"),
+    limit: Optional[int] = Query(None, ge=1, description="Лимит записей"),
+    offset: int = Query(0, ge=0, description="Смещение (для постраничного вывода лучше after_id)"),
+    after_id: Optional[int] = Query(None, description="Записи с id больше заданного (keyset-пагинация)"),
+    count: str = Query("exact", description="Общее число записей: exact, approximate (оценка) или none"),
+    output_format: str = Query("json", alias="format",
+                               description="json - один документ, ndjson - потоковая выгрузка по строке"),
     db: Session = Depends(get_db)
 ):
-    """Возвращает все данные таблицы (для статистики)"""
+    """
+    Возвращает все данные таблицы (для статистики).
+
+    Постраничный вывод - по id: ?after_id=<последний id страницы>&limit=N,
+    следующая страница - pagination.next_after_id. format=ndjson отдает
+    выборку потоком через серверный курсор (полная выгрузка не собирается
+    в памяти API).
+    """
+    if output_format not in STATISTICS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format должен быть одним из {STATISTICS_FORMATS}")
+    if count not in STATISTICS_COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count должен быть одним из {STATISTICS_COUNT_MODES}")
+    if offset and after_id is not None:
+        raise HTTPException(status_code=400, detail="offset и after_id нельзя задавать вместе")
     try:
         # Проверяем существование таблицы
-        table_exists = db.execute(text("""
-            SELECT EXISTS (
-                SELECT 1 FROM information_schema.tables
-                WHERE table_schema = 'public'
-                AND table_name = :table_name
-            )
-        """), {"table_name": TARGET_TABLE}).scalar()
-
-        if not table_exists:
+        if not schema_registry.has_table(db, TARGET_TABLE):
             raise HTTPException(status_code=404, detail=f"Таблица {TARGET_TABLE} не найдена")
 
-        # Получаем общее количество записей
-        total_count_result = db.execute(text(f"SELECT COUNT(*) FROM {TARGET_TABLE}"))
-        total_count = total_count_result.scalar() or 0  # Гарантируем, что total_count не None
-
-        # Получаем данные
-        if limit is None:
-            result = db.execute(text(f"SELECT * FROM {TARGET_TABLE} OFFSET :offset"), {"offset": offset})
-        else:
-            result = db.execute(
-                text(f"SELECT * FROM {TARGET_TABLE} LIMIT :limit OFFSET :offset"),
-                {"limit": limit, "offset": offset}
-            )
-
+        # Строки всегда упорядочены по id: next_after_id первой страницы
+        # продолжается следующей без пропусков и повторов
+        params = {}
+        query = f"SELECT * FROM {TARGET_TABLE}"
+        if after_id is not None:
+            # Keyset: страница начинается по индексу первичного ключа, без пропуска строк
+            query += " WHERE id > :after_id"
+            params["after_id"] = after_id
+        query += " ORDER BY id"
+        if limit is not None:
+            # Лишняя строка показывает, есть ли следующая страница
+            query += " LIMIT :limit"
+            params["limit"] = limit if output_format == "ndjson" else limit + 1
+        if offset:
+            query += " OFFSET :offset"
+            params["offset"] = offset
+
+        if output_format == "ndjson":
+            return StreamingResponse(ndjson_stream(open_row_batches(query, params)),
+                                     media_type=NDJSON_MEDIA_TYPE)
+
+        total_count, is_estimate = _count_rows(db, count)
+        result = db.execute(text(query), params)
         columns = result.keys()
         data = [dict(zip(columns, row)) for row in result.fetchall()]
 
-        # Исправляем проверку has_more
-        has_more = False
-        if limit is not None and total_count is not None:
-            has_more = (offset + limit) < total_count
+        has_more = limit is not None and len(data) > limit
+        if has_more:
+            data = data[:limit]
 
-        return {
+        return FastJSONResponse({
             "data": data,
             "pagination": {
                 "limit": limit,
                 "offset": offset,
+                "after_id": after_id,
+                "next_after_id": data[-1].get("id") if has_more and data else None,
                 "total": total_count,
+                "total_is_estimate": is_estimate,
                 "has_more": has_more
             }
-        }
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка в /statistics: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
@@ -262,23 +319,16 @@ async def get_city_data(
 
         result = _execute_safe_query(db, query, {"city_name": city_name})
 
-        # Преобразуем результат в список словарей
+        # Преобразуем результат в список словарей (datetime кодирует FastJSONResponse)
         columns = result.keys()
-        data = []
-        for row in result.fetchall():
-            row_dict = dict(zip(columns, row))
-            # Преобразуем datetime в строки, если есть такие поля
-            for key, value in row_dict.items():
-                if isinstance(value, datetime):
-                    row_dict[key] = value.isoformat()
-            data.append(row_dict)
+        data = [dict(zip(columns, row)) for row in result.fetchall()]
 
-        return {
+        return FastJSONResponse({
             "center": city_name,
             "data": data,
             "count": len(data),
             "column_used": center_column
-        }
+        })
 
     except HTTPException:
         raise
@@ -344,6 +394,11 @@ async def add_region(
 async def health():
     return {"status": "OK", "timestamp": datetime.now().isoformat()}
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Попадания в кэш ответов по уровням (память процесса / Redis)"""
+    return cache_stats()
+
 
 
 def init_region_map():
@@ -363,6 +418,7 @@ def init_region_map():
 ##### =============================================================================
 
 @app.get("/cities")
+@cached_response("/cities")
 async def get_cities(
     search: Optional[str] = Query(None, description="Поисковый запрос"),
     db: Session = Depends(get_db)
@@ -410,46 +466,110 @@ async def get_cities(
         logger.error(f"Ошибка в /cities: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
-@app.get("/stats/regions", response_model=List[Dict])
-def get_stats_regions(db: Session = Depends(get_db)):
+def _sql_time(column: str) -> str:
+    """Текстовое время 'HH:MM:SS' -> TIME в SQL; некорректные значения (ZZ:ZZ:00 и т.п.) -> NULL"""
+    return (f"CASE WHEN \"{column}\" ~ '^([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]$' "
+            f"THEN \"{column}\"::time END")
+
+def _sql_duration_minutes(departure: str, arrival: str) -> str:
+    """Длительность полета в минутах; посадка после полуночи (arrival < departure) - +24 ч"""
+    return (f"EXTRACT(EPOCH FROM ({arrival} - {departure})) / 60"
+            f" + CASE WHEN {arrival} < {departure} THEN 24 * 60 ELSE 0 END")
+
+def _duration_expression(db: Session) -> str:
+    """Длительность полета: колонка duration_minutes (считается при загрузке) или,
+    для таблиц без нее, вычисление по текстовым временам"""
+    if "duration_minutes" in schema_registry.columns(db, TARGET_TABLE):
+        return '"duration_minutes"'
+    return _sql_duration_minutes(_sql_time("departure_time"), _sql_time("arrival_time"))
+
+def _region_rollup(db: Session) -> Optional[str]:
+    """Сводка регион x день (region_rollup), если загрузчик ее построил"""
+    rollup = rollup_table_name(TARGET_TABLE)
+    return rollup if schema_registry.has_table(db, rollup) else None
+
+def _with_schema_retry(db: Session, fetch):
+    """
+    fetch(db) с одной повторной попыткой: если таблицы или колонки из кэша
+    структуры уже нет (ProgrammingError - их подменил или удалил другой
+    процесс), кэш сбрасывается и запрос строится заново
+    """
     try:
-        query = text("SELECT tsentr_es_orvd, departure_time, arrival_time FROM excel_data_result_1")
-        result = db.execute(query).mappings().all()  # <-- исправлено
-
-        stats = {}
-        for row in result:
-            region = row["tsentr_es_orvd"]
-            dep = parse_time(row["departure_time"])
-            arr = parse_time(row["arrival_time"])
-
-            if not region or not dep or not arr:
-                continue
-
-            duration = (arr - dep).total_seconds() / 60
-            if duration < 0:
-                duration += 24 * 60
-
-            if region not in stats:
-                stats[region] = {"num_flights": 0, "total_duration": 0}
+        return fetch(db)
+    except ProgrammingError as e:
+        logger.warning(f"Структура таблиц изменилась, запрос повторяется: {e}")
+        db.rollback()
+        schema_registry.invalidate()
+        return fetch(db)
 
-            stats[region]["num_flights"] += 1
-            stats[region]["total_duration"] += duration
+def _stats_regions_rows(db: Session):
+    """Регион, число полетов, средняя длительность: по сводке или по самой таблице"""
+    rollup = _region_rollup(db)
+    if rollup:
+        query = text(f"""
+            SELECT region, SUM(timed_flights)::bigint AS num_flights,
+                   SUM(duration_sum) / SUM(timed_flights) AS avg_duration
+            FROM {rollup}
+            WHERE region != ''
+            GROUP BY region
+            HAVING SUM(timed_flights) > 0
+            ORDER BY region
+        """)
+    else:
+        # Считается в БД одним GROUP BY: в приложение приходит по строке на регион
+        query = text(f"""
+            SELECT region, COUNT(*) AS num_flights, AVG(duration) AS avg_duration
+            FROM (
+                SELECT tsentr_es_orvd AS region, {_duration_expression(db)} AS duration
+                FROM {TARGET_TABLE}
+                WHERE tsentr_es_orvd IS NOT NULL AND tsentr_es_orvd != ''
+            ) flights
+            WHERE duration IS NOT NULL
+            GROUP BY region
+            ORDER BY region
+        """)
+    return db.execute(query).fetchall()
 
-        result_list = []
-        for region, data in stats.items():
-            avg_duration = data["total_duration"] / data["num_flights"] if data["num_flights"] > 0 else 0
-            result_list.append({
-                "region": region,
-                "num_flights": data["num_flights"],
-                "avg_flight_duration": round(avg_duration, 2)
-            })
+@app.get("/stats/regions", response_model=List[Dict])
+@cached_response("/stats/regions")
+def get_stats_regions(db: Session = Depends(get_db)):
+    try:
+        result = _with_schema_retry(db, _stats_regions_rows)
 
-        return result_list
+        return [
+            {
+                "region": row[0],
+                "num_flights": row[1],
+                "avg_flight_duration": round(float(row[2]), 2)
+            }
+            for row in result
+        ]
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при подсчете статистики: {e}")
 
 
+def _region_stats_row(db: Session, region_name: str):
+    """Число строк, полетов с длительностью и средняя длительность по региону"""
+    rollup = _region_rollup(db)
+    if rollup:
+        query = text(f"""
+            SELECT SUM(flights)::bigint AS rows, SUM(timed_flights)::bigint AS total_flights,
+                   SUM(duration_sum) / NULLIF(SUM(timed_flights), 0) AS avg_duration
+            FROM {rollup}
+            WHERE region = :region
+        """)
+    else:
+        query = text(f"""
+            SELECT COUNT(*) AS rows, COUNT(duration) AS total_flights, AVG(duration) AS avg_duration
+            FROM (
+                SELECT {_duration_expression(db)} AS duration
+                FROM {TARGET_TABLE}
+                WHERE tsentr_es_orvd = :region
+            ) flights
+        """)
+    return db.execute(query, {"region": region_name}).one()
+
 @app.get("/stats/region/{region_name}")
 def region_stats(region_name: str, db: Session = Depends(get_db)):
     """
@@ -458,24 +578,14 @@ def region_stats(region_name: str, db: Session = Depends(get_db)):
     - среднее время полета (минуты)
     """
     try:
-        query = text("""
-            SELECT departure_time, arrival_time
-            FROM excel_data_result_1
-            WHERE tsentr_es_orvd = :region
-        """)
-        result = db.execute(query, {"region": region_name}).fetchall()
+        rows, total_flights, avg_duration = _with_schema_retry(
+            db, lambda db: _region_stats_row(db, region_name)
+        )
 
-        if not result:
+        if not rows:
             raise HTTPException(status_code=404, detail="Регион не найден")
 
-        durations = []
-        for row in result:
-            dur = parse_flight_duration(row[0], row[1])
-            if dur is not None:
-                durations.append(dur)
-
-        total_flights = len(durations)
-        avg_duration = sum(durations) / total_flights if total_flights else 0
+        avg_duration = float(avg_duration) if total_flights else 0
 
         return {
             "region": region_name,
@@ -487,26 +597,159 @@ def region_stats(region_name: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Ошибка при подсчете статистики: {e}")
 
 
-@app.get("/flights/points", response_model=List[Dict])
-def get_flight_points(db: Session = Depends(get_db)):
+POINT_FORMATS = ("objects", "columns", "float32")
+# До какого масштаба карты (включительно) точки отдаются кластерами по сетке
+POINT_CLUSTER_MAX_ZOOM = int(os.getenv("POINT_CLUSTER_MAX_ZOOM", "8"))
+# Размер ячейки сетки кластеров в пикселях карты (тайл - 256 px)
+POINT_CLUSTER_CELL_PX = int(os.getenv("POINT_CLUSTER_CELL_PX", "64"))
+
+def _parse_bbox(bbox: str) -> List[tuple]:
     """
-    Возвращает список точек взлета для всех рейсов: id + координаты
+    'запад,юг,восток,север' в градусах -> список прямоугольников (lon_min, lat_min, lon_max, lat_max);
+    область через 180-й меридиан (запад > восток) делится на два
     """
     try:
-        query = text("SELECT id, dep_1 FROM excel_data_result_1 WHERE dep_1 IS NOT NULL")
-        result = db.execute(query)
-        points = []
-
-        for row in result.fetchall():
-            # row[0] - это id, row[1] - dep_1
-            coords = convert_coord(row[1])
-            if coords["latitude"] is not None and coords["longitude"] is not None:
-                points.append({
-                    "id": row[0],
-                    "latitude": coords["latitude"],
-                    "longitude": coords["longitude"]
-                })
-        return points
+        west, south, east, north = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox: ожидается 'запад,юг,восток,север' в градусах")
+    if south > north:
+        raise HTTPException(status_code=400, detail="bbox: юг больше севера")
+    if west > east:
+        return [(west, south, 180.0, north), (-180.0, south, east, north)]
+    return [(west, south, east, north)]
+
+def _cluster_cell_degrees(zoom: int) -> float:
+    """Размер ячейки сетки в градусах для масштаба zoom (web mercator, тайлы 256 px)"""
+    return 360.0 * POINT_CLUSTER_CELL_PX / (256 * 2 ** zoom)
+
+def _points_float32(first, latitudes, longitudes, headers) -> Response:
+    """Точки в бинарном виде: N x int32 (id или число точек кластера), N x float32 широта,
+    N x float32 долгота (little-endian)"""
+    body = b"".join([
+        np.asarray(first, dtype="<i4").tobytes(),
+        np.asarray(latitudes, dtype="<f4").tobytes(),
+        np.asarray(longitudes, dtype="<f4").tobytes(),
+    ])
+    return Response(content=body, media_type="application/octet-stream",
+                    headers={"X-Point-Count": str(len(first)), **headers})
+
+def _legacy_points(db: Session, boxes, cell) -> List[tuple]:
+    """Точки таблиц, загруженных до появления dep_lat/dep_lon: разбор dep_1 по строкам"""
+    rows = []
+    query = text(f"SELECT id, dep_1 FROM {TARGET_TABLE} WHERE dep_1 IS NOT NULL")
+    for flight_id, dep in db.execute(query).fetchall():
+        coords = convert_coord(dep)
+        latitude, longitude = coords["latitude"], coords["longitude"]
+        if latitude is None or longitude is None:
+            continue
+        if boxes and not any(w <= longitude <= e and s <= latitude <= n for w, s, e, n in boxes):
+            continue
+        rows.append((flight_id, latitude, longitude))
+    if cell is None:
+        return rows
+
+    clusters = defaultdict(lambda: [0, 0.0, 0.0])
+    for _, latitude, longitude in rows:
+        cluster = clusters[(longitude // cell, latitude // cell)]
+        cluster[0] += 1
+        cluster[1] += latitude
+        cluster[2] += longitude
+    return [(count, lat_sum / count, lon_sum / count) for count, lat_sum, lon_sum in clusters.values()]
+
+def _snap_bbox(bbox: str, step: float) -> str:
+    """
+    bbox, расширенный наружу до сетки с шагом step градусов: при сдвиге карты
+    в пределах ячейки получается тот же bbox, а значит и тот же ключ кэша
+    """
+    _parse_bbox(bbox)
+    west, south, east, north = (float(value) for value in bbox.split(","))
+    snapped_west = max(math.floor(west / step) * step, -180.0)
+    snapped_east = min(math.ceil(east / step) * step, 180.0)
+    if west > east and snapped_west <= snapped_east:
+        # Область через 180-й меридиан после расширения покрывает все долготы
+        snapped_west, snapped_east = -180.0, 180.0
+    snapped_south = max(math.floor(south / step) * step, -90.0)
+    snapped_north = min(math.ceil(north / step) * step, 90.0)
+    return ",".join(f"{value:.6f}" for value in (snapped_west, snapped_south, snapped_east, snapped_north))
+
+@app.get("/flights/points")
+def get_flight_points(
+    output_format: str = Query("objects", alias="format",
+                               description="objects - список {id, latitude, longitude}, "
+                                           "columns - параллельные массивы, float32 - бинарный буфер"),
+    bbox: Optional[str] = Query(None, description="Видимая область: запад,юг,восток,север (градусы)"),
+    zoom: Optional[int] = Query(None, ge=0, le=24, description="Масштаб карты; при малом - кластеры"),
+    db: Session = Depends(get_db)
+):
+    """
+    Возвращает список точек взлета для всех рейсов: id + координаты.
+
+    bbox ограничивает точки видимой областью (GiST-индекс по point(dep_lon, dep_lat)).
+    При zoom <= POINT_CLUSTER_MAX_ZOOM вместо точек отдаются кластеры по сетке
+    ({count, latitude, longitude}, координаты - центр масс): размер ответа
+    ограничен числом ячеек на экране, а не размером таблицы.
+
+    Для кэша bbox расширяется до сетки кластеров (или тайлов масштаба zoom),
+    поэтому число ключей ограничено сеткой, а не каждым сдвигом карты;
+    bbox без zoom не кэшируется. format=float32 тоже идет мимо кэша ответов
+    (он хранит только JSON) и каждый раз читается из БД.
+    """
+    if output_format not in POINT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format должен быть одним из {POINT_FORMATS}")
+    clustered = zoom is not None and zoom <= POINT_CLUSTER_MAX_ZOOM
+    if output_format == "float32" or (bbox and zoom is None):
+        return _flight_points.__wrapped__(output_format=output_format, bbox=bbox, zoom=zoom, db=db)
+    if bbox:
+        step = _cluster_cell_degrees(zoom) if clustered else 360.0 / 2 ** zoom
+        bbox = _snap_bbox(bbox, step)
+    elif not clustered:
+        # Без bbox и кластеров масштаб на ответ не влияет
+        zoom = None
+    return _flight_points(output_format=output_format, bbox=bbox, zoom=zoom, db=db)
+
+@cached_response("/flights/points")
+def _flight_points(output_format: str, bbox: Optional[str], zoom: Optional[int], db: Session):
+    """Точки или кластеры для get_flight_points (параметры уже проверены и нормализованы)"""
+    boxes = _parse_bbox(bbox) if bbox else []
+    cell = _cluster_cell_degrees(zoom) if zoom is not None and zoom <= POINT_CLUSTER_MAX_ZOOM else None
+    try:
+        if {"dep_lat", "dep_lon"} <= set(schema_registry.columns(db, TARGET_TABLE)):
+            # Координаты разобраны при загрузке - фильтр и кластеры считаются в БД
+            params = {}
+            conditions = ["dep_lat IS NOT NULL"]
+            if boxes:
+                box_conditions = []
+                for i, box in enumerate(boxes):
+                    box_conditions.append(
+                        f"point(dep_lon, dep_lat) <@ box(point(:w{i}, :s{i}), point(:e{i}, :n{i}))"
+                    )
+                    params.update(zip((f"w{i}", f"s{i}", f"e{i}", f"n{i}"), box))
+                conditions.append(f"({' OR '.join(box_conditions)})")
+            where = " AND ".join(conditions)
+
+            if cell is None:
+                query = f"SELECT id, dep_lat, dep_lon FROM {TARGET_TABLE} WHERE {where} ORDER BY id"
+            else:
+                params["cell"] = cell
+                query = f"""
+                    SELECT COUNT(*)::int, AVG(dep_lat), AVG(dep_lon)
+                    FROM {TARGET_TABLE}
+                    WHERE {where}
+                    GROUP BY floor(dep_lon / :cell), floor(dep_lat / :cell)
+                """
+            rows = db.execute(text(query), params).fetchall()
+        else:
+            rows = _legacy_points(db, boxes, cell)
+
+        first_name = "id" if cell is None else "count"
+        if output_format == "objects":
+            return [{first_name: first, "latitude": latitude, "longitude": longitude}
+                    for first, latitude, longitude in rows]
+        first, latitudes, longitudes = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+        if output_format == "columns":
+            return {first_name: first, "latitude": latitudes, "longitude": longitudes}
+        return _points_float32(first, latitudes, longitudes,
+                               {"X-Clustered": "0" if cell is None else "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении точек: {e}")
     
@@ -578,7 +821,8 @@ async def get_flight_zone(
             "flight_time": {
                 "departure_time": departure_time,
                 "arrival_time": arrival_time,
-                "duration_minutes": parse_flight_duration(departure_time, arrival_time)
+                "duration_minutes": (flight_dict["duration_minutes"] if "duration_minutes" in flight_dict
+                                     else parse_flight_duration(departure_time, arrival_time))
             },
             "registration_number": flight_dict.get("reg"),
             "date_of_flight": flight_dict.get("dof"),
@@ -598,50 +842,71 @@ async def get_flight_zone(
         logger.error(f"Ошибка в /flights/{flight_id}/flight_zone: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при получении данных о зоне полета: {str(e)}")
         
-@app.get("/stats/regions/monthly")
-async def get_regions_monthly_stats(db: Session = Depends(get_db)):
-    """Возвращает количество полетов для каждого региона по месяцам"""
-    try:
-        # Ищем колонку с датой полета
+def _regions_monthly_rows(db: Session):
+    """Строки регион, месяц, число полетов и использованные колонки даты и региона"""
+    rollup = _region_rollup(db)
+    # Колонка с датой полета: flight_date (DATE, заполняется при загрузке)
+    # или текстовая DOF в формате DDMMYY
+    date_column = "flight_date" if rollup else _find_column_case_insensitive(db, TARGET_TABLE, ["flight_date"])
+    if date_column:
+        month_expression = f'EXTRACT(MONTH FROM "{date_column}")'
+        date_filter = f'"{date_column}" IS NOT NULL'
+    else:
         date_column = _find_column_case_insensitive(db, TARGET_TABLE, [
             "dof", "DOF", "date_of_flight", "date", "дата"
         ])
+        month_expression = f"""EXTRACT(MONTH FROM TO_DATE("{date_column}", 'DDMMYY'))"""
+        date_filter = f'"{date_column}" IS NOT NULL AND "{date_column}" != \'\''
         
-        # Ищем колонку с регионом (центром ЕС ОРВД)
-        region_column = _find_column_case_insensitive(db, TARGET_TABLE, [
-            "tsentr_es_orvd", "TSENTR_ES_ORVD", "центр", "center", "region"
-        ])
-
-        if not date_column or not region_column:
-            raise HTTPException(
-                status_code=400,
-                detail="Не найдены необходимые колонки для анализа (дата и регион)"
-            )
-
-        # Словарь названий месяцев
-        month_names = {
-            1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
-            5: "Май", 6: "Июнь", 7: "Июль", 8: "Август", 
-            9: "Сентябрь", 10: "Октябрь", 11: "Ноябрь", 12: "Декабрь"
-        }
+    # Ищем колонку с регионом (центром ЕС ОРВД)
+    region_column = "tsentr_es_orvd" if rollup else _find_column_case_insensitive(db, TARGET_TABLE, [
+        "tsentr_es_orvd", "TSENTR_ES_ORVD", "центр", "center", "region"
+    ])
+
+    if not date_column or not region_column:
+        raise HTTPException(
+            status_code=400,
+            detail="Не найдены необходимые колонки для анализа (дата и регион)"
+        )
 
-        # Запрос для группировки по регионам и месяцам
+    # Запрос для группировки по регионам и месяцам
+    if rollup:
+        query = text(f"""
+            SELECT region, EXTRACT(MONTH FROM flight_date) AS month, SUM(flights)::bigint AS flight_count
+            FROM {rollup}
+            WHERE flight_date != {UNKNOWN_DATE} AND region != ''
+            GROUP BY region, month
+            ORDER BY region, month
+        """)
+    else:
         query = text(f"""
             SELECT 
                 "{region_column}" as region,
-                EXTRACT(MONTH FROM TO_DATE("{date_column}", 'DDMMYY')) as month,
+                {month_expression} as month,
                 COUNT(*) as flight_count
             FROM {TARGET_TABLE}
-            WHERE "{date_column}" IS NOT NULL 
-            AND "{date_column}" != ''
+            WHERE {date_filter}
             AND "{region_column}" IS NOT NULL
             AND "{region_column}" != ''
             GROUP BY "{region_column}", month
             ORDER BY "{region_column}", month
         """)
 
-        result = db.execute(query)
-        stats_data = result.fetchall()
+    return db.execute(query).fetchall(), date_column, region_column
+
+@app.get("/stats/regions/monthly")
+@cached_response("/stats/regions/monthly")
+async def get_regions_monthly_stats(db: Session = Depends(get_db)):
+    """Возвращает количество полетов для каждого региона по месяцам"""
+    try:
+        stats_data, date_column, region_column = _with_schema_retry(db, _regions_monthly_rows)
+
+        # Словарь названий месяцев
+        month_names = {
+            1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
+            5: "Май", 6: "Июнь", 7: "Июль", 8: "Август", 
+            9: "Сентябрь", 10: "Октябрь", 11: "Ноябрь", 12: "Декабрь"
+        }
 
         # Форматируем данные в удобную структуру
         regions_stats = {}
@@ -697,54 +962,111 @@ async def get_regions_monthly_stats(db: Session = Depends(get_db)):
 
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_file(
+    file: UploadFile = File(...),
+    mode: Optional[str] = Query(None, description="upsert - дописать новые строки, replace - пересобрать таблицу"),
+    db: Session = Depends(get_db)
+):
+    mode = mode or LOAD_MODE
+    if mode not in LOAD_MODES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный режим загрузки: {mode}")
+    upsert = mode == 'upsert'
+
     try:
-        logger.info(f"Начало загрузки файла: {file.filename}")
+        logger.info(f"Начало загрузки файла: {file.filename} (режим {mode})")
         
-        # Сохраняем файл временно
-        contents = await file.read()
+        # Сохраняем файл временно (копированием по частям, без чтения в память целиком)
         temp_filename = f"temp_{file.filename}"
         with open(temp_filename, "wb") as f:
-            f.write(contents)
+            shutil.copyfileobj(file.file, f, UPLOAD_COPY_BUFFER)
         logger.info(f"Файл сохранен как: {temp_filename}")
 
-        # Парсим Excel
         excel_parser = ExcelParser()
         excel_parser.excel_file_path = temp_filename
-        all_sheets = excel_parser.read_all_excel_sheets()
-        logger.info(f"Прочитано листов: {len(all_sheets)}")
+        sheet_names = excel_parser.get_sheet_names()
+        logger.info(f"Листов в файле: {len(sheet_names)}")
 
         # Обрабатываем и загружаем данные используя существующую сессию БД
         data_processor = DataProcessor(db_session=db)
         
+        # replace: все листы попадают в одну staging-таблицу (первый пересоздает ее,
+        # остальные дописываются), живая таблица подменяется один раз в конце.
+        # upsert: листы дописываются в живую таблицу, уже загруженные строки
+        # (по row_key) пропускаются
         total_records = 0
-        for sheet_name, df in all_sheets.items():
-            logger.info(f"Обработка листа: {sheet_name}, строк: {len(df)}")
-            
-            # Очищаем данные - используем статический метод ПРАВИЛЬНО
-            df_cleaned = DataProcessor.clean_dataframe(df)  # Просто вызываем как статический метод
-            logger.info(f"После очистки: {len(df_cleaned)} строк")
-            
-            if not df_cleaned.empty:
-                # Дешифруем поля плана полета
-                df_decoded = data_processor.decode_flight_plan_fields(df_cleaned)
-                logger.info(f"После декодирования: {len(df_decoded)} строк")
-                
-                # Сохраняем в таблицу
-                result = data_processor.save_to_table_with_id(df_decoded, TARGET_TABLE)
+        skipped_records = 0
+        sheet_timings = {}
+        append = False
+        workers = resolve_workers(None, len(sheet_names))
+        if workers > 1:
+            # SHEET_WORKERS > 1: листы читаются целиком, очищаются и дешифруются
+            # параллельно в процессах, загрузка - по мере готовности в порядке листов
+            excel_parser.close()
+            for prepared in iter_prepared_sheets(temp_filename, sheet_names, workers,
+                                                 source_column=SOURCE_SHEET_COLUMN):
+                sheet_name = prepared['sheet_name']
+                timings = sheet_timings[sheet_name] = prepared['timings']
+                if prepared['data'].empty:
+                    logger.warning(f"Лист {sheet_name} пуст после очистки")
+                    continue
+
+                started = time.perf_counter()
+                data = prepared['data']
+                if upsert:
+                    result = data_processor.upsert_to_table(
+                        data_processor.drop_loaded_rows(data, TARGET_TABLE), TARGET_TABLE
+                    )
+                    result["skipped"] = len(data) - result.get("added", 0)
+                else:
+                    result = data_processor.save_to_table_with_id(
+                        data, TARGET_TABLE, append=append, publish=False
+                    )
+                    append = True
+                timings['load_seconds'] = round(time.perf_counter() - started, 3)
                 total_records += result.get("added", 0)
-                logger.info(f"Сохранено в базу: {result.get('added', 0)} записей")
-            else:
-                logger.warning(f"Лист {sheet_name} пуст после очистки")
+                skipped_records += result.get("skipped", 0)
+                logger.info(f"Лист {sheet_name}: сохранено {result.get('added', 0)} записей, {timings}")
+        else:
+            # Один процесс: лист читается потоково блоками по EXCEL_CHUNK_ROWS строк
+            for sheet_name in sheet_names:
+                logger.info(f"Обработка листа: {sheet_name}")
+                started = time.perf_counter()
+                
+                # Очистка -> дешифровка -> сохранение блоками
+                result = data_processor.load_sheet_chunks(
+                    excel_parser.iter_sheet_chunks(sheet_name), TARGET_TABLE, append=append, publish=False,
+                    sheet_name=sheet_name, upsert=upsert
+                )
+                sheet_timings[sheet_name] = {
+                    'rows': result.get("total", 0),
+                    'added': result.get("added", 0),
+                    'total_seconds': round(time.perf_counter() - started, 3)
+                }
+                skipped_records += result.get("skipped", 0)
+                if result.get("added", 0):
+                    append = True
+                    total_records += result.get("added", 0)
+                    logger.info(f"Сохранено в базу: {result.get('added', 0)} записей")
+                elif not result.get("total", 0):
+                    logger.warning(f"Лист {sheet_name} пуст после очистки")
+
+        if total_records and not upsert:
+            data_processor.publish_table(TARGET_TABLE)
 
         # Удаляем временный файл
+        excel_parser.close()
         os.remove(temp_filename)
         logger.info(f"Временный файл удален")
 
+        shr_cache = get_shr_cache()
         return {
-            "message": f"Успешно загружено {len(all_sheets)} листов, {total_records} записей в {TARGET_TABLE}",
-            "sheets_processed": len(all_sheets),
-            "records_added": total_records
+            "message": f"Успешно загружено {len(sheet_names)} листов, {total_records} записей в {TARGET_TABLE}",
+            "sheets_processed": len(sheet_names),
+            "records_added": total_records,
+            "records_skipped": skipped_records,
+            "mode": mode,
+            "sheets": sheet_timings,
+            "shr_cache": shr_cache.stats() if shr_cache else None
         }
         
     except Exception as e:
@@ -752,10 +1074,13 @@ async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db
         # Убедимся, что временный файл удален даже при ошибке
         try:
             if 'temp_filename' in locals():
+                release_workbook(temp_filename)
                 os.remove(temp_filename)
         except:
             pass
-        raise HTTPException(status_code=500, detail=f"Ошибка при загрузке: {str(e)}")
+        # Повторы row_key в живой таблице - ошибка режима загрузки, а не сервера
+        status_code = 409 if isinstance(e, DuplicateRowKeysError) else 500
+        raise HTTPException(status_code=status_code, detail=f"Ошибка при загрузке: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,78 @@
+# pg_copy.py
+"""Массовая загрузка DataFrame в PostgreSQL через COPY ... FROM STDIN.
+
+Вместо параметризованных INSERT (to_sql) данные блоками сериализуются в CSV
+в памяти и передаются через psycopg2 copy_expert. Таблица должна уже
+существовать; типы колонок задает DataProcessor.map_pandas_to_postgres_types.
+"""
+import io
+import os
+import logging
+
+import pandas as pd
+from sqlalchemy import types as sa_types
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном блоке COPY (размер буфера CSV в памяти)
+COPY_CHUNK_ROWS = int(os.getenv('COPY_CHUNK_ROWS', '50000'))
+
+# Маркер NULL в CSV: пустая строка остается пустой строкой, а не NULL
+NULL_MARKER = '\\N'
+
+_INTEGER_TYPES = (sa_types.BigInteger, sa_types.Integer, sa_types.SmallInteger)
+
+
+def _integer_columns(df, dtypes):
+    """Колонки с целочисленным типом в БД, значения которых pandas хранит как float/object"""
+    columns = []
+    for col, col_type in (dtypes or {}).items():
+        if col not in df.columns:
+            continue
+        is_integer = (isinstance(col_type, type) and issubclass(col_type, _INTEGER_TYPES)) \
+            or isinstance(col_type, _INTEGER_TYPES)
+        if is_integer and not pd.api.types.is_integer_dtype(df[col].dtype):
+            columns.append(col)
+    return columns
+
+
+def _to_csv(chunk: pd.DataFrame, integer_columns) -> io.StringIO:
+    """Блок в CSV без заголовка; целые числа без '.0', чтобы COPY принял их в BIGINT"""
+    if integer_columns:
+        chunk = chunk.copy()
+        for col in integer_columns:
+            try:
+                chunk[col] = pd.to_numeric(chunk[col]).astype('Int64')
+            except (ValueError, TypeError):
+                # Нецелые значения оставляем как есть - ошибку покажет сама БД
+                pass
+
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, index=False, header=False, na_rep=NULL_MARKER)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_dataframe(connection, df: pd.DataFrame, table_name: str, dtypes=None, chunk_rows=None) -> int:
+    """Загружает df в существующую таблицу через COPY блоками по chunk_rows строк.
+
+    connection - соединение SQLAlchemy (транзакцией управляет вызывающий код).
+    Возвращает количество загруженных строк.
+    """
+    if df.empty:
+        return 0
+
+    chunk_rows = chunk_rows or COPY_CHUNK_ROWS
+    columns = ', '.join(f'"{col}"' for col in df.columns)
+    copy_sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')"
+    integer_columns = _integer_columns(df, dtypes)
+
+    cursor = connection.connection.cursor()
+    try:
+        for start in range(0, len(df), chunk_rows):
+            cursor.copy_expert(copy_sql, _to_csv(df.iloc[start:start + chunk_rows], integer_columns))
+    finally:
+        cursor.close()
+
+    logger.info(f"COPY в {table_name}: {len(df)} строк")
+    return len(df)
@@ -3,6 +3,10 @@ import psycopg2
 import pandas as pd
 from sqlalchemy import text
 from data_integrator import DatabaseConfig  # Changed from config.database
+from pg_copy import copy_dataframe
+from schema_registry import schema_registry
+from region_rollup import ROLLUP_SOURCE_COLUMNS, rollup_table_name, build_rollup
+from dependencies import bump_dataset_version
 
 class PostgresLoader:
     """Загрузчик данных в PostgreSQL"""
@@ -52,6 +56,11 @@ class PostgresLoader:
     def load_data(self, df, table_name, if_exists='replace'):
         """
         Загрузка данных в PostgreSQL
+
+        После загрузки - те же шаги, что у DataProcessor.publish_table:
+        сводка по регионам пересчитывается (или удаляется, если колонок для
+        нее нет), кэш структуры таблиц сбрасывается, версия данных
+        увеличивается, чтобы кэши ответов перестали отдавать старые данные.
         
         Args:
             df (DataFrame): DataFrame с данными
@@ -63,19 +72,33 @@ class PostgresLoader:
             from data_processor import DataProcessor  # Changed from parsers.data_processor
             dtypes = DataProcessor.map_pandas_to_postgres_types(df)
             
-            # Создаем таблицу если нужно
-            if if_exists == 'replace':
-                self.create_table(table_name, dtypes)
-            
-            # Загружаем данные
-            df.to_sql(
-                table_name,
-                self.engine,
-                if_exists=if_exists,
-                index=False,
-                dtype=dtypes,
-                method='multi'  # Для более быстрой вставки
-            )
+            with self.engine.begin() as conn:
+                # Создаем (или пересоздаем) пустую таблицу с нужными типами
+                df.head(0).to_sql(
+                    table_name,
+                    conn,
+                    if_exists=if_exists,
+                    index=False,
+                    dtype=dtypes
+                )
+                
+                # Загружаем данные через COPY (вместо многострочных INSERT)
+                copy_dataframe(conn, df, table_name, dtypes)
+
+                # Колонки - по самой таблице: при append в ней могут быть и другие
+                table_columns = set(conn.execute(text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :table"
+                ), {"table": table_name}).scalars().all())
+                rollup = rollup_table_name(table_name)
+                if ROLLUP_SOURCE_COLUMNS <= table_columns:
+                    build_rollup(conn, table_name, rollup)
+                else:
+                    conn.execute(text(f"DROP TABLE IF EXISTS {rollup}"))
+
+            schema_registry.invalidate(table_name)
+            schema_registry.invalidate(rollup)
+            bump_dataset_version()
             
             print(f"Данные успешно загружены в таблицу {table_name}")
             
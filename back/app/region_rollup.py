@@ -0,0 +1,92 @@
+# region_rollup.py
+"""Сводная таблица регион x день для статистики по регионам.
+
+{таблица}_region_daily хранит по каждому региону (tsentr_es_orvd) и дню
+полета число строк, число полетов с известной длительностью и сумму
+длительностей. Ее поддерживает загрузчик (DataProcessor): при полной
+перезагрузке сводка пересчитывается по staging-таблице и подменяется
+вместе с ней, в режиме upsert к ней прибавляются только вставленные строки.
+Эндпоинты статистики читают сводку (десятки строк на регион) вместо
+агрегации по всей таблице.
+
+Строки без даты полета учитываются с flight_date = 'infinity' (build_rollup
+возвращает их число, загрузчик пишет его в лог); в помесячную статистику
+они не попадают.
+"""
+from sqlalchemy import text
+
+# Колонки данных, по которым строится сводка
+ROLLUP_SOURCE_COLUMNS = {'tsentr_es_orvd', 'flight_date', 'duration_minutes'}
+UNKNOWN_DATE = "'infinity'::date"
+
+
+def rollup_table_name(table_name: str) -> str:
+    return f"{table_name}_region_daily"
+
+
+def _aggregate_sql(source: str) -> str:
+    """Агрегат по регионам и дням из таблицы (или CTE) source"""
+    return f"""
+        SELECT tsentr_es_orvd AS region,
+               COALESCE(flight_date, {UNKNOWN_DATE}) AS flight_date,
+               COUNT(*) AS flights,
+               COUNT(duration_minutes) AS timed_flights,
+               COALESCE(SUM(duration_minutes), 0) AS duration_sum
+        FROM {source}
+        WHERE tsentr_es_orvd IS NOT NULL
+        GROUP BY 1, 2
+    """
+
+
+def create_rollup_table(connection, rollup: str):
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {rollup} (
+            region TEXT NOT NULL,
+            flight_date DATE NOT NULL,
+            flights BIGINT NOT NULL,
+            timed_flights BIGINT NOT NULL,
+            duration_sum DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (region, flight_date)
+        )
+    """))
+
+
+def build_rollup(connection, source_table: str, rollup: str) -> int:
+    """Создает и заполняет сводку по всей таблице source_table; возвращает число строк без даты полета"""
+    connection.execute(text(f"DROP TABLE IF EXISTS {rollup}"))
+    create_rollup_table(connection, rollup)
+    connection.execute(text(f"INSERT INTO {rollup} {_aggregate_sql(source_table)}"))
+    return connection.execute(text(
+        f"SELECT COALESCE(SUM(flights), 0) FROM {rollup} WHERE flight_date = {UNKNOWN_DATE}"
+    )).scalar()
+
+
+def replace_rollup(connection, staging_rollup: str, rollup: str):
+    """Подменяет содержимое сводки заранее посчитанной (в транзакции подмены таблицы)"""
+    create_rollup_table(connection, rollup)
+    connection.execute(text(f"TRUNCATE {rollup}"))
+    connection.execute(text(f"INSERT INTO {rollup} SELECT * FROM {staging_rollup}"))
+    connection.execute(text(f"DROP TABLE {staging_rollup}"))
+
+
+def insert_with_rollup(connection, table_name: str, source: str, columns: str, conflict_column: str) -> int:
+    """
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING из source в table_name и
+    прибавление вставленных строк к сводке - одним запросом.
+    Возвращает число вставленных строк.
+    """
+    rollup = rollup_table_name(table_name)
+    return connection.execute(text(f"""
+        WITH inserted AS (
+            INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {source}
+            ON CONFLICT ({conflict_column}) DO NOTHING
+            RETURNING tsentr_es_orvd, flight_date, duration_minutes
+        ), rolled AS (
+            INSERT INTO {rollup} {_aggregate_sql('inserted')}
+            ON CONFLICT (region, flight_date) DO UPDATE SET
+                flights = {rollup}.flights + EXCLUDED.flights,
+                timed_flights = {rollup}.timed_flights + EXCLUDED.timed_flights,
+                duration_sum = {rollup}.duration_sum + EXCLUDED.duration_sum
+        )
+        SELECT COUNT(*) FROM inserted
+    """)).scalar()
@@ -0,0 +1,83 @@
+# schema_registry.py
+"""Кэш структуры таблиц в памяти процесса.
+
+Колонки таблицы читаются из information_schema один раз, дальше поиск
+колонок (в том числе без учета регистра) идет по памяти. DataProcessor
+сбрасывает запись, когда подменяет, создает или расширяет таблицу; в
+остальных процессах API кэш сбрасывается при смене версии данных (подписка
+в dependencies). SCHEMA_CACHE_TTL ограничивает срок жизни записи на случай,
+если подписки нет.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Срок жизни записи о таблице, секунд (0 - без ограничения)
+SCHEMA_CACHE_TTL = float(os.getenv('SCHEMA_CACHE_TTL', '300'))
+
+
+class SchemaRegistry:
+    """Колонки таблиц схемы public по порядку (ordinal_position)"""
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = SCHEMA_CACHE_TTL if ttl is None else ttl
+        self._tables: Dict[str, Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+        # Номер поколения: чтение, начатое до invalidate, не попадает в кэш
+        self._generation = 0
+
+    def _fresh(self, entry) -> bool:
+        return entry is not None and (self.ttl <= 0 or time.monotonic() - entry[0] < self.ttl)
+
+    def columns(self, db, table_name: str) -> List[str]:
+        """Колонки таблицы; пустой список - таблицы нет (такой ответ не кэшируется)"""
+        with self._lock:
+            entry = self._tables.get(table_name)
+            generation = self._generation
+        if self._fresh(entry):
+            return entry[1]
+
+        columns = list(db.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = :table_name
+            AND table_schema = 'public'
+            ORDER BY ordinal_position
+        """), {"table_name": table_name}).scalars().all())
+
+        if columns:
+            with self._lock:
+                if generation == self._generation:
+                    self._tables[table_name] = (time.monotonic(), columns)
+            logger.info(f"Структура таблицы {table_name} загружена в кэш: {len(columns)} колонок")
+        return columns
+
+    def has_table(self, db, table_name: str) -> bool:
+        return bool(self.columns(db, table_name))
+
+    def find_column(self, db, table_name: str, variants: List[str]) -> Optional[str]:
+        """Первая (по порядку в таблице) колонка, имя которой без учета регистра есть в variants"""
+        targets = {variant.lower() for variant in variants}
+        for column in self.columns(db, table_name):
+            if column.lower() in targets:
+                return column
+        return None
+
+    def invalidate(self, table_name: Optional[str] = None):
+        """Сбрасывает запись о таблице (None - обо всех таблицах)"""
+        with self._lock:
+            self._generation += 1
+            if table_name is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table_name, None)
+
+
+# Общий реестр процесса
+schema_registry = SchemaRegistry()
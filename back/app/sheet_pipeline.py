@@ -0,0 +1,152 @@
+# sheet_pipeline.py
+"""Параллельная подготовка листов книги: чтение -> очистка -> дешифровка.
+
+Листы (по одному на региональный центр ЕС ОрВД) независимы до загрузки,
+поэтому каждый обрабатывается в отдельном процессе. Результаты отдаются
+в порядке листов; одновременно в работе не больше workers листов.
+"""
+import os
+import time
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from excel_parser import ExcelParser
+from data_processor import DataProcessor
+from shr_decoder import decode_shr_frame
+from shr_cache import get_shr_cache
+
+logger = logging.getLogger(__name__)
+
+# Число процессов для листов: 1 - без пула (по умолчанию), 0 - по числу ядер.
+# Процессы читают листы целиком и передают DataFrame обратно, поэтому
+# память растет с размером листа; загрузка через API при 1 идет потоково
+# блоками (ExcelParser.iter_sheet_chunks), а в режиме upsert уже
+# загруженные строки отбрасываются до дешифровки
+SHEET_WORKERS = int(os.getenv('SHEET_WORKERS', '1'))
+
+
+def resolve_workers(workers: Optional[int], n_sheets: int) -> int:
+    """Фактическое число процессов: не больше числа листов"""
+    if workers is None:
+        workers = SHEET_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, n_sheets))
+
+
+def prepare_sheet(path: str, sheet_name: str, clean: bool = True, decode: bool = True,
+                  source_column: Optional[str] = None) -> Dict:
+    """Обработка одного листа (выполняется в процессе пула).
+
+    Возвращает {'sheet_name', 'data', 'timings', 'cache_counts'}; при заданном
+    source_column в data есть и ключи строк (row_key).
+    """
+    timings = {'pid': os.getpid()}
+    started = time.perf_counter()
+
+    parser = ExcelParser()
+    parser.excel_file_path = path
+    df = parser.read_excel_sheet(sheet_name)
+    timings['source_rows'] = len(df)
+    timings['read_seconds'] = round(time.perf_counter() - started, 3)
+
+    if clean:
+        step = time.perf_counter()
+        df = DataProcessor.clean_dataframe(df)
+        timings['clean_seconds'] = round(time.perf_counter() - step, 3)
+
+    # После очистки: иначе полностью пустые строки не отбросились бы
+    # (в них уже было бы название листа). Ключи строк - до дешифровки,
+    # только по исходным ячейкам
+    if source_column and not df.empty:
+        df[source_column] = sheet_name
+        df = DataProcessor.add_row_keys(df)
+
+    cache_counts = {}
+    if decode and not df.empty:
+        step = time.perf_counter()
+        cache = get_shr_cache()
+        before = cache.counts() if cache is not None else {}
+        df = decode_shr_frame(df, cache)
+        if cache is not None:
+            cache_counts = {name: value - before[name] for name, value in cache.counts().items()}
+        timings['decode_seconds'] = round(time.perf_counter() - step, 3)
+
+    timings['rows'] = len(df)
+    timings['total_seconds'] = round(time.perf_counter() - started, 3)
+    return {
+        'sheet_name': sheet_name,
+        'data': df,
+        'timings': timings,
+        'cache_counts': cache_counts,
+    }
+
+
+def iter_prepared_sheets(path: str, sheet_names: Optional[List[str]] = None, workers: Optional[int] = None,
+                         clean: bool = True, decode: bool = True,
+                         source_column: Optional[str] = None) -> Iterator[Dict]:
+    """Результаты prepare_sheet по листам в исходном порядке.
+
+    В пул одновременно отправляется не больше workers листов, поэтому
+    в памяти держатся только они и еще не забранный результат.
+    """
+    if sheet_names is None:
+        parser = ExcelParser()
+        parser.excel_file_path = path
+        sheet_names = parser.get_sheet_names()
+    if not sheet_names:
+        return
+
+    workers = resolve_workers(workers, len(sheet_names))
+    cache = get_shr_cache()
+
+    if workers == 1:
+        for sheet_name in sheet_names:
+            yield prepare_sheet(path, sheet_name, clean, decode, source_column)
+        return
+
+    logger.info(f"Параллельная обработка {len(sheet_names)} листов в {workers} процессах")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        names = iter(sheet_names)
+        for sheet_name in names:
+            pending.append(pool.submit(prepare_sheet, path, sheet_name, clean, decode, source_column))
+            if len(pending) >= workers:
+                break
+
+        while pending:
+            result = pending.popleft().result()
+            next_sheet = next(names, None)
+            if next_sheet is not None:
+                pending.append(pool.submit(prepare_sheet, path, next_sheet, clean, decode, source_column))
+            # Счетчики кэша SHR из процессов пула учитываются в кэше текущего процесса
+            if cache is not None and result['cache_counts']:
+                cache.add_counts(result['cache_counts'])
+            yield result
+
+
+def run_sheet_pipeline(path: str, sheet_names: Optional[List[str]] = None, workers: Optional[int] = None,
+                       clean: bool = True, decode: bool = True,
+                       source_column: Optional[str] = None) -> Dict:
+    """Обрабатывает все листы и объединяет их в один DataFrame для единой загрузки.
+
+    Возвращает {'data': DataFrame | None, 'sheets': {лист: тайминги}, 'elapsed_seconds'}.
+    """
+    started = time.perf_counter()
+    frames = []
+    sheets = {}
+    for result in iter_prepared_sheets(path, sheet_names, workers, clean, decode, source_column):
+        sheets[result['sheet_name']] = result['timings']
+        if not result['data'].empty:
+            frames.append(result['data'])
+
+    data = pd.concat(frames, ignore_index=True, sort=False) if frames else None
+    return {
+        'data': data,
+        'sheets': sheets,
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,170 @@
+# shr_cache.py
+"""Кэш дешифрованных сообщений SHR.
+
+Ключ - хэш исходного текста сообщения и версии дешифратора (DECODER_VERSION),
+значение - кортеж полей, полученных из самого сообщения (в порядке
+shr_decoder.MESSAGE_FIELDS). В памяти хранится ограниченный LRU; при заданном
+SHR_CACHE_DB результаты дополнительно пишутся в sqlite, так что повторная
+загрузка пересекающихся файлов (и другие процессы пула) дешифровку не повторяют.
+Процессы пула по умолчанию работают без LRU в памяти (SHR_WORKER_CACHE_SIZE).
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Запись занимает около 1 КБ: 20000 записей - порядка 20 МБ на процесс
+SHR_CACHE_SIZE = int(os.getenv('SHR_CACHE_SIZE', '20000'))
+# LRU в процессах пула дешифровки (decode_shr_frame_parallel): у каждого
+# процесса своя копия, поэтому по умолчанию выключен - процессы пула делят
+# только слой sqlite (SHR_CACHE_DB)
+SHR_WORKER_CACHE_SIZE = int(os.getenv('SHR_WORKER_CACHE_SIZE', '0'))
+SHR_CACHE_DB = os.getenv('SHR_CACHE_DB', '')
+
+# Версия дешифратора в ключе кэша: увеличить при изменении MESSAGE_FIELDS
+# или логики дешифровки - старые записи в SHR_CACHE_DB перестанут находиться
+DECODER_VERSION = 2
+_KEY_PERSON = f"shr-v{DECODER_VERSION}".encode()
+
+# Ограничение числа параметров в одном запросе sqlite
+_SQLITE_BATCH = 500
+
+
+class ShrDecodeCache:
+    """Ограниченный LRU-кэш дешифрованных SHR с необязательным слоем в sqlite"""
+
+    def __init__(self, max_size: int = SHR_CACHE_SIZE, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.db_path = db_path or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Повторы внутри одного листа: дешифруются один раз, в кэш не обращаются
+        self.repeats = 0
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        """Хэш текста сообщения (с версией дешифратора)"""
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16, person=_KEY_PERSON).digest()
+
+    def _connection(self):
+        """Соединение с sqlite открывается лениво - отдельно в каждом процессе"""
+        if self.db_path is None:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            # Соединение, унаследованное через fork, не используется
+            self._db_pid = os.getpid()
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS shr_decoded (key BLOB PRIMARY KEY, fields TEXT NOT NULL)"
+            )
+        return self._db
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, tuple]:
+        """Найденные значения по ключам: сначала память, затем sqlite"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                fields = self._entries.get(key)
+                if fields is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = fields
+            self.memory_hits += len(found)
+
+            missing = [key for key in keys if key not in found]
+            db = self._connection()
+            if db is not None and missing:
+                from_disk = {}
+                try:
+                    for start in range(0, len(missing), _SQLITE_BATCH):
+                        batch = missing[start:start + _SQLITE_BATCH]
+                        placeholders = ','.join('?' * len(batch))
+                        rows = db.execute(
+                            f"SELECT key, fields FROM shr_decoded WHERE key IN ({placeholders})", batch
+                        )
+                        for key, fields in rows:
+                            from_disk[key] = tuple(json.loads(fields))
+                except sqlite3.Error as e:
+                    logger.warning(f"Кэш SHR в sqlite недоступен: {e}")
+                self.disk_hits += len(from_disk)
+                self._remember(from_disk)
+                found.update(from_disk)
+
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[bytes, tuple]):
+        """Сохраняет результаты дешифровки в память и (если задан) в sqlite"""
+        if not items:
+            return
+        with self._lock:
+            self._remember(items)
+            db = self._connection()
+            if db is not None:
+                try:
+                    with db:
+                        db.executemany(
+                            "INSERT OR IGNORE INTO shr_decoded (key, fields) VALUES (?, ?)",
+                            [(key, json.dumps(fields, ensure_ascii=False)) for key, fields in items.items()]
+                        )
+                except sqlite3.Error as e:
+                    logger.warning(f"Не удалось записать кэш SHR в sqlite: {e}")
+
+    def _remember(self, items: Dict[bytes, tuple]):
+        if self.max_size <= 0:
+            return
+        self._entries.update(items)
+        for key in items:
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def add_counts(self, counts: Dict[str, int]):
+        """Учитывает счетчики, накопленные в другом процессе (пул дешифровки)"""
+        with self._lock:
+            self.memory_hits += counts.get('memory_hits', 0)
+            self.disk_hits += counts.get('disk_hits', 0)
+            self.misses += counts.get('misses', 0)
+            self.repeats += counts.get('repeats', 0)
+
+    def counts(self) -> Dict[str, int]:
+        return {'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'repeats': self.repeats}
+
+    def stats(self) -> dict:
+        """Счетчики попаданий/промахов и доля попаданий среди обращений к кэшу (без повторов)"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            **self.counts(),
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'disk': self.db_path,
+            'hit_ratio': round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = self.disk_hits = self.misses = self.repeats = 0
+
+
+_default_cache = None
+
+
+def get_shr_cache() -> Optional[ShrDecodeCache]:
+    """Общий кэш процесса (None, если SHR_CACHE_SIZE=0 и SHR_CACHE_DB не задан)"""
+    global _default_cache
+    if _default_cache is None and (SHR_CACHE_SIZE > 0 or SHR_CACHE_DB):
+        _default_cache = ShrDecodeCache(SHR_CACHE_SIZE, SHR_CACHE_DB)
+    return _default_cache
@@ -0,0 +1,377 @@
+# shr_decoder.py
+"""Колоночный (векторизованный) дешифратор сообщений SHR.
+
+Заменяет построчный проход ``df.iterrows()``: каждая колонка просматривается
+один раз, шаблоны компилируются заранее и применяются ко всей колонке
+(через ``.str`` или один проход по списку строк), а результаты записываются
+в DataFrame целыми массивами.
+
+Большие листы можно дешифровать параллельно (decode_shr_frame_parallel):
+строки делятся на блоки, которые обрабатываются в постоянном пуле процессов.
+Пул включается явно (SHR_DECODE_WORKERS > 1): по умолчанию дешифровка идет
+в текущем процессе, а листы и так обрабатываются параллельно (sheet_pipeline).
+"""
+import os
+import re
+import atexit
+import logging
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_object_dtype, is_string_dtype
+from shr_tokenizer import item18_columns, first_words
+from shr_cache import ShrDecodeCache, get_shr_cache, SHR_WORKER_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Число процессов для дешифровки (1 - без пула, по умолчанию; 0 - по числу ядер)
+# и порог в строках, ниже которого лист дешифруется в текущем процессе
+DECODE_WORKERS = int(os.getenv('SHR_DECODE_WORKERS', '1'))
+PARALLEL_MIN_ROWS = int(os.getenv('SHR_PARALLEL_MIN_ROWS', '50000'))
+# Блоков на процесс: выравнивает нагрузку, если сообщения разной длины
+CHUNKS_PER_WORKER = 4
+
+SHR_PREFIXES = [
+    'DOF/', 'STS/', 'DEP/', 'DEST/', 'TYP/', 'REG/',
+    'EET/', 'OPR/', 'ORGN/', 'PER/', 'DLE/'
+]
+
+OUTPUT_COLUMNS = [prefix.strip('/') for prefix in SHR_PREFIXES] + [
+    'RMK', 'departure_time', 'arrival_time',
+    'flight_level', 'flight_zone', 'flight_zone_radius'
+]
+
+# Поля, зависящие только от текста SHR (кэшируются по хэшу сообщения).
+# Резервное время вылета (_shr_time) сюда не входит: оно нужно только строкам
+# без времени в IDEP и считается для них отдельно
+MESSAGE_FIELDS = [prefix.strip('/') for prefix in SHR_PREFIXES] + [
+    'RMK', 'flight_level', 'flight_zone', 'flight_zone_radius'
+]
+
+FLIGHT_LEVEL_PATTERN = re.compile(r'(M\d{4}/M\d{4})')
+FLIGHT_ZONE_PATTERN = re.compile(r'\/ZONA\s+([^\/]+)')
+RADIUS_PATTERN = re.compile(r'(R[\d,]+)')
+ATD_PATTERN = re.compile(r'-ATD\s+(\d{4})')
+ATA_PATTERN = re.compile(r'-ATA\s+(\d{4})')
+TIME_PATTERN_HMS = re.compile(r'(\d{2}:\d{2}(?::\d{2})?)')
+TIME_PATTERN_ICAO = re.compile(r'(?<![/])([A-Z]{4})(\d{4})\b')
+VALID_TIME_PATTERN = re.compile(r'(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d')
+
+
+def _is_text_column(series: pd.Series) -> bool:
+    """Колонки, в которых в принципе может встретиться текст сообщения"""
+    dtype = series.dtype
+    return is_object_dtype(dtype) or is_string_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype)
+
+
+def _hhmm(value: str) -> str:
+    """'HHMM' -> 'HH:MM'"""
+    return f"{value[:2]}:{value[2:]}"
+
+
+def _extract_shr(text: str):
+    """Содержимое '(SHR-...)' до первой закрывающей скобки; пустое - не найдено"""
+    start = text.find('(SHR-')
+    if start < 0:
+        return None
+    end = text.find(')', start + 5)
+    if end <= start + 5:
+        return None
+    return text[start + 5:end]
+
+
+def _first_marked_time(current: np.ndarray, found: np.ndarray, cells, joined, marker: str,
+                       name_hit: bool, pattern: re.Pattern):
+    """Время ATD/ATA из первой колонки (по порядку), где встретился маркер IDEP/IARR.
+
+    joined - ячейки колонки одной строкой: колонки без маркера отсеиваются
+    одной проверкой подстроки, без обхода ячеек.
+    """
+    if name_hit:
+        hit = np.ones(len(current), dtype=bool)
+    elif cells is None or marker not in joined:
+        return
+    else:
+        hit = np.fromiter((marker in cell for cell in cells), dtype=bool, count=len(cells))
+
+    new_hits = np.flatnonzero(hit & ~found)
+    found |= hit
+    if cells is None:
+        return
+
+    for i in new_hits.tolist():
+        match = pattern.search(cells[i])
+        if match:
+            current[i] = _hhmm(match.group(1))
+
+
+def _decode_item18(texts: list) -> dict:
+    """Значения индикаторов пункта 18 для каждого сообщения (один проход токенизатора).
+
+    Обычный индикатор - первое слово без запятых; OPR/ - все значение целиком,
+    RMK/ - все значение без запятых.
+    """
+    names = [prefix.strip('/') for prefix in SHR_PREFIXES]
+    values = item18_columns(texts, names + ['RMK'])
+
+    decoded = {}
+    for name in names:
+        if name == 'OPR':
+            decoded[name] = [None if value is None else value.strip() for value in values[name]]
+        else:
+            decoded[name] = first_words(values[name])
+    decoded['RMK'] = [
+        None if value is None else value.strip().replace(',', '')
+        for value in values['RMK']
+    ]
+    return decoded
+
+
+def _decode_zone(text: str):
+    """/ZONA ... - зона полета и радиус (радиус вырезается из описания зоны)"""
+    match = FLIGHT_ZONE_PATTERN.search(text)
+    if match is None:
+        return None, None
+    zone_info = match.group(1).strip()
+    radius = RADIUS_PATTERN.search(zone_info)
+    if radius is None:
+        return zone_info, None
+    return zone_info.replace(radius.group(1), '').strip(), radius.group(1)
+
+
+def _flight_level(text: str):
+    match = FLIGHT_LEVEL_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+def _shr_time(text: str):
+    """Резервное время вылета из текста SHR: первое HH:MM[:SS] (кроме 00:00), иначе ICAO-группа"""
+    if ':' in text:
+        # finditer, а не findall: текст дальше первого подходящего времени не сканируется
+        for match in TIME_PATTERN_HMS.finditer(text):
+            value = match.group(1)
+            if value not in ('00:00', '00:00:00'):
+                return value
+    match = TIME_PATTERN_ICAO.search(text)
+    if match:
+        return _hhmm(match.group(1))
+    return None
+
+
+def _normalize_time(value):
+    """24:00 -> 00:00:00, HH:MM -> HH:MM:00"""
+    if not value:
+        return value
+    if value in ('24:00', '24:00:00'):
+        return '00:00:00'
+    if value.count(':') == 1:
+        return value + ':00'
+    return value
+
+
+def _ordered_times(departure, arrival):
+    """Меняет нормализованные времена местами, если прибытие раньше вылета"""
+    if (departure and arrival
+            and VALID_TIME_PATTERN.fullmatch(departure)
+            and VALID_TIME_PATTERN.fullmatch(arrival)
+            and arrival < departure):
+        return arrival, departure
+    return departure, arrival
+
+
+def _decode_messages(texts: list) -> dict:
+    """Поля MESSAGE_FIELDS для списка текстов SHR: {поле: список значений}"""
+    # Регулярные выражения напрямую, без .str.extract: у него на каждое значение
+    # накладные расходы pandas и NaN вместо None
+    decoded = _decode_item18(texts)
+    decoded['flight_level'] = [_flight_level(text) for text in texts]
+    zones = [_decode_zone(text) for text in texts]
+    decoded['flight_zone'] = [zone for zone, _ in zones]
+    decoded['flight_zone_radius'] = [radius for _, radius in zones]
+    return decoded
+
+
+def _decode_cached(texts: list, cache: Optional[ShrDecodeCache]) -> dict:
+    """_decode_messages с дедупликацией: каждый уникальный текст дешифруется один раз,
+    ранее встречавшиеся берутся из кэша"""
+    unique = list(dict.fromkeys(texts))
+    if cache is None:
+        if len(unique) == len(texts):
+            return _decode_messages(texts)
+        keys = unique
+        found = {}
+    else:
+        keys = [cache.key(text) for text in unique]
+        found = cache.get_many(keys)
+        # Повторы внутри листа не дешифруются заново; считаются отдельно от попаданий
+        cache.add_counts({'repeats': len(texts) - len(unique)})
+
+    missing = [i for i, key in enumerate(keys) if key not in found]
+    if missing:
+        fresh = _decode_messages([unique[i] for i in missing])
+        computed = dict(zip([keys[i] for i in missing], zip(*[fresh[name] for name in MESSAGE_FIELDS])))
+        if cache is not None:
+            cache.put_many(computed)
+        found.update(computed)
+
+    by_text = {text: found[key] for text, key in zip(unique, keys)}
+    columns = zip(*[by_text[text] for text in texts])
+    return dict(zip(MESSAGE_FIELDS, map(list, columns)))
+
+
+def decode_shr_frame(df: pd.DataFrame, cache: Optional[ShrDecodeCache] = None) -> pd.DataFrame:
+    """Дешифрует поля плана полета (SHR, IDEP, IARR) для всего DataFrame сразу.
+
+    Возвращает копию df с колонками OUTPUT_COLUMNS; пустые значения - None.
+    cache - кэш дешифрованных сообщений (см. shr_cache); None - только
+    дедупликация внутри df.
+    """
+    if df.empty:
+        return df
+
+    df = df.copy()
+    n_rows = len(df)
+
+    shr = np.full(n_rows, None, dtype=object)
+    departure = np.full(n_rows, None, dtype=object)
+    arrival = np.full(n_rows, None, dtype=object)
+    shr_found = np.zeros(n_rows, dtype=bool)
+    idep_found = np.zeros(n_rows, dtype=bool)
+    iarr_found = np.zeros(n_rows, dtype=bool)
+
+    for position, col in enumerate(df.columns):
+        if col in OUTPUT_COLUMNS:
+            # Выходные колонки перезаписываются и в поиске не участвуют
+            continue
+        column = df.iloc[:, position]
+        cells = joined = None
+        if _is_text_column(column):
+            cells = column.astype(str).tolist()
+            joined = '\x00'.join(cells)
+
+            # Первое непустое сообщение SHR по порядку колонок
+            pending = np.flatnonzero(~shr_found).tolist() if '(SHR-' in joined else []
+            for i in [i for i in pending if '(SHR-' in cells[i]]:
+                message = _extract_shr(cells[i])
+                if message is not None:
+                    shr[i] = message
+                    shr_found[i] = True
+
+        _first_marked_time(departure, idep_found, cells, joined, 'IDEP', 'IDEP' in str(col), ATD_PATTERN)
+        _first_marked_time(arrival, iarr_found, cells, joined, 'IARR', 'IARR' in str(col), ATA_PATTERN)
+
+    decoded = {name: np.full(n_rows, None, dtype=object) for name in OUTPUT_COLUMNS}
+    rows = np.flatnonzero(shr_found)
+
+    if len(rows):
+        fields = _decode_cached(shr[rows].tolist(), cache)
+        for name in OUTPUT_COLUMNS:
+            if name in fields:
+                decoded[name][rows] = fields[name]
+
+        # Резервное время вылета из самого SHR
+        need_time = rows[pd.isna(departure[rows])]
+        departure[need_time] = np.array([_shr_time(text) for text in shr[need_time].tolist()], dtype=object)
+
+    departures = departure.tolist()
+    arrivals = arrival.tolist()
+    # Нормализуются уникальные значения: их не больше числа минут (секунд) в сутках
+    normalized = {value: _normalize_time(value) for value in {*departures, *arrivals}}
+    times = [_ordered_times(normalized[dep], normalized[arr]) for dep, arr in zip(departures, arrivals)]
+    decoded['departure_time'][:] = [dep for dep, _ in times]
+    decoded['arrival_time'][:] = [arr for _, arr in times]
+
+    for name in OUTPUT_COLUMNS:
+        df[name] = decoded[name]
+
+    return df
+
+
+_pool = None
+_pool_workers = 0
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Пул процессов создается один раз на процесс и переиспользуется между загрузками"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        shutdown_pool()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def shutdown_pool():
+    """Останавливает пул процессов дешифровки (если он был создан)"""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+
+
+atexit.register(shutdown_pool)
+
+
+_worker_caches = {}
+
+
+def _decode_chunk(chunk: pd.DataFrame, cache_config):
+    """Выполняется в процессе пула: общий sqlite (если задан) и, при
+    SHR_WORKER_CACHE_SIZE > 0, свой LRU на процесс.
+
+    Возвращает результат и приращение счетчиков кэша для родительского процесса.
+    """
+    cache = None
+    if cache_config is not None:
+        cache = _worker_caches.get(cache_config)
+        if cache is None:
+            cache = _worker_caches[cache_config] = ShrDecodeCache(*cache_config)
+    before = cache.counts() if cache is not None else {}
+    decoded = decode_shr_frame(chunk, cache)
+    counts = {}
+    if cache is not None:
+        counts = {name: value - before[name] for name, value in cache.counts().items()}
+    return decoded, counts
+
+
+def decode_shr_frame_parallel(df: pd.DataFrame, workers: int = None, min_rows: int = None,
+                              cache: Optional[ShrDecodeCache] = None) -> pd.DataFrame:
+    """Дешифровка по блокам строк в пуле процессов; результат склеивается в исходном порядке.
+
+    workers - число процессов (None - SHR_DECODE_WORKERS, 1 - без пула, 0 - по числу ядер),
+    min_rows - порог, ниже которого используется однопроцессный decode_shr_frame,
+    cache - кэш дешифрованных сообщений; процессы пула используют его слой sqlite
+    и LRU размером SHR_WORKER_CACHE_SIZE (по умолчанию без LRU: копия в каждом
+    процессе умножала бы память на число процессов), их счетчики суммируются в cache.
+    """
+    if workers is None:
+        workers = DECODE_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if min_rows is None:
+        min_rows = PARALLEL_MIN_ROWS
+
+    if workers <= 1 or len(df) < max(min_rows, 2):
+        return decode_shr_frame(df, cache)
+
+    n_chunks = min(workers * CHUNKS_PER_WORKER, len(df))
+    bounds = np.linspace(0, len(df), n_chunks + 1, dtype=np.int64)
+    chunks = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+    # При SHR_WORKER_CACHE_SIZE=0 кэш процесса пула ничего не хранит в памяти,
+    # но ведет счетчики
+    cache_config = (SHR_WORKER_CACHE_SIZE, cache.db_path) if cache is not None else None
+    try:
+        results = list(_get_pool(workers).map(_decode_chunk, chunks, [cache_config] * len(chunks)))
+    except BrokenProcessPool:
+        logger.warning("Пул процессов дешифровки недоступен, дешифровка в текущем процессе")
+        shutdown_pool()
+        return decode_shr_frame(df, cache)
+
+    if cache is not None:
+        for _, counts in results:
+            cache.add_counts(counts)
+    return pd.concat([decoded for decoded, _ in results])
@@ -0,0 +1,86 @@
+# shr_tokenizer.py
+"""Разбор пункта 18 сообщений SHR/FPL (прочая информация) за один проход.
+
+Весь текст делится одним составным шаблоном по индикаторам вида 'DEP/',
+'OPR/', 'RMK/' и т.д.; значение индикатора - текст до следующего индикатора,
+поэтому многословные OPR/ и RMK/ не захватывают соседние поля.
+"""
+import re
+from typing import Dict, List, Optional
+
+# Индикаторы пункта 18 ИКАО и SID/ (идентификатор сообщения в выгрузках ЕС ОРВД)
+ITEM18_INDICATORS = (
+    'STS', 'PBN', 'NAV', 'COM', 'DAT', 'SUR', 'DEP', 'DEST', 'DOF', 'REG',
+    'EET', 'SEL', 'TYP', 'CODE', 'DLE', 'OPR', 'ORGN', 'PER', 'ALTN',
+    'RALT', 'TALT', 'RIF', 'RMK', 'SID'
+)
+
+# Индикатор начинается с начала строки, после пробела/перевода строки, '(' или '-'
+INDICATOR_PATTERN = re.compile(
+    r'(?<![^\s(\-])(' + '|'.join(ITEM18_INDICATORS) + r')/'
+)
+# Тот же шаблон для развернутого текста: '/', развернутый индикатор, затем
+# (в исходном порядке - перед индикатором) начало строки, пробел, '(' или '-'
+REVERSED_INDICATOR_PATTERN = re.compile(
+    r'/(' + '|'.join(indicator[::-1] for indicator in ITEM18_INDICATORS) + r')(?![^\s(\-])'
+)
+FIRST_WORD_PATTERN = re.compile(r'[^\s/]*')
+# Первые слова значений, склеенных через '\x00' (first_words): по совпадению на значение
+JOINED_FIRST_WORD_PATTERN = re.compile(r'\s*([^\s/\x00]*)[^\x00]*\x00')
+
+
+def tokenize_item18(text: str) -> Dict[str, str]:
+    """Делит текст на {индикатор: значение}; при повторе индикатора берется первое вхождение"""
+    if not text:
+        return {}
+    parts = INDICATOR_PATTERN.split(text)
+    fields = {}
+    for indicator, value in zip(parts[1::2], parts[2::2]):
+        if indicator not in fields:
+            fields[indicator] = value.strip()
+    return fields
+
+
+def first_word(value: Optional[str]) -> Optional[str]:
+    """Однословное значение индикатора (DEP/, DOF/, REG/ ...): до пробела или '/', без запятых"""
+    if value is None:
+        return None
+    return FIRST_WORD_PATTERN.match(value).group(0).replace(',', '')
+
+
+def item18_columns(texts: List[str], names: List[str]) -> Dict[str, List[Optional[str]]]:
+    """
+    tokenize_item18 для списка текстов сразу по колонкам: {индикатор: [значение
+    или None по каждому тексту]} для индикаторов names. Значения без strip (его
+    делают потребители: first_words пропускает начальные пробелы сам).
+
+    Текст делится развернутым шаблоном (REVERSED_INDICATOR_PATTERN): он
+    начинается с литерала '/', поэтому движок re проверяет альтернативы только
+    у символов '/', а не в каждой позиции текста. Пары идут с конца текста,
+    так что при повторе индикатора последним записывается первое вхождение.
+    """
+    count = len(texts)
+    columns = {name[::-1]: [None] * count for name in names}
+    get_column = columns.get
+    split = REVERSED_INDICATOR_PATTERN.split
+    for index, text in enumerate(texts):
+        parts = split(text[::-1])
+        for indicator, value in zip(parts[1::2], parts[0:-1:2]):
+            column = get_column(indicator)
+            if column is not None:
+                column[index] = value
+    return {
+        name: [None if value is None else value[::-1] for value in columns[name[::-1]]]
+        for name in names
+    }
+
+
+def first_words(values: List[Optional[str]]) -> List[Optional[str]]:
+    """first_word для списка значений (без strip) одним проходом регулярного выражения"""
+    present = [value for value in values if value is not None]
+    joined = '\x00'.join(present).replace(',', '') + '\x00'
+    if joined.count('\x00') != len(present):
+        # '\x00' внутри значения - разбор по одному
+        return [None if value is None else first_word(value.strip()) for value in values]
+    words = iter(JOINED_FIRST_WORD_PATTERN.findall(joined))
+    return [None if value is None else next(words) for value in values]
@@ -0,0 +1,74 @@
+# streaming.py
+"""Потоковая отдача больших выборок (StreamingResponse).
+
+Строки читаются именованным серверным курсором пачками по
+STREAM_BATCH_ROWS и сразу кодируются в JSON, поэтому память процесса API
+не зависит от размера таблицы, а первые байты ответа уходят до окончания
+чтения. Генератор открывает свою сессию БД: сессия запроса (get_db)
+закрывается раньше, чем отдается тело ответа.
+"""
+import os
+import logging
+from itertools import chain
+
+from sqlalchemy import text
+
+from cache_codecs import dumps_json
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Строк в одной пачке серверного курсора
+STREAM_BATCH_ROWS = int(os.getenv('STREAM_BATCH_ROWS', '5000'))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def iter_row_batches(query: str, params: dict = None, batch_rows: int = None):
+    """Пачки строк (списки dict) запроса из серверного курсора (yield_per)"""
+    batch_rows = batch_rows or STREAM_BATCH_ROWS
+    session = SessionLocal()
+    try:
+        connection = session.connection().execution_options(yield_per=batch_rows)
+        result = connection.execute(text(query), params or {})
+        for batch in result.mappings().partitions():
+            yield [dict(row) for row in batch]
+    except Exception as e:
+        # Статус ответа уже отправлен - поток просто обрывается
+        logger.error(f"Ошибка потоковой выборки: {e}")
+        raise
+    finally:
+        session.close()
+
+
+def open_row_batches(query: str, params: dict = None, batch_rows: int = None):
+    """
+    iter_row_batches с уже прочитанной первой пачкой: ошибки запроса (нет
+    колонки и т.п.) возникают здесь, пока эндпоинт еще может ответить 500
+    """
+    batches = iter_row_batches(query, params, batch_rows)
+    first = next(batches, None)
+    return chain([first], batches) if first is not None else iter(())
+
+
+def ndjson_stream(batches):
+    """Строки в формате NDJSON: по JSON-объекту на строку"""
+    for batch in batches:
+        yield b"".join(dumps_json(row) + b"\n" for row in batch)
+
+
+def json_document_stream(batches, key: str, extra):
+    """
+    JSON-объект {key: [строки...], **extra(count)}, кодируемый по пачкам.
+    extra получает число отданных строк и возвращает остальные поля ответа.
+    """
+    yield b'{' + dumps_json(key) + b':['
+    count = 0
+    for batch in batches:
+        if not batch:
+            continue
+        # Пачка кодируется одним вызовом: массив без скобок
+        yield (b',' if count else b'') + dumps_json(batch)[1:-1]
+        count += len(batch)
+    tail = dumps_json(extra(count))
+    yield b']' + (b',' + tail[1:] if len(tail) > 2 else b'}')
@@ -0,0 +1,112 @@
+# bench_cache_codecs.py
+"""Размер и скорость кодеков кэша ответов (cache_codecs) на ответах эндпоинтов.
+
+Запуск: python benchmarks/bench_cache_codecs.py --rows 100000
+        python benchmarks/bench_cache_codecs.py --url http://localhost:8000
+Без --url ответы /, /flights/points и /stats/regions строятся той же логикой,
+что в main.py, по синтетическому листу; с --url - забираются у запущенного API.
+Для каждого кодека: байт в Redis, запись (кодирование) и чтение в двух видах -
+JSON для тела ответа (decode_payload) и данные Python (decode_data).
+Первая строка - прежний формат set_cached_data (json.dumps текстом).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from cache_codecs import COMPRESSORS, SERIALIZERS, Codec, decode_data, decode_payload
+from data_processor import DataProcessor
+from flight_parsers import convert_coord, parse_time
+from shr_decoder import decode_shr_frame
+from shr_samples import make_sheet
+
+ENDPOINTS = ['/', '/flights/points', '/stats/regions']
+
+
+def synthetic_payloads(n_rows):
+    df = DataProcessor.clean_dataframe(decode_shr_frame(DataProcessor.clean_dataframe(make_sheet(n_rows))))
+    df['id'] = range(1, len(df) + 1)
+
+    main_columns = {'reg': 'reg', 'opr': 'opr', 'typ': 'typ', 'dep_1': 'dep', 'dest': 'dest',
+                    'flight_zone_radius': 'flight_zone_radius', 'flight_level': 'flight_level',
+                    'departure_time': 'departure_time', 'arrival_time': 'arrival_time'}
+    rows = df[list(main_columns)].rename(columns=main_columns)
+    main = {"data": rows.astype(object).where(rows.notna(), None).to_dict('records'),
+            "count": len(rows), "columns": list(main_columns.values())}
+
+    points = []
+    for flight_id, dep in zip(df['id'], df['dep_1']):
+        coords = convert_coord(dep) if dep else {"latitude": None}
+        if coords["latitude"] is not None:
+            points.append({"id": int(flight_id), **coords})
+
+    stats = {}
+    for region, dep, arr in zip(df['tsentr_es_orvd'], df['departure_time'], df['arrival_time']):
+        dep, arr = parse_time(dep), parse_time(arr)
+        if region and dep and arr:
+            duration = (arr - dep).total_seconds() / 60 % (24 * 60)
+            entry = stats.setdefault(region, [0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+    regions = [{"region": region, "num_flights": n, "avg_flight_duration": round(total / n, 2)}
+               for region, (n, total) in stats.items()]
+
+    return {'/': main, '/flights/points': points, '/stats/regions': regions}
+
+
+def fetch_payloads(base_url):
+    payloads = {}
+    for endpoint in ENDPOINTS:
+        with urllib.request.urlopen(base_url.rstrip('/') + endpoint) as response:
+            payloads[endpoint] = json.loads(response.read())
+    return payloads
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, result
+
+
+def legacy_encode(data):
+    return json.dumps(data, default=lambda obj: obj.isoformat(), ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--url', default=None, help='адрес запущенного API вместо синтетических данных')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = fetch_payloads(args.url) if args.url else synthetic_payloads(args.rows)
+    codecs = [Codec(serializer, compressor) for serializer in SERIALIZERS for compressor in COMPRESSORS]
+    print(f"Сериализаторы: {list(SERIALIZERS)}, сжатие: {list(COMPRESSORS)}")
+
+    for endpoint, data in payloads.items():
+        print(f"\n{endpoint}")
+        print(f"{'Кодек':16} {'Байт':>12} {'Запись, мс':>11} {'-> JSON, мс':>12} {'-> данные, мс':>14}")
+
+        encode_ms, text = best_of(args.repeat, legacy_encode, data)
+        decode_ms, _ = best_of(args.repeat, json.loads, text)
+        print(f"{'прежний (json)':16} {len(text.encode('utf-8')):>12,} {encode_ms:>11.1f} "
+              f"{decode_ms:>12.1f} {decode_ms:>14.1f}")
+
+        for codec in codecs:
+            encode_ms, (_, stored) = best_of(args.repeat, codec.encode, data)
+            payload_ms, _ = best_of(args.repeat, decode_payload, stored)
+            data_ms, _ = best_of(args.repeat, decode_data, stored)
+            print(f"{codec.name:16} {len(stored):>12,} {encode_ms:>11.1f} {payload_ms:>12.1f} {data_ms:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# bench_excel_streaming.py
+"""Пиковая память (RSS) при чтении книги целиком и потоковом чтении блоками.
+
+Запуск: python benchmarks/bench_excel_streaming.py --rows 1000000
+Генерирует книгу (если ее нет) и в отдельных процессах прогоняет
+очистку и дешифровку двумя способами: read_all_excel_sheets (как раньше
+в /api/upload) и iter_sheet_chunks. Загрузка в БД не выполняется.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from shr_samples import make_sheet
+
+GENERATE_BATCH = 50_000
+
+
+def generate_workbook(path, n_rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Москва')
+    header = None
+    for batch, start in enumerate(range(0, n_rows, GENERATE_BATCH)):
+        df = make_sheet(min(GENERATE_BATCH, n_rows - start), seed=batch)
+        if header is None:
+            header = ['Центр ЕС ОрВД', 'SHR', 'DEP', 'ARR', 'N']
+            sheet.append(header)
+        for row in df.itertuples(index=False):
+            sheet.append(list(row))
+    workbook.save(path)
+
+
+def run_mode(path, mode, chunk_size):
+    from data_processor import DataProcessor
+    from excel_parser import ExcelParser
+    from shr_decoder import decode_shr_frame
+
+    parser = ExcelParser()
+    parser.excel_file_path = path
+    rows = 0
+    started = time.perf_counter()
+    if mode == 'full':
+        decoded = {}
+        for sheet_name, df in parser.read_all_excel_sheets().items():
+            decoded[sheet_name] = decode_shr_frame(DataProcessor.clean_dataframe(df))
+            rows += len(decoded[sheet_name])
+    else:
+        for sheet_name in parser.get_sheet_names():
+            for chunk in parser.iter_sheet_chunks(sheet_name, chunk_size):
+                chunk = DataProcessor.clean_dataframe(chunk, drop_empty_columns=False)
+                rows += len(decode_shr_frame(chunk))
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode}\t{rows}\t{elapsed:.1f}\t{peak_mb:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--path', default=None)
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    parser.add_argument('--mode', choices=['full', 'stream'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    path = args.path or f"bench_{args.rows}.xlsx"
+
+    if args.mode:
+        run_mode(path, args.mode, args.chunk_size)
+        return
+
+    if not os.path.exists(path):
+        print(f"Генерация {path} ({args.rows} строк)...")
+        generate_workbook(path, args.rows)
+
+    print(f"{'Режим':8} {'Строк':>9} {'Время, c':>9} {'Пик RSS, МБ':>12}")
+    for mode in ('full', 'stream'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--path', path, '--mode', mode,
+             '--chunk-size', str(args.chunk_size)],
+            check=True, capture_output=True, text=True
+        ).stdout.strip().splitlines()[-1]
+        _, rows, elapsed, peak = output.split('\t')
+        print(f"{mode:8} {rows:>9} {elapsed:>9} {peak:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_json_response.py
+"""Время кодирования ответов эндпоинтов: прежний путь FastAPI против FastJSONResponse.
+
+Запуск: python benchmarks/bench_json_response.py --rows 50000
+Ответы /, /statistics, /flights/points и /city/{name} строятся по
+синтетическому листу в том виде, в каком их возвращают эндпоинты (строки
+из БД с datetime/date/time). Прежний путь - jsonable_encoder + JSONResponse
+(стандартный json), новый - FastJSONResponse (orjson) без jsonable_encoder.
+Печатаются p50 и p99 по --repeat запускам.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from data_processor import DataProcessor
+from json_response import FastJSONResponse
+from shr_decoder import decode_shr_frame
+from shr_samples import make_sheet
+
+
+def synthetic_payloads(n_rows):
+    df = DataProcessor.add_typed_columns(
+        DataProcessor.clean_dataframe(decode_shr_frame(DataProcessor.clean_dataframe(make_sheet(n_rows))))
+    )
+    df['id'] = range(1, len(df) + 1)
+    # Строки как из БД: NULL -> None, типизированные колонки - объекты datetime
+    rows = df.astype(object).where(df.notna(), None).to_dict('records')
+
+    main_columns = {'reg': 'reg', 'opr': 'opr', 'typ': 'typ', 'dep_1': 'dep', 'dest': 'dest',
+                    'flight_zone_radius': 'flight_zone_radius', 'flight_level': 'flight_level',
+                    'departure_time': 'departure_time', 'arrival_time': 'arrival_time'}
+    main = {"data": [{name: row[col] for col, name in main_columns.items()} for row in rows],
+            "count": len(rows), "columns": list(main_columns.values())}
+
+    points = [{"id": row['id'], "latitude": row['dep_lat'], "longitude": row['dep_lon']}
+              for row in rows if row['dep_lat'] is not None]
+
+    region = rows[0]['tsentr_es_orvd']
+    city_rows = [row for row in rows if row['tsentr_es_orvd'] == region]
+    city = {"center": region, "data": city_rows, "count": len(city_rows), "column_used": "tsentr_es_orvd"}
+
+    statistics_page = {"data": rows, "pagination": {"limit": None, "offset": 0, "total": len(rows),
+                                                    "has_more": False}}
+
+    return {'/': main, '/statistics': statistics_page, '/flights/points': points, '/city/{name}': city}
+
+
+def legacy_render(data):
+    return JSONResponse(jsonable_encoder(data)).body
+
+
+def fast_render(data):
+    return FastJSONResponse(data).body
+
+
+def percentiles(repeat, func, data):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(data)
+        timings.append((time.perf_counter() - started) * 1000)
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return cuts[49], cuts[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = synthetic_payloads(args.rows)
+    print(f"{'Эндпоинт':18} {'Байт':>12} {'прежний p50':>12} {'p99':>9} {'orjson p50':>11} {'p99':>9}")
+    for endpoint, data in payloads.items():
+        size = len(fast_render(data))
+        legacy_p50, legacy_p99 = percentiles(args.repeat, legacy_render, data)
+        fast_p50, fast_p99 = percentiles(args.repeat, fast_render, data)
+        print(f"{endpoint:18} {size:>12,} {legacy_p50:>12.1f} {legacy_p99:>9.1f} "
+              f"{fast_p50:>11.1f} {fast_p99:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
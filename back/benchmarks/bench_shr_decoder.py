@@ -0,0 +1,207 @@
+# bench_shr_decoder.py
+"""Сравнение построчного (исходного) и колоночного дешифратора SHR.
+
+Запуск: python benchmarks/bench_shr_decoder.py --rows 500000
+Проверяет побайтовое совпадение результатов и печатает ускорение. Поля
+пункта 18 (DEP, OPR, RMK ...) с переходом на shr_tokenizer разбираются по
+границам индикаторов, поэтому сравниваются только остальные колонки.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from data_processor import DataProcessor
+from shr_decoder import SHR_PREFIXES, decode_shr_frame, decode_shr_frame_parallel
+from shr_samples import make_sheet
+
+ITEM18_COLUMNS = [prefix.strip('/') for prefix in SHR_PREFIXES] + ['RMK']
+
+
+# Исходная построчная реализация DataProcessor.decode_flight_plan_fields (эталон)
+def legacy_decode_flight_plan_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """Дешифрует сырые данные из полей сообщения о плане запуска"""
+    if df.empty:
+        return df
+
+    df = df.copy()
+
+    prefixes = [
+        'DOF/', 'STS/', 'DEP/', 'DEST/', 'TYP/', 'REG/',
+        'EET/', 'OPR/', 'ORGN/', 'PER/', 'DLE/'
+    ]
+
+    for prefix in prefixes:
+        df[prefix.strip('/')] = None
+    df['RMK'] = None
+    df['departure_time'] = None
+    df['arrival_time'] = None
+    df['flight_level'] = None
+    df['flight_zone'] = None
+    df['flight_zone_radius'] = None
+
+    time_pattern_icao = r'(?<![/])([A-Z]{4})(\d{4})\b'
+    time_pattern_hms = r'(\d{2}:\d{2}(?::\d{2})?)'
+    shr_pattern = r'\(SHR-(.*?)\)'
+    flight_level_pattern = r'M\d{4}/M\d{4}'
+    flight_zone_pattern = r'\/ZONA\s+([^\/]+)'
+
+    for idx, row in df.iterrows():
+        departure_time = None
+        arrival_time = None
+        shr_cell = None
+
+        for col in df.columns:
+            try:
+                cell = str(row[col])
+                shr_match = re.search(shr_pattern, cell, re.DOTALL)
+                if shr_match and not shr_cell:
+                    shr_cell = shr_match.group(1)
+            except Exception:
+                continue
+
+        if shr_cell:
+            for prefix in prefixes:
+                if prefix in shr_cell:
+                    value = shr_cell.split(prefix)[1].split(' ')[0].split(')')[0].split('/')[0]
+                    value = value.replace(',', '')
+                    df.at[idx, prefix.strip('/')] = value
+
+                    if prefix == 'OPR/':
+                        next_prefix_positions = []
+                        for p in prefixes:
+                            if p in shr_cell and shr_cell.find(p) > shr_cell.find(prefix):
+                                next_prefix_positions.append(shr_cell.find(p))
+                        if next_prefix_positions:
+                            min_pos = min(next_prefix_positions)
+                            value = shr_cell[shr_cell.find(prefix)+len(prefix):min_pos].strip()
+                        else:
+                            value = shr_cell.split(prefix)[1].strip()
+                        df.at[idx, prefix.strip('/')] = value
+
+            flight_level_match = re.search(flight_level_pattern, shr_cell)
+            if flight_level_match:
+                df.at[idx, 'flight_level'] = flight_level_match.group(0)
+
+            flight_zone_match = re.search(flight_zone_pattern, shr_cell)
+            if flight_zone_match:
+                zone_info = flight_zone_match.group(1).strip()
+                df.at[idx, 'flight_zone'] = zone_info
+                radius_match = re.search(r'R[\d,]+', zone_info)
+                if radius_match:
+                    df.at[idx, 'flight_zone_radius'] = radius_match.group(0)
+                    df.at[idx, 'flight_zone'] = zone_info.replace(radius_match.group(0), '').strip()
+
+            if 'RMK/' in shr_cell:
+                rmk_value = shr_cell.split('RMK/')[1].split(')')[0].strip()
+                rmk_value = rmk_value.replace(',', '')
+                df.at[idx, 'RMK'] = rmk_value
+
+        idep_found = False
+        iarr_found = False
+        for col in df.columns:
+            try:
+                cell = str(row[col])
+                if not idep_found and ('IDEP' in str(col) or 'IDEP' in cell):
+                    idep_found = True
+                    atd_match = re.search(r'-ATD\s+(\d{4})', cell)
+                    if atd_match:
+                        time_str = atd_match.group(1)
+                        departure_time = f"{time_str[:2]}:{time_str[2:]}"
+
+                if not iarr_found and ('IARR' in str(col) or 'IARR' in cell):
+                    iarr_found = True
+                    ata_match = re.search(r'-ATA\s+(\d{4})', cell)
+                    if ata_match:
+                        time_str = ata_match.group(1)
+                        arrival_time = f"{time_str[:2]}:{time_str[2:]}"
+            except Exception:
+                continue
+
+        if not departure_time and shr_cell:
+            shr_times = []
+            for match in re.finditer(time_pattern_hms, shr_cell):
+                current_time = match.group(1)
+                if current_time not in ["00:00", "00:00:00"]:
+                    shr_times.append(current_time)
+            for match in re.finditer(time_pattern_icao, shr_cell):
+                time_str = match.group(1)
+                current_time = f"{time_str[:2]}:{time_str[2:]}"
+                if current_time != "00:00":
+                    shr_times.append(current_time)
+            if shr_times:
+                departure_time = shr_times[0] if len(shr_times) > 0 else None
+
+        if departure_time:
+            if departure_time == '24:00' or departure_time == '24:00:00':
+                departure_time = '00:00:00'
+            if len(departure_time.split(':')) == 2:
+                departure_time += ':00'
+
+        if arrival_time:
+            if arrival_time == '24:00' or arrival_time == '24:00:00':
+                arrival_time = '00:00:00'
+            if len(arrival_time.split(':')) == 2:
+                arrival_time += ':00'
+
+        if departure_time and arrival_time:
+            try:
+                departure_dt = datetime.strptime(departure_time, "%H:%M:%S")
+                arrival_dt = datetime.strptime(arrival_time, "%H:%M:%S")
+                if arrival_dt < departure_dt:
+                    departure_time, arrival_time = arrival_time, departure_time
+            except ValueError:
+                pass
+
+        df.at[idx, 'departure_time'] = departure_time
+        df.at[idx, 'arrival_time'] = arrival_time
+
+    return df
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--legacy-rows', type=int, default=20_000,
+                        help='строк для эталона (результат масштабируется линейно)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='процессов для параллельного режима (0 - по числу ядер)')
+    args = parser.parse_args()
+
+    df = DataProcessor.clean_dataframe(make_sheet(args.rows))
+    legacy_rows = min(args.legacy_rows, args.rows)
+    sample = df.iloc[:legacy_rows]
+
+    expected, legacy_time = _timed(legacy_decode_flight_plan_fields, sample)
+    actual, _ = _timed(decode_shr_frame, sample)
+    expected = expected.drop(columns=ITEM18_COLUMNS)
+    actual = actual.drop(columns=ITEM18_COLUMNS)
+    pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+    assert actual.astype(str).equals(expected.astype(str))
+    print(f"Совпадение с эталоном на {legacy_rows} строках: OK")
+
+    _, vector_time = _timed(decode_shr_frame, df)
+    legacy_estimate = legacy_time * len(df) / legacy_rows
+    print(f"Построчно:  {legacy_estimate:8.2f} c на {len(df)} строк (оценка по {legacy_rows})")
+    print(f"Колоночно:  {vector_time:8.2f} c на {len(df)} строк")
+    print(f"Ускорение:  {legacy_estimate / vector_time:8.1f}x")
+
+    parallel, parallel_time = _timed(decode_shr_frame_parallel, df, args.workers, 0)
+    pd.testing.assert_frame_equal(parallel, decode_shr_frame(df))
+    print(f"Параллельно: {parallel_time:7.2f} c ({vector_time / parallel_time:.1f}x к колоночному)")
+
+
+if __name__ == '__main__':
+    main()
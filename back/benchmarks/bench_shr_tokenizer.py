@@ -0,0 +1,84 @@
+# bench_shr_tokenizer.py
+"""Микробенчмарк разбора пункта 18: сообщений в секунду.
+
+Запуск: python benchmarks/bench_shr_tokenizer.py --messages 200000
+Сравнивает исходный разбор (``prefix in text`` + ``split`` на каждый префикс
+и дополнительный поиск границы для OPR/) с однопроходным shr_tokenizer.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from shr_decoder import SHR_PREFIXES, _extract_shr
+from shr_tokenizer import tokenize_item18, first_word
+from shr_samples import make_shr
+
+
+def legacy_item18(shr_cell: str) -> dict:
+    """Исходный разбор из построчного decode_flight_plan_fields"""
+    result = {}
+    for prefix in SHR_PREFIXES:
+        if prefix in shr_cell:
+            value = shr_cell.split(prefix)[1].split(' ')[0].split(')')[0].split('/')[0]
+            result[prefix.strip('/')] = value.replace(',', '')
+
+            if prefix == 'OPR/':
+                next_prefix_positions = []
+                for p in SHR_PREFIXES:
+                    if p in shr_cell and shr_cell.find(p) > shr_cell.find(prefix):
+                        next_prefix_positions.append(shr_cell.find(p))
+                if next_prefix_positions:
+                    value = shr_cell[shr_cell.find(prefix) + len(prefix):min(next_prefix_positions)].strip()
+                else:
+                    value = shr_cell.split(prefix)[1].strip()
+                result['OPR'] = value
+    if 'RMK/' in shr_cell:
+        result['RMK'] = shr_cell.split('RMK/')[1].split(')')[0].strip().replace(',', '')
+    return result
+
+
+def tokenizer_item18(shr_cell: str) -> dict:
+    """Тот же набор полей через tokenize_item18"""
+    fields = tokenize_item18(shr_cell)
+    result = {}
+    for prefix in SHR_PREFIXES:
+        name = prefix.strip('/')
+        if name in fields:
+            result[name] = fields[name] if name == 'OPR' else first_word(fields[name])
+    if 'RMK' in fields:
+        result['RMK'] = fields['RMK'].replace(',', '')
+    return result
+
+
+def _rate(func, messages, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            func(message)
+        best = min(best, time.perf_counter() - started)
+    return len(messages) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    messages = [_extract_shr(make_shr(rng)) for _ in range(args.messages)]
+
+    legacy = _rate(legacy_item18, messages, args.repeat)
+    tokenizer = _rate(tokenizer_item18, messages, args.repeat)
+    print(f"Исходный разбор: {legacy:12,.0f} сообщений/с")
+    print(f"Токенизатор:     {tokenizer:12,.0f} сообщений/с")
+    print(f"Ускорение:       {tokenizer / legacy:12.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# shr_samples.py
+"""Генератор синтетических листов с сообщениями SHR/IDEP/IARR для бенчмарков"""
+import random
+import pandas as pd
+
+OPERATORS = [
+    'ГУ МЧС РОССИИ ПО\nСТАВРОПОЛЬСКОМУ КРАЮ',
+    'ООО АЭРОГЕО',
+    'ИВАНОВ ИВАН ИВАНОВИЧ',
+    'АО, НПП "ЗАЛА АЭРО"',
+]
+REMARKS = [
+    'WR655 В\nЗОНЕ ВИЗУАЛЬНОГО ПОЛЕТА СОГЛАСОВАНО С ЕС ОРВД',
+    'ПОЛЕТ БВС, ТЕЛ 89001234567',
+    'MR091 00:00 ПОСАДКА 24:00',
+    '',
+]
+CENTERS = ['Московский', 'Санкт-Петербургский', 'Ростовский', 'Красноярский', 'Новосибирский']
+
+
+def _coord(rng):
+    return f"{rng.randint(41, 70):02d}{rng.randint(0, 59):02d}N{rng.randint(20, 179):03d}{rng.randint(0, 59):02d}E"
+
+
+def make_shr(rng):
+    """Одно сообщение SHR со случайным набором полей пункта 18"""
+    point = _coord(rng)
+    dep_time = f"{rng.randint(0, 24):02d}{rng.choice([0, 15, 30, 45]):02d}"
+    fields = [
+        f"DEP/{point}",
+        f"DEST/{point if rng.random() < 0.7 else _coord(rng)}",
+        f"DOF/{rng.randint(1, 28):02d}{rng.randint(1, 12):02d}25",
+        f"OPR/{rng.choice(OPERATORS)}",
+        f"REG/{rng.choice(['0267J81', '0267J81 00Q7U04', 'RA-1234,5'])}",
+        f"STS/{rng.choice(['SAR', 'STATE'])}",
+        f"TYP/{rng.choice(['BLA', '1BLA', 'AER'])}",
+        f"EET/UUWV{rng.randint(0, 99):04d}",
+        f"ORGN/UUWWZDZX",
+        f"PER/{rng.choice(['A', 'B'])}",
+        f"DLE/{rng.choice(['MDP', 'WR'])}{rng.randint(0, 2400):04d}",
+    ]
+    rng.shuffle(fields)
+    fields = [f for f in fields if rng.random() < 0.85]
+    if rng.random() < 0.8:
+        fields.append(f"RMK/{rng.choice(REMARKS)}")
+    if rng.random() < 0.1:
+        fields.append(f"SID/{rng.randint(10**9, 10**10)}")
+    separator = rng.choice([' ', '\n'])
+    zone = rng.choice([
+        f"/ZONA R{rng.choice(['0,5', '5', '10'])} {point}/",
+        f"/ZONA {point} {_coord(rng)} {_coord(rng)}/",
+        '',
+    ])
+    times = rng.choice([
+        f"-ZZZZ{dep_time}",
+        f"-{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}",
+        "-00:00 ZZZZ0000",
+        "",
+    ])
+    return (f"(SHR-ZZZZZ\n{times}\n-M0000/M{rng.randint(1, 30):04d} {zone}\n-ZZZZ{dep_time}\n-"
+            + separator.join(fields) + ")")
+
+
+def make_sheet(n_rows, seed=0):
+    """Лист в формате исходной выгрузки: центр ЕС ОРВД, SHR, DEP (IDEP), ARR (IARR)"""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n_rows):
+        shr = make_shr(rng) if rng.random() < 0.95 else rng.choice([None, '(SHR-)', 'нет данных'])
+        dep = None
+        if rng.random() < 0.6:
+            dep = f"-TITLE IDEP\n-SID 7772251137\n-ADD 250201\n-ATD {rng.randint(0, 24):02d}{rng.randint(0, 59):02d}"
+        arr = None
+        if rng.random() < 0.6:
+            arr = f"-TITLE IARR\n-SID 7772251137\n-ADA 250201\n-ATA {rng.randint(0, 24):02d}{rng.randint(0, 59):02d}"
+        rows.append({
+            'tsentr_es_orvd': rng.choice(CENTERS),
+            'shr': shr,
+            'dep': dep,
+            'arr': arr,
+            'n': rng.randint(0, 1000),
+        })
+    return pd.DataFrame(rows)
@@ -3,8 +3,9 @@ import pandas as pd
 from dotenv import load_dotenv
 from config.database import DatabaseConfig
 from back.app.excel_parser import ExcelParser
-from back.app.data_processor import DataProcessor
+from back.app.data_processor import DataProcessor, LOAD_MODE, SOURCE_SHEET_COLUMN
 from back.app.postgres_loader import PostgresLoader
+from back.app.sheet_pipeline import run_sheet_pipeline, resolve_workers
 
 def main():
     """Основная функция с автоматическим выбором режима обработки"""
@@ -48,7 +49,7 @@ def main_standard(db_connection_string):
         print("=" * 60)
         print("СТАНДАРТНАЯ ОБРАБОТКА EXCEL В POSTGRESQL")
         print("=" * 60)
-        print(f"РЕЖИМ: Загрузка в таблицу {table_name} с уникальными ID")
+        print(f"РЕЖИМ: Загрузка в таблицу {table_name} с уникальными ID ({LOAD_MODE})")
 
         # Получаем список всех страниц
         print("\n1. Получение списка страниц Excel...")
@@ -56,46 +57,47 @@ def main_standard(db_connection_string):
         print(f"Найдено страниц: {len(sheet_names)}")
         print(f"Названия страниц: {sheet_names}")
 
-        # Читаем все страницы
-        print("\n3. Чтение всех страниц...")
-        all_sheets_data = excel_parser.read_all_excel_sheets()
+        # Читаем, очищаем и дешифруем страницы (параллельно при SHEET_WORKERS > 1)
+        workers = resolve_workers(None, len(sheet_names))
+        print(f"\n3. Обработка страниц в {workers} процессах...")
+        excel_parser.close()
+        pipeline = run_sheet_pipeline(
+            excel_parser.excel_file_path,
+            sheet_names,
+            workers=workers,
+            source_column=SOURCE_SHEET_COLUMN  # колонка с названием страницы для идентификации
+        )
 
-        # Объединяем все страницы в одну таблицу
         print("\n4. Объединение всех страниц в одну таблицу...")
-        combined_df_list = []
-
-        for sheet_name, df in all_sheets_data.items():
-            if df.empty:
+        for sheet_name, timings in pipeline['sheets'].items():
+            if not timings['rows']:
                 print(f"  Страница '{sheet_name}': ПУСТАЯ - пропускаем")
                 continue
-                
-            print(f"  Обработка страницы '{sheet_name}': {df.shape[0]} строк, {df.shape[1]} колонок")
-
-            # Добавляем колонку с названием страницы для идентификации
-            df['source_sheet'] = sheet_name
-
-            # Очищаем DataFrame
-            df_cleaned = data_processor.clean_dataframe(df)
-            df_decoded = data_processor.decode_flight_plan_fields(df_cleaned)
-            
-            if not df_decoded.empty:
-                combined_df_list.append(df_decoded)
-                print(f"    Добавлено: {df_decoded.shape[0]} строк")
-            else:
-                print(f"    Предупреждение: Страница '{sheet_name}' пустая после обработки")
+            print(f"  Страница '{sheet_name}': {timings['rows']} строк "
+                  f"(чтение {timings['read_seconds']} c, очистка {timings.get('clean_seconds', 0)} c, "
+                  f"дешифровка {timings.get('decode_seconds', 0)} c)")
+        print(f"  Время обработки страниц: {pipeline['elapsed_seconds']} c")
 
         # Объединяем все DataFrame
-        if combined_df_list:
-            combined_df = pd.concat(combined_df_list, ignore_index=True, sort=False)
+        combined_df = pipeline['data']
+        if combined_df is not None:
             print(f"\nОбъединенная таблица: {combined_df.shape[0]} строк, {combined_df.shape[1]} колонок")
 
             # Загружаем в таблицу excel_data_result_1 с уникальными ID
             print(f"\n5. Загрузка данных в таблицу '{table_name}' с уникальными ID...")
             try:
-                result = data_processor.save_to_table_with_id(combined_df, table_name)
+                if LOAD_MODE == 'upsert':
+                    # Дописываем только строки, которых еще нет в таблице (по row_key)
+                    new_rows = data_processor.drop_loaded_rows(combined_df, table_name)
+                    result = data_processor.upsert_to_table(new_rows, table_name)
+                    result['total'] = len(combined_df)
+                else:
+                    result = data_processor.save_to_table_with_id(combined_df, table_name)
 
                 print(f"\nРЕЗУЛЬТАТ ЗАГРУЗКИ:")
                 print(f"Успешно загружено строк: {result['added']}")
+                if LOAD_MODE == 'upsert':
+                    print(f"Уже были в таблице: {result['total'] - result['added']}")
                 print(f"Всего обработано: {result['total']}")
 
                 # Проверка загрузки
@@ -3,6 +3,7 @@ from typing import Dict, List, Optional, Any, Union
 from datetime import datetime
 import pandas as pd
 import re
+from back.app.shr_tokenizer import tokenize_item18, first_word
 
 
 @dataclass
@@ -201,6 +202,30 @@ class AviationTemplateProcessor:
             
         return time_str if time_str else None
 
+    def enrich_from_other_info(self, template_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Дополнение полей FPL из пункта 18 (прочая информация)
+        
+        По правилам ИКАО при ZZZZ в основных полях тип ВС и аэродромы
+        указываются в TYP/, DEP/, DEST/ и ALTN/.
+        """
+        other_info = template_data.get('other_info')
+        if other_info is None or pd.isna(other_info):
+            return template_data
+        
+        item18 = tokenize_item18(str(other_info).strip().rstrip(')'))
+        indicator_fields = {
+            'aircraft_type': 'TYP',
+            'departure_aerodrome': 'DEP',
+            'destination_aerodrome': 'DEST',
+            'alternate_aerodromes': 'ALTN',
+        }
+        for template_field, indicator in indicator_fields.items():
+            current = template_data.get(template_field)
+            if indicator in item18 and (current is None or current == 'ZZZZ'):
+                template_data[template_field] = first_word(item18[indicator]) or None
+        
+        return template_data
+
     def apply_template(self, df: pd.DataFrame, message_type: Optional[str] = None) -> pd.DataFrame:
         """Применение шаблона к данным"""
         if message_type is None:
@@ -241,6 +266,9 @@ class AviationTemplateProcessor:
                     else:
                         template_data[template_field] = None
             
+            if message_type == 'FPL':
+                self.enrich_from_other_info(template_data)
+            
             processed_data.append(template_data)
         
         # Создаем новый DataFrame с стандартизированными данными
@@ -281,6 +309,8 @@ class AviationTemplateProcessor:
                     mapping['cruising_level'] = columns[i]
                 elif any(keyword in col for keyword in ['alternate']):
                     mapping['alternate_aerodromes'] = columns[i]
+                elif any(keyword in col for keyword in ['other_info', 'item18', 'shr', 'fpl']):
+                    mapping['other_info'] = columns[i]
         
         return mapping
 
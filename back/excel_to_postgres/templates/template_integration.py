@@ -8,6 +8,7 @@ from config.database import DatabaseConfig
 from back.app.excel_parser import ExcelParser
 from back.app.data_processor import DataProcessor
 from back.app.postgres_loader import PostgresLoader
+from back.app.sheet_pipeline import iter_prepared_sheets
 from templates.aviation_templates import AviationTemplateProcessor, create_aviation_table_name, get_aviation_table_schema
 
 load_dotenv()
@@ -28,8 +29,12 @@ class TemplateEnabledLoader:
         self.auto_detect_message_type = os.getenv('AUTO_DETECT_MESSAGE_TYPE', 'true').lower() == 'true'
         self.generate_reports = os.getenv('GENERATE_REPORTS', 'true').lower() == 'true'
         
-    def process_sheet_with_template(self, df: pd.DataFrame, sheet_name: str, message_type: Optional[str] = None) -> Dict[str, Any]:
-        """Обработка листа Excel с применением авиационного шаблона"""
+    def process_sheet_with_template(self, df: pd.DataFrame, sheet_name: str, message_type: Optional[str] = None,
+                                    cleaned: bool = False) -> Dict[str, Any]:
+        """Обработка листа Excel с применением авиационного шаблона
+
+        cleaned=True - df уже прошел стандартную очистку (параллельный конвейер листов)
+        """
         print(f"\n  Применение авиационного шаблона к листу '{sheet_name}'...")
         
         # Определяем тип сообщения
@@ -41,7 +46,7 @@ class TemplateEnabledLoader:
             print(f"    Используется тип сообщения по умолчанию: {message_type}")
         
         # Применяем стандартный процессинг (очистка колонок и данных)
-        df_cleaned = self.data_processor.clean_dataframe(df.copy())
+        df_cleaned = df if cleaned else self.data_processor.clean_dataframe(df.copy())
         
         if df_cleaned.empty:
             return {
@@ -182,29 +187,39 @@ class TemplateEnabledLoader:
                 self._process_standard_way()
                 return
             
-            # Читаем все листы
+            # Листы читаются и очищаются параллельно в процессах (SHEET_WORKERS),
+            # шаблоны применяются по мере готовности в порядке листов
             print(f"\nЧтение всех листов Excel...")
-            all_sheets_data = self.excel_parser.read_all_excel_sheets()
+            self.excel_parser.close()
+            prepared_sheets = iter_prepared_sheets(
+                self.excel_parser.excel_file_path, sheet_names, decode=False
+            )
             
             successful_loads = 0
             total_records = 0
             
-            for sheet_name, df in all_sheets_data.items():
+            for prepared in prepared_sheets:
+                sheet_name = prepared['sheet_name']
+                df = prepared['data']
+                timings = prepared['timings']
                 print(f"\n{'='*50}")
                 print(f"Обработка листа: '{sheet_name}'")
-                print(f"Исходные данные: {df.shape[0]} строк, {df.shape[1]} колонок")
+                print(f"Исходные данные: {timings['source_rows']} строк, "
+                      f"чтение {timings['read_seconds']} c, очистка {timings['clean_seconds']} c")
                 
                 if df.empty:
                     print(f"    Лист '{sheet_name}' пустой, пропускаем")
                     processing_reports['sheets'][sheet_name] = {
                         'success': False,
                         'message': 'Пустой лист',
-                        'processed_records': 0
+                        'processed_records': 0,
+                        'timings': timings
                     }
                     continue
                 
                 # Применяем авиационный шаблон
-                template_result = self.process_sheet_with_template(df, sheet_name)
+                template_result = self.process_sheet_with_template(df, sheet_name, cleaned=True)
+                template_result['timings'] = timings
                 
                 if not template_result['success']:
                     print(f"    {template_result['message']}")
@@ -232,7 +247,7 @@ class TemplateEnabledLoader:
             # Общая статистика
             print(f"\n{'='*70}")
             print(f"ИТОГОВАЯ СТАТИСТИКА:")
-            print(f"   Успешно обработано листов: {successful_loads}/{len(all_sheets_data)}")
+            print(f"   Успешно обработано листов: {successful_loads}/{len(sheet_names)}")
             print(f"   Общее количество загруженных записей: {total_records}")
             
             # Проверяем загруженные данные
@@ -312,12 +327,8 @@ class TemplateEnabledLoader:
     def preview_template_mapping(self, sheet_name: str, message_type: Optional[str] = None) -> Dict[str, Any]:
         """Предварительный просмотр маппинга шаблона"""
         try:
-            # Читаем только первые несколько строк для анализа
-            df_sample = pd.read_excel(
-                self.excel_parser.excel_file_path,
-                sheet_name=sheet_name,
-                nrows=5
-            )
+            # Читаем только первые несколько строк для анализа (книга берется из кэша ExcelParser)
+            df_sample = self.excel_parser.read_sheet_head(sheet_name, nrows=5)
             
             # Определяем тип сообщения
             if message_type is None:
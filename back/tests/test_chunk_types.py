@@ -0,0 +1,75 @@
+# test_chunk_types.py
+"""Типы колонок staging-таблицы при потоковой загрузке листа блоками.
+
+Запуск: python -m pytest back/tests
+"""
+import os
+import sys
+
+import openpyxl
+import pytest
+from sqlalchemy import types as sa_types
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from data_processor import DataProcessor
+from excel_parser import ExcelParser, release_workbook
+from pg_copy import _integer_columns, _to_csv
+
+
+@pytest.fixture
+def mixed_sheet(tmp_path):
+    """Лист, в котором колонка 'Количество' целая в первом блоке и дробная во втором"""
+    path = tmp_path / 'mixed.xlsx'
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Лист1'
+    worksheet.append(['Центр', 'Количество', 'Код'])
+    for i in range(4):
+        worksheet.append(['Московский', i + 1, i])
+    worksheet.append(['Ростовский', 2.5, 'A7'])
+    worksheet.append(['Ростовский', None, 9])
+    workbook.save(path)
+    yield str(path)
+    release_workbook(str(path))
+
+
+def _chunk_types(path, chunk_size):
+    parser = ExcelParser()
+    parser.excel_file_path = path
+    for chunk in parser.iter_sheet_chunks('Лист1', chunk_size):
+        df = DataProcessor.clean_dataframe(chunk)
+        yield df, DataProcessor.map_pandas_to_postgres_types(df)
+
+
+def test_later_chunk_widens_integer_column(mixed_sheet):
+    (first, first_types), (second, second_types) = _chunk_types(mixed_sheet, 4)
+    assert first_types['kolichestvo'] is sa_types.BigInteger
+    assert second_types['kolichestvo'] is sa_types.Float
+
+    widened = DataProcessor.widened_type(first_types['kolichestvo'](), second_types['kolichestvo'],
+                                         second['kolichestvo'])
+    assert widened is sa_types.Float
+    # Целые и текст во втором блоке: BIGINT -> TEXT
+    assert DataProcessor.widened_type(first_types['kod'](), second_types['kod'], second['kod']) is sa_types.Text
+
+
+def test_whole_valued_floats_keep_integer_column(mixed_sheet):
+    (first, first_types), = _chunk_types(mixed_sheet, 100)
+    chunk = first.iloc[:4].assign(kolichestvo=[1.0, 2.0, None, 4.0])
+    chunk_types = DataProcessor.map_pandas_to_postgres_types(chunk)
+    assert DataProcessor.widened_type(sa_types.BigInteger(), chunk_types['kolichestvo'],
+                                      chunk['kolichestvo']) is None
+
+    # COPY по типам таблицы: 2.0 пишется как 2, иначе BIGINT его не примет
+    table_types = {'kolichestvo': sa_types.BigInteger()}
+    csv = _to_csv(chunk[['kolichestvo']], _integer_columns(chunk, table_types)).getvalue()
+    assert csv.split() == ['1', '2', '\\N', '4']
+
+
+def test_object_column_type_uses_all_values(mixed_sheet):
+    (whole, whole_types), = _chunk_types(mixed_sheet, 100)
+    assert whole_types['kolichestvo'] is sa_types.Float
+    # Первое значение целое, но дальше есть строка - колонка текстовая
+    assert whole_types['kod'] is sa_types.Text
+    assert whole_types['tsentr'] is sa_types.Text
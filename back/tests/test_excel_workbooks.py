@@ -0,0 +1,73 @@
+# test_excel_workbooks.py
+"""Общий кэш открытых книг excel_parser: вытеснение книги, которую еще читают.
+
+Запуск: python -m pytest back/tests
+"""
+import os
+import sys
+
+import openpyxl
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import excel_parser
+from excel_parser import ExcelParser, release_workbook
+
+
+def _make_book(path, rows):
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Лист1'
+    worksheet.append(['Центр', 'Номер'])
+    for i in range(rows):
+        worksheet.append(['Московский', i])
+    workbook.save(path)
+    return str(path)
+
+
+def _parser(path):
+    parser = ExcelParser()
+    parser.excel_file_path = path
+    return parser
+
+
+def _is_closed(excel_file):
+    return excel_file.book._archive.fp is None
+
+
+@pytest.fixture
+def books(tmp_path):
+    paths = [_make_book(tmp_path / f'book{i}.xlsx', 10) for i in range(2)]
+    yield paths
+    for path in paths:
+        release_workbook(path)
+
+
+def test_released_workbook_stays_open_while_read(books):
+    chunks = _parser(books[0]).iter_sheet_chunks('Лист1', chunk_size=3)
+    first = next(chunks)
+    entry = next(iter(excel_parser._workbooks.values()))
+
+    release_workbook(books[0])
+    assert not _is_closed(entry.excel_file)
+
+    rest = list(chunks)
+    assert [len(chunk) for chunk in [first] + rest] == [3, 3, 3, 1]
+    assert rest[-1]['Номер'].tolist() == [9]
+    assert _is_closed(entry.excel_file)
+
+
+def test_lru_eviction_waits_for_readers(books, monkeypatch):
+    monkeypatch.setattr(excel_parser, 'EXCEL_WORKBOOK_CACHE_SIZE', 1)
+    chunks = _parser(books[0]).iter_sheet_chunks('Лист1', chunk_size=4)
+    next(chunks)
+    entry = next(iter(excel_parser._workbooks.values()))
+
+    # Вторая книга вытесняет первую из кэша, но первую еще читают
+    assert _parser(books[1]).get_sheet_names() == ['Лист1']
+    assert entry not in excel_parser._workbooks.values()
+    assert not _is_closed(entry.excel_file)
+
+    assert sum(len(chunk) for chunk in chunks) == 6
+    assert _is_closed(entry.excel_file)
@@ -0,0 +1,66 @@
+# test_http_compression.py
+"""Vary: Accept-Encoding у ответов CompressionMiddleware.
+
+Запуск: python -m pytest back/tests
+"""
+import asyncio
+import gzip
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import http_compression
+from http_compression import CompressionMiddleware
+
+
+def _app(body: bytes, content_type: bytes):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type)]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+def _request(app, accept_encoding=None):
+    """(заголовки ответа как dict, тело)"""
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": headers}
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+    return dict(messages[0]["headers"]), b"".join(m.get("body", b"") for m in messages[1:])
+
+
+@pytest.fixture
+def gzip_only(monkeypatch):
+    monkeypatch.setattr(http_compression, 'ENCODINGS', ['gzip'])
+
+
+@pytest.mark.parametrize("accept_encoding, body", [
+    ("gzip", b"[" + b"1," * 2000 + b"1]"),
+    ("gzip", b"[]"),
+    ("identity", b"[" + b"1," * 2000 + b"1]"),
+    (None, b"[" + b"1," * 2000 + b"1]"),
+], ids=["compressed", "below-threshold", "identity", "no-accept-encoding"])
+def test_json_responses_vary_on_accept_encoding(gzip_only, accept_encoding, body):
+    headers, content = _request(_app(body, b"application/json"), accept_encoding)
+    assert headers[b"vary"] == b"Accept-Encoding"
+    if b"content-encoding" in headers:
+        content = gzip.decompress(content)
+    assert content == body
+
+
+def test_binary_responses_are_untouched(gzip_only):
+    body = b"\x00" * 4096
+    headers, content = _request(_app(body, b"application/octet-stream"), "gzip")
+    assert b"vary" not in headers and b"content-encoding" not in headers
+    assert content == body